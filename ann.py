@@ -0,0 +1,109 @@
+# ann.py
+"""
+Corpus index types. Every type is wrapped in IndexIDMap2 so FAISS ids stay the
+content-addressed line ids.
+
+    flat      exact inner product (default; a linear scan, fine up to ~100k lines)
+    hnsw      HNSW graph; ANN_EF_SEARCH trades recall for latency
+    ivf_flat  inverted lists over k-means cells; ANN_NPROBE cells are scanned per query
+    ivf_pq    IVF + product-quantized codes; candidates re-ranked exactly from embeddings.npy
+    ivf_sq    IVF + 8-bit scalar quantization; candidates re-ranked exactly
+
+The type and its build parameters are recorded in the snapshot manifest
+("index_type", "index_params"); retrieval applies the search knobs when it loads a
+snapshot.
+"""
+import math
+import os
+from typing import Dict, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq")
+RERANKED_TYPES = ("ivf_pq", "ivf_sq")  # lossy codes: scores are recomputed from stored vectors
+
+ANN_INDEX_TYPE = os.environ.get("ANN_INDEX_TYPE", "flat")
+HNSW_M = int(os.environ.get("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "200"))
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 -> about 4 * sqrt(lines)
+PQ_M = int(os.environ.get("PQ_M", "16"))  # sub-quantizers; lowered to a divisor of dim
+TRAIN_SAMPLE = int(os.environ.get("ANN_TRAIN_SAMPLE", "200000"))  # vectors used to train IVF / PQ / SQ
+ADD_BLOCK_ROWS = 65536  # vectors may be memory-mapped: add them in blocks
+
+# search-time knobs, applied by retrieval to every loaded snapshot
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))
+ANN_EF_SEARCH = int(os.environ.get("ANN_EF_SEARCH", "64"))
+RERANK_FACTOR = int(os.environ.get("RERANK_FACTOR", "4"))  # candidates fetched per result before exact re-rank
+
+
+def index_kind(manifest: Dict) -> str:
+    """Index type of a snapshot; manifests written before index types existed are flat."""
+    kind = (manifest or {}).get("index_type")
+    return kind if kind in INDEX_TYPES else "flat"
+
+
+def default_params(kind: str, n: int, dim: int) -> Dict:
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"index type must be one of {INDEX_TYPES}, got {kind!r}")
+    if kind == "flat":
+        return {}
+    if kind == "hnsw":
+        return {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION}
+    # k-means wants ~39+ training points per cell
+    nlist = IVF_NLIST or int(4 * math.sqrt(n))
+    params = {"nlist": max(1, min(nlist, n // 39))}
+    if kind == "ivf_pq":
+        m = next(m for m in range(min(PQ_M, dim), 0, -1) if dim % m == 0)
+        params.update(m=m, nbits=max(1, min(8, int(math.log2(max(n, 2))))))
+    return params
+
+
+def _factory_string(kind: str, params: Dict) -> str:
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{params['M']}"
+    if kind == "ivf_flat":
+        return f"IVF{params['nlist']},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+    return f"IVF{params['nlist']},SQ8"
+
+
+def build_index(kind: str, vectors: np.ndarray, ids: np.ndarray, params: Dict = None) -> Tuple[faiss.Index, Dict]:
+    """
+    Build (train + add) an ID-mapped index of the given type over L2-normalized vectors
+    (an array or a read-only memmap). Returns (index, params actually used) for the manifest.
+    """
+    n, dim = vectors.shape
+    params = params or default_params(kind, n, dim)
+    inner = faiss.index_factory(dim, _factory_string(kind, params), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        inner.hnsw.efConstruction = params["efConstruction"]
+    if not inner.is_trained:
+        # k-means / quantizer training only needs a sample, not the whole (possibly memory-mapped) corpus
+        sample = slice(None)
+        if n > TRAIN_SAMPLE:
+            sample = np.sort(np.random.default_rng(0).choice(n, TRAIN_SAMPLE, replace=False))
+        inner.train(np.ascontiguousarray(vectors[sample], dtype="float32"))
+    index = faiss.IndexIDMap2(inner)
+    ids = np.asarray(ids, dtype="int64")
+    for i in range(0, n, ADD_BLOCK_ROWS):
+        index.add_with_ids(np.ascontiguousarray(vectors[i:i + ADD_BLOCK_ROWS], dtype="float32"), ids[i:i + ADD_BLOCK_ROWS])
+    configure(index)
+    return index, params
+
+
+def configure(index: faiss.Index, nprobe: int = None, ef_search: int = None):
+    """Apply nprobe / efSearch to an (ID-mapped) index; no-op for types without them."""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or ANN_NPROBE, ivf.nlist)
+    if hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = ef_search or ANN_EF_SEARCH
+
+
+def index_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
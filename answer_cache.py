@@ -0,0 +1,122 @@
+# answer_cache.py
+"""
+Semantic cache of verified answers, keyed by query embedding.
+
+Paraphrases of the same question land close together in embedding space, so a new
+query whose cosine similarity to a cached query is within CACHE_MAX_DISTANCE reuses
+that query's verified answer instead of calling the LLM twice. Entries live in a
+small FAISS IndexIDMap2 next to the main index, with LRU + TTL eviction, and the
+whole cache is dropped whenever the corpus is re-ingested.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+from storage import corpus_version
+from telemetry import get_logger
+
+log = get_logger("answer_cache")
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "86400"))
+CACHE_MAX_DISTANCE = float(os.environ.get("CACHE_MAX_DISTANCE", "0.08"))  # 1 - cosine similarity
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 max_distance: float = CACHE_MAX_DISTANCE):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._index = None              # built on first put, once the dim is known
+        self._entries = OrderedDict()   # id -> (created_ts, payload); order = LRU, oldest first
+        self._next_id = 0
+        self._version = corpus_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        """Drop everything if the corpus was re-ingested since the cache was filled."""
+        current = corpus_version()
+        if current != self._version:
+            if self._entries:
+                log.info(f"corpus changed ({self._version} -> {current}); dropping {len(self._entries)} entries")
+            self._clear()
+            self._version = current
+            self.invalidations += 1
+
+    def _clear(self):
+        self._entries.clear()
+        if self._index is not None:
+            self._index.reset()
+
+    def _remove(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array([entry_id], dtype="int64"))
+
+    def get(self, q_emb: np.ndarray) -> Optional[Dict]:
+        """
+        Return the cached payload for the nearest cached query if it is close enough
+        and not expired, else None. q_emb: L2-normalized (1, dim) float32.
+        """
+        with self._lock:
+            self._check_version()
+            if not self._entries:
+                self.misses += 1
+                return None
+            D, I = self._index.search(q_emb, 1)
+            entry_id, sim = int(I[0][0]), float(D[0][0])
+            if entry_id < 0 or 1.0 - sim > self.max_distance:
+                self.misses += 1
+                return None
+            created, payload = self._entries[entry_id]
+            if time.time() - created > self.ttl_seconds:
+                self._remove(entry_id)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return payload
+
+    def put(self, q_emb: np.ndarray, payload: Dict):
+        with self._lock:
+            self._check_version()
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(q_emb.shape[1]))
+            # a paraphrase of an existing entry replaces it rather than adding a twin
+            if self._entries:
+                D, I = self._index.search(q_emb, 1)
+                if int(I[0][0]) >= 0 and 1.0 - float(D[0][0]) <= self.max_distance:
+                    self._remove(int(I[0][0]))
+            while len(self._entries) >= self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(q_emb, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (time.time(), payload)
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0, "evictions": self.evictions,
+                "invalidations": self.invalidations, "max_entries": self.max_entries}
+
+
+ANSWER_CACHE = AnswerCache()
@@ -0,0 +1,210 @@
+# batch.py
+"""
+Bulk question answering (ticket triage, pre-answering support forms).
+
+run_batch takes the questions a window at a time:
+  - greetings get the template reply; every other question of the window is encoded
+    in one batch and searched with one index search (retrieval.search_many)
+  - identical questions (after normalizing case, spacing and punctuation) and
+    near-identical ones (cosine >= BATCH_DEDUP_SIM) are answered once; the copies
+    carry duplicate_of = index of the first occurrence
+  - cache / OOD / precomputed fast paths apply as in /chat; the rest generate and
+    verify on a pool of BATCH_CONCURRENCY threads
+Results come back in input order. Used by POST /chat/batch (NDJSON) and the CLI,
+which resumes from a checkpoint after an interruption:
+
+    python batch.py support/forms --output triage.ndjson
+    python batch.py questions.jsonl --output answers.ndjson --concurrency 4
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+import faiss
+import numpy as np
+
+from answer_cache import ANSWER_CACHE, CACHE_ENABLED
+from coalesce import normalize
+from context_packer import record_packing
+from generator import FALLBACK_TEXT, OLLAMA_MAX_CONCURRENCY, build_generation_prompt, run_ollama_mistral
+from retrieval import DEFAULT_THRESHOLD, DEFAULT_TOP_K, encode_texts, search_many
+from router import greeting_reply, precomputed_answer
+from telemetry import get_logger
+from verifier import verify_answer
+
+log = get_logger("batch")
+
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY)))  # generations in flight
+BATCH_WINDOW = int(os.environ.get("BATCH_WINDOW", "512"))  # questions encoded + searched per step
+BATCH_DEDUP_SIM = float(os.environ.get("BATCH_DEDUP_SIM", "0.95"))  # cosine at which two questions are one
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "10000"))  # per /chat/batch request
+
+def _sources(retrieved: List[Dict]) -> List[Dict]:
+    return [{k: r[k] for k in ("line_no", "score", "source") if k in r} for r in retrieved]
+
+
+def answer_one(query: str, q_emb: np.ndarray, retrieved: List[Dict], is_ood: bool, max_score: float) -> Dict:
+    """The /chat pipeline after retrieval, for one (representative) question; never raises."""
+    base = {"is_ood": False, "max_score": max_score, "sources": _sources(retrieved)}
+    cached = ANSWER_CACHE.get(q_emb) if CACHE_ENABLED else None
+    if cached is not None:
+        return {**base, "answer": cached["answer"], "verified": True, "route": "cache"}
+    if is_ood:
+        return {**base, "answer": FALLBACK_TEXT, "is_ood": True, "verified": False, "route": "ood"}
+    answer = precomputed_answer(retrieved, max_score)
+    if answer is not None:
+        return {**base, "answer": answer, "verified": True, "route": "precomputed"}
+    packing = {}
+    prompt = build_generation_prompt(query, retrieved, packing)
+    record_packing(packing)
+    try:
+        gen = run_ollama_mistral(prompt)
+        verified, final = verify_answer(query, retrieved, gen)
+    except Exception as e:
+        log.warning(f"query={query!r} failed: {e}")
+        return {**base, "answer": None, "verified": False, "route": "error", "error": str(e)}
+    if verified and CACHE_ENABLED:
+        ANSWER_CACHE.put(q_emb, {"answer": final, "is_ood": False, "retrieved": retrieved, "verified": True,
+                                 "max_score": max_score})
+    return {**base, "answer": final, "verified": verified, "route": "llm"}
+
+
+def _done(result: Dict) -> Future:
+    f = Future()
+    f.set_result(result)
+    return f
+
+
+def run_batch(items: Iterable[Dict], top_k: int = DEFAULT_TOP_K, threshold: float = DEFAULT_THRESHOLD,
+              concurrency: int = BATCH_CONCURRENCY, start: int = 0) -> Iterator[Dict]:
+    """
+    items: [{"id": ..., "query": ...}]. Yields one result per item from index start on,
+    in input order: {index, id, query, answer, route, verified, is_ood, max_score,
+    sources, duplicate_of}. Closing the iterator cancels generations not yet started.
+    """
+    items = list(items)
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch-llm")
+    first_by_text = {}             # normalized question -> index of its first occurrence
+    reps, rep_index = None, []     # embeddings of answered questions (FAISS ids = positions in rep_index)
+    futures = {}                   # representative index -> Future of its result
+    try:
+        for w0 in range(start, len(items), BATCH_WINDOW):
+            window = range(w0, min(w0 + BATCH_WINDOW, len(items)))
+            owner, todo = {}, []
+            for i in window:
+                query = items[i]["query"]
+                reply = greeting_reply(query)
+                if reply is not None:
+                    futures[i] = _done({"answer": reply, "verified": True, "is_ood": False, "max_score": 0.0,
+                                        "sources": [], "route": "greeting"})
+                    owner[i] = i
+                    continue
+                key = normalize(query)
+                if key in first_by_text:
+                    owner[i] = first_by_text[key]
+                else:
+                    first_by_text[key] = owner[i] = i
+                    todo.append(i)
+            if todo:
+                Q = encode_texts([items[i]["query"] for i in todo])
+                if reps is None:
+                    reps = faiss.IndexFlatIP(Q.shape[1])
+                unique = []
+                for j, i in enumerate(todo):
+                    if reps.ntotal:
+                        D, I = reps.search(Q[j:j + 1], 1)
+                        if D[0][0] >= BATCH_DEDUP_SIM:
+                            owner[i] = rep_index[int(I[0][0])]
+                            continue
+                    reps.add(Q[j:j + 1])
+                    rep_index.append(i)
+                    unique.append(j)
+                hits = search_many([items[todo[j]]["query"] for j in unique], top_k, threshold, Q[unique])
+                for j, hit in zip(unique, hits):
+                    i = todo[j]
+                    futures[i] = pool.submit(answer_one, items[i]["query"], Q[j:j + 1], *hit)
+                log.info(f"window {w0}-{window[-1]}: {len(window)} questions, {len(unique)} to answer")
+            for i in window:
+                result = futures[owner[i]].result()
+                yield {"index": i, "id": items[i].get("id", i), "query": items[i]["query"], **result,
+                       "duplicate_of": owner[i] if owner[i] != i else None}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ----- CLI -----
+
+def load_items(path: str) -> List[Dict]:
+    """
+    Questions to run: a directory of support form JSON files (their "message"), a .jsonl
+    file of {"id", "query"} objects (or plain strings), a .json list, or a text file
+    with one question per line.
+    """
+    p = Path(path)
+    if p.is_dir():
+        items = []
+        for f in sorted(p.glob("*.json")):
+            form = json.loads(f.read_text(encoding="utf-8"))
+            items.append({"id": f.stem, "query": form.get("message") or form.get("query", "")})
+    elif p.suffix in (".jsonl", ".json"):
+        text = p.read_text(encoding="utf-8")
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()] if p.suffix == ".jsonl" else json.loads(text)
+        items = [{"id": i, "query": r} if isinstance(r, str) else {"id": r.get("id", i), "query": r.get("query") or r.get("message", "")}
+                 for i, r in enumerate(rows)]
+    else:
+        lines = p.read_text(encoding="utf-8").splitlines()
+        items = [{"id": i, "query": line} for i, line in enumerate(lines)]
+    return [it for it in items if it["query"].strip()]
+
+
+def _fingerprint(items: List[Dict]) -> str:
+    h = hashlib.sha1()
+    for it in items:
+        h.update(f"{it['id']}\t{it['query']}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Answer many questions in bulk; results as NDJSON in input order")
+    ap.add_argument("input", help="support forms directory, .jsonl / .json / .txt file of questions")
+    ap.add_argument("--output", required=True, help="NDJSON results file (appended to when resuming)")
+    ap.add_argument("--checkpoint", help="checkpoint file (default: <output>.ckpt)")
+    ap.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    ap.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    ap.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = ap.parse_args()
+
+    items = load_items(args.input)
+    output = Path(args.output)
+    ckpt_path = Path(args.checkpoint or f"{args.output}.ckpt")
+    fingerprint = _fingerprint(items)
+    done, offset = 0, 0
+    if ckpt_path.exists() and not args.restart:
+        ckpt = json.loads(ckpt_path.read_text(encoding="utf-8"))
+        if ckpt.get("input") != fingerprint:
+            raise SystemExit(f"{ckpt_path} belongs to a different input; use --restart")
+        done, offset = ckpt["done"], ckpt["offset"]
+        log.info(f"resuming at question {done}/{len(items)}")
+
+    with open(output, "ab" if done else "wb") as out:
+        out.truncate(offset)  # drop a line written after the last checkpoint
+        counts = {}
+        for result in run_batch(items, args.top_k, args.threshold, args.concurrency, start=done):
+            out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+            out.flush()
+            done = result["index"] + 1
+            tmp = ckpt_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"input": fingerprint, "done": done, "offset": out.tell()}), encoding="utf-8")
+            os.replace(tmp, ckpt_path)
+            counts[result["route"]] = counts.get(result["route"], 0) + 1
+            counts["duplicates"] = counts.get("duplicates", 0) + (result["duplicate_of"] is not None)
+    log.info(f"{done}/{len(items)} questions answered -> {output}; this run: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# benchmarks: standalone performance scripts, run from the project root with `python -m benchmarks.<name>`
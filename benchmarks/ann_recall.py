@@ -0,0 +1,104 @@
+# benchmarks/ann_recall.py
+"""
+Recall@k against the exact flat index, p50/p99 single-query latency, build time and
+serialized index bytes for every ann.INDEX_TYPES entry.
+
+Vectors are synthetic (clustered, L2-normalized, like sentence embeddings) unless
+--from-storage is given, which uses the active snapshot's embeddings.npy. Queries
+are noisy copies of corpus vectors. Quantized types are scored after the same exact
+re-rank retrieval applies.
+
+    python -m benchmarks.ann_recall --n 200000 --queries 1000 --k 5 --json ann.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+import ann
+from storage import EMB_FILE, current_dir
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype("float32")
+    vecs = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def make_queries(vectors: np.ndarray, nq: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = vectors[rng.integers(0, len(vectors), nq)] + 0.3 * rng.standard_normal((nq, vectors.shape[1])).astype("float32")
+    q = q.astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def exact_rerank(vectors: np.ndarray, q: np.ndarray, cand: np.ndarray, k: int) -> np.ndarray:
+    cand = cand[cand >= 0]
+    return cand[np.argsort(-(vectors[cand] @ q))[:k]]
+
+
+def run(kind: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int,
+        nprobe: int, ef_search: int) -> dict:
+    ids = np.arange(len(vectors), dtype="int64")
+    t0 = time.perf_counter()
+    index, params = ann.build_index(kind, vectors, ids)
+    build_s = time.perf_counter() - t0
+    ann.configure(index, nprobe=nprobe, ef_search=ef_search)
+    rerank = kind in ann.RERANKED_TYPES
+    fetch = k * ann.RERANK_FACTOR if rerank else k
+
+    latencies, hits = [], 0
+    for q, true_ids in zip(queries, truth):
+        t0 = time.perf_counter()
+        _, I = index.search(q[None, :], fetch)
+        found = exact_rerank(vectors, q, I[0], k) if rerank else I[0]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(found.tolist()) & set(true_ids.tolist()))
+    lat = np.array(latencies)
+    return {"index_type": kind, "params": params, f"recall@{k}": round(hits / truth.size, 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 3), "p99_ms": round(float(np.percentile(lat, 99)), 3),
+            "build_s": round(build_s, 3), "index_bytes": ann.index_bytes(index)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ANN index types: recall vs latency vs size")
+    ap.add_argument("--n", type=int, default=100000, help="synthetic corpus size")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--from-storage", action="store_true", help="use the active snapshot's embeddings instead")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--types", nargs="+", choices=ann.INDEX_TYPES, default=list(ann.INDEX_TYPES))
+    ap.add_argument("--nprobe", type=int, default=ann.ANN_NPROBE)
+    ap.add_argument("--ef-search", type=int, default=ann.ANN_EF_SEARCH)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    if args.from_storage:
+        vectors = np.ascontiguousarray(np.load(str(current_dir() / EMB_FILE)), dtype="float32")
+    else:
+        vectors = synthetic_vectors(args.n, args.dim)
+    queries = make_queries(vectors, args.queries)
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    truth = exact.search(queries, args.k)[1]
+
+    print(f"{len(vectors)} vectors, dim={vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'type':>9} {'recall':>7} {'p50_ms':>8} {'p99_ms':>8} {'build_s':>8} {'MB':>8}")
+    results = []
+    for kind in args.types:
+        r = run(kind, vectors, queries, truth, args.k, args.nprobe, args.ef_search)
+        results.append(r)
+        print(f"{kind:>9} {r[f'recall@{args.k}']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8} {r['build_s']:>8} "
+              f"{r['index_bytes'] / 1e6:>8.2f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
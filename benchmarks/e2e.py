@@ -0,0 +1,263 @@
+# benchmarks/e2e.py
+"""
+End-to-end benchmark of the FastAPI APP against a deterministic Ollama stand-in
+(ollama_stub.py) generating at a configurable token rate.
+
+Drives /chat (or /chat/stream) with a seeded query mix (corpus questions, keyword
+lookups, repeats that hit the answer cache, greetings, off-topic questions) at each
+concurrency level, either in-process through httpx's ASGI transport or over real
+HTTP (an in-thread uvicorn server, or --url for a running deployment). Reports
+end-to-end and per-stage (encode, search, prompt, generate, verify) p50/p95/p99 from
+the response "timings", requests/sec, 503 rejections, the route mix and process
+memory, and writes it all as JSON; --compare prints the change against an earlier file.
+
+    python -m benchmarks.e2e --requests 200 --concurrency 1 8 32 --tokens-per-sec 40 --json e2e.json
+    python -m benchmarks.e2e --transport http --compare e2e.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from ollama_stub import start_stub_server
+from telemetry import quiet_logs
+
+STAGES = ("lexical", "encode", "search", "prompt", "generate", "verify")
+DEFAULT_MIX = "natural=0.5,keyword=0.15,repeat=0.15,greeting=0.1,ood=0.1"
+GREETINGS = ["hi", "hello there!", "good morning", "hey assistant"]
+OFF_TOPIC = ["What's the weather in Paris tomorrow?", "Who won the football world cup in 2018?",
+             "How do I bake sourdough bread?", "Explain quantum entanglement simply",
+             "What is the capital of Australia?"]
+
+
+def build_mix(n: int, mix: str, seed: int):
+    """n (kind, query) pairs drawn with the given kind=weight mix; deterministic for a seed."""
+    from benchmarks.hybrid_retrieval import build_queries
+    weights = {k: float(v) for k, v in (part.split("=") for part in mix.split(","))}
+    with quiet_logs():
+        corpus = build_queries(10 ** 9)
+    rng = random.Random(seed)
+    kinds = rng.choices(list(weights), weights=list(weights.values()), k=n)
+    queries, asked = [], []
+    for kind in kinds:
+        if kind == "natural" or (kind == "repeat" and not asked):
+            q = rng.choice(corpus["natural"])[0]
+            asked.append(q)
+        elif kind == "repeat":
+            q = rng.choice(asked)
+        elif kind == "keyword":
+            q = rng.choice(corpus["keyword"])[0]
+        elif kind == "greeting":
+            q = rng.choice(GREETINGS)
+        elif kind == "ood":
+            q = rng.choice(OFF_TOPIC)
+        else:
+            raise ValueError(f"unknown query kind {kind!r}")
+        queries.append((kind, q))
+    return queries
+
+
+def _rss_mb():
+    """(current RSS, peak RSS) of this process in MB, where the platform exposes them."""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    except ImportError:
+        pass
+    return current and round(current, 1), peak and round(peak, 1)
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    arr = np.asarray(values, dtype=float)
+    return {"n": len(arr), "p50": round(float(np.percentile(arr, 50)), 3), "p95": round(float(np.percentile(arr, 95)), 3),
+            "p99": round(float(np.percentile(arr, 99)), 3), "mean": round(float(arr.mean()), 3)}
+
+
+async def _one(client: httpx.AsyncClient, endpoint: str, query: str) -> dict:
+    t0 = time.perf_counter()
+    out = {"status": None, "ttft_ms": None, "body": None}
+    if endpoint == "/chat/stream":
+        async with client.stream("POST", endpoint, json={"query": query}) as resp:
+            out["status"] = resp.status_code
+            event = None
+            async for line in resp.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    if event == "token" and out["ttft_ms"] is None:
+                        out["ttft_ms"] = (time.perf_counter() - t0) * 1000
+                    elif event == "done":
+                        out["body"] = json.loads(line[6:])
+    else:
+        resp = await client.post(endpoint, json={"query": query})
+        out["status"] = resp.status_code
+        if resp.status_code == 200:
+            out["body"] = resp.json()
+    out["latency_ms"] = (time.perf_counter() - t0) * 1000
+    return out
+
+
+async def drive(client: httpx.AsyncClient, endpoint: str, queries, concurrency: int):
+    pending = list(enumerate(queries))
+    results = [None] * len(queries)
+
+    async def worker():
+        while pending:
+            i, (_, query) = pending.pop(0)
+            try:
+                results[i] = await _one(client, endpoint, query)
+            except httpx.HTTPError as e:
+                results[i] = {"status": None, "error": str(e), "latency_ms": None, "ttft_ms": None, "body": None}
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - t0
+
+
+def summarize(results, elapsed: float, queries) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    stages = {s: _percentiles([r["body"]["timings"][f"{s}_ms"] for r in ok
+                               if r["body"] and f"{s}_ms" in r["body"].get("timings", {})]) for s in STAGES}
+    current, peak = _rss_mb()
+    return {"requests": len(results), "ok": len(ok), "rejected_503": sum(r["status"] == 503 for r in results),
+            "errors": sum(r["status"] not in (200, 503) for r in results), "seconds": round(elapsed, 3),
+            "rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": _percentiles([r["latency_ms"] for r in ok]),
+            "ttft_ms": _percentiles([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+            "stages_ms": {s: v for s, v in stages.items() if v},
+            "routes": dict(Counter(r["body"].get("route") for r in ok if r["body"])),
+            "query_kinds": dict(Counter(kind for kind, _ in queries)),
+            "rss_mb": current, "peak_rss_mb": peak}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def _client(transport: str, url: str = None):
+    """Yield (httpx.AsyncClient factory, description) for the chosen transport."""
+    if transport == "inprocess":
+        from main import APP
+        yield lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=APP), base_url="http://bench", timeout=300), "asgi"
+        return
+    server = None
+    if url is None:
+        import uvicorn
+        from main import APP
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(APP, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        url = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+    try:
+        yield lambda: httpx.AsyncClient(base_url=url, timeout=300, limits=limits), url
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base: dict, current: dict):
+    old = {(r["transport"], r["endpoint"], r["concurrency"]): r for r in base["runs"]}
+    print(f"\nvs {base['meta'].get('commit')}:")
+    for r in current["runs"]:
+        b = old.get((r["transport"], r["endpoint"], r["concurrency"]))
+        if not b or not b["latency_ms"] or not r["latency_ms"]:
+            continue
+        d_rps = (r["rps"] - b["rps"]) / b["rps"] * 100 if b["rps"] else 0.0
+        d_p95 = (r["latency_ms"]["p95"] - b["latency_ms"]["p95"]) / b["latency_ms"]["p95"] * 100
+        print(f"  {r['transport']:>9} {r['endpoint']:>12} c={r['concurrency']:<4} rps {d_rps:+6.1f}%  p95 {d_p95:+6.1f}%")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="End-to-end /chat benchmark with a stub LLM")
+    ap.add_argument("--transport", choices=("inprocess", "http"), default="inprocess")
+    ap.add_argument("--url", help="benchmark a running server instead of starting one (http transport)")
+    ap.add_argument("--endpoint", choices=("/chat", "/chat/stream"), default="/chat")
+    ap.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--tokens-per-sec", type=float, default=40.0, help="stub LLM generation speed (0 = instant)")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="query kind weights, e.g. " + DEFAULT_MIX)
+    ap.add_argument("--no-cache", action="store_true", help="disable the semantic answer cache")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="earlier results file to compare against")
+    ap.add_argument("--verbose", action="store_true", help="keep the service's console logging")
+    args = ap.parse_args()
+
+    stub, stub_url = start_stub_server(tokens_per_sec=args.tokens_per_sec)
+    os.environ["OLLAMA_URL"] = stub_url  # before generator is imported through main
+    quiet = contextlib.nullcontext if args.verbose else quiet_logs
+    runs = []
+    try:
+        with quiet():
+            import main as service
+            from retrieval import clear_query_cache
+            if args.no_cache:
+                service.CACHE_ENABLED = False
+            queries = build_mix(args.requests, args.mix, args.seed)
+        with _client(args.transport, args.url) as (make_client, target):
+            for conc in args.concurrency:
+                # every level starts cold so repeats hit the cache only within a level (in-process / local server)
+                service.ANSWER_CACHE.invalidate()
+                clear_query_cache()
+
+                async def run_level():
+                    async with make_client() as client:
+                        await _one(client, args.endpoint, "warm-up question about orders")
+                        return await drive(client, args.endpoint, queries, conc)
+                with quiet():
+                    results, elapsed = asyncio.run(run_level())
+                r = {"transport": args.transport, "endpoint": args.endpoint, "concurrency": conc, "target": target,
+                     **summarize(results, elapsed, queries)}
+                runs.append(r)
+                lat = r["latency_ms"] or {}
+                stages = "  ".join(f"{s}={v['p50']}" for s, v in r["stages_ms"].items())
+                print(f"c={conc:<4} rps={r['rps']:<8} p50={lat.get('p50')} p95={lat.get('p95')} p99={lat.get('p99')} "
+                      f"503={r['rejected_503']} err={r['errors']} rss={r['rss_mb']}MB | stage p50 ms: {stages}")
+    finally:
+        stub.shutdown()
+
+    report = {"meta": {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(), "args": vars(args)}, "runs": runs}
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
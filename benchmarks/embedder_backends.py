@@ -0,0 +1,133 @@
+# benchmarks/embedder_backends.py
+"""
+Embedding backends (embeddings.EMBED_BACKENDS) on the help document: model load time,
+single-query encode latency, corpus throughput, process memory and retrieval quality.
+
+Each backend runs in its own process so load time and RSS are its own (the onnx
+backend never imports torch). Quality compares every backend with the first one:
+mean cosine between their corpus vectors, hit@k (a query made from a line's words
+should retrieve that line) and overlap@k with the first backend's top-k.
+
+    python embeddings.py --export-onnx          # once, for the onnx backend
+    python -m benchmarks.embedder_backends --threads 4 --k 1 5 10 --json embedders.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+import embeddings
+from benchmarks.e2e import _percentiles, _rss_mb
+from benchmarks.retrieval_throughput import load_queries
+from telemetry import quiet_logs
+
+
+def measure(backend: str, doc: str, n_queries: int, threads: int, out: str) -> dict:
+    """Run in a fresh process: load the backend, time query + corpus encoding, save the vectors to out (.npz)."""
+    embeddings.EMBED_BACKEND = backend
+    embeddings.EMBED_THREADS = threads
+    rss_before, _ = _rss_mb()
+    t0 = time.perf_counter()
+    with quiet_logs():
+        model = embeddings.get_embedder()
+    load_s = time.perf_counter() - t0
+    if threads and backend == "torch":
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+    lines = [ln.strip() for ln in Path(doc).read_text(encoding="utf-8").splitlines() if ln.strip()]
+    queries = load_queries(doc, n_queries)
+    model.encode(queries[:8], convert_to_numpy=True)  # warm-up
+    latencies, Q = [], []
+    for q in queries:
+        t = time.perf_counter()
+        Q.append(model.encode([q], convert_to_numpy=True, batch_size=1)[0])
+        latencies.append((time.perf_counter() - t) * 1000)
+    t = time.perf_counter()
+    D = model.encode(lines, convert_to_numpy=True, batch_size=32)
+    corpus_s = time.perf_counter() - t
+    Q, D = np.asarray(Q, dtype="float32"), np.asarray(D, dtype="float32")
+    faiss.normalize_L2(Q)
+    faiss.normalize_L2(D)
+    np.savez(out, queries=Q, corpus=D)
+    rss, peak = _rss_mb()
+    return {"backend": backend, "embedder": embeddings.embedder_id(), "threads": threads or None, "load_s": round(load_s, 3),
+            "query_ms": _percentiles(latencies), "corpus_lines": len(lines),
+            "lines_per_sec": round(len(lines) / corpus_s, 1), "rss_mb": rss,
+            "model_rss_mb": rss and rss_before and round(rss - rss_before, 1), "peak_rss_mb": peak}
+
+
+def quality(results, vectors, ks):
+    """Per backend: cosine agreement with the first backend's corpus vectors, hit@k and overlap@k."""
+    ref = vectors[0]
+    kmax = max(ks)
+    ref_top = None
+    for r, v in zip(results, vectors):
+        index = faiss.IndexFlatIP(v["corpus"].shape[1])
+        index.add(v["corpus"])
+        _, top = index.search(v["queries"], kmax)
+        if ref_top is None:
+            ref_top = top
+        target = np.arange(len(top)) % len(v["corpus"])  # load_queries cycles through the lines
+        r["hit_at"] = {k: round(float(np.mean([t in row[:k] for t, row in zip(target, top)])), 4) for k in ks}
+        r["overlap_at"] = {k: round(float(np.mean([len(set(a[:k]) & set(b[:k])) / k for a, b in zip(top, ref_top)])), 4)
+                           for k in ks}
+        if v["corpus"].shape == ref["corpus"].shape:
+            r["cosine_vs_ref"] = round(float(np.mean(np.sum(v["corpus"] * ref["corpus"], axis=1))), 4)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare embedding backends: latency, throughput, memory, recall")
+    ap.add_argument("--doc", default="amazon_help_doc.txt")
+    ap.add_argument("--backends", nargs="+", default=["torch", "onnx"], help="first one is the reference")
+    ap.add_argument("--queries", type=int, default=256)
+    ap.add_argument("--threads", type=int, default=0, help="intra-op threads for every backend (0 = default)")
+    ap.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)  # internal: measure one backend, write to this .npz
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.backends[0], args.doc, args.queries, args.threads, args.worker)))
+        return
+
+    results, vectors = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            out = str(Path(tmp) / f"{backend}.npz")
+            proc = subprocess.run([sys.executable, "-m", "benchmarks.embedder_backends", "--worker", out,
+                                   "--backends", backend, "--doc", args.doc, "--queries", str(args.queries),
+                                   "--threads", str(args.threads)], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{backend}: failed\n{proc.stderr.strip()[-2000:]}", file=sys.stderr)
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            with np.load(out) as npz:
+                vectors.append({"queries": npz["queries"], "corpus": npz["corpus"]})
+    if not results:
+        raise SystemExit("no backend ran")
+    quality(results, vectors, args.k)
+
+    print(f"{'backend':<8} {'load_s':>7} {'q_p50_ms':>9} {'q_p95_ms':>9} {'lines/s':>9} {'rss_mb':>7} "
+          f"{'cos_ref':>8} " + " ".join(f"{f'hit@{k}':>7}" for k in args.k) + " "
+          + " ".join(f"{f'ovl@{k}':>7}" for k in args.k))
+    for r in results:
+        print(f"{r['backend']:<8} {r['load_s']:>7} {r['query_ms']['p50']:>9} {r['query_ms']['p95']:>9} "
+              f"{r['lines_per_sec']:>9} {str(r['rss_mb']):>7} {str(r.get('cosine_vs_ref', '-')):>8} "
+              + " ".join(f"{r['hit_at'][k]:>7}" for k in args.k) + " "
+              + " ".join(f"{r['overlap_at'][k]:>7}" for k in args.k))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# benchmarks/hybrid_retrieval.py
+"""
+Recall, latency and OOD rate of dense vs hybrid (dense + BM25, RRF) retrieval, and of
+hybrid with the lexical shortcut that skips query encoding on decisive keyword hits.
+
+Two query sets are derived from the active corpus, each with its source line as the
+expected hit:
+  keyword  - the line's two rarest terms ("crocs", "gift card" style lookups)
+  natural  - a slice of the line's wording (paraphrase-like questions)
+
+    python -m benchmarks.hybrid_retrieval --k 5 --json hybrid.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+import retrieval
+from lexical import tokenize
+from telemetry import quiet_logs
+
+MODES = {"dense": ("dense", False), "hybrid": ("hybrid", False), "hybrid+shortcut": ("hybrid", True)}
+
+
+def build_queries(n: int):
+    snap = retrieval.current_snapshot()
+    bm25 = snap.bm25
+    if bm25 is None:
+        raise SystemExit("active snapshot has no BM25 index; re-run ingest.py")
+    keyword, natural = [], []
+    for row in range(min(n, len(snap.lines))):
+        meta = snap.lines.row(row)
+        doc_id = int(meta["id"])
+        terms = sorted(set(tokenize(meta["text"])), key=lambda t: -bm25.idf[bm25.terms[t]])
+        if terms:
+            keyword.append((" ".join(terms[:2]), doc_id))
+        words = meta["text"].split()
+        natural.append((" ".join(words[5:14] or words), doc_id))
+    return {"keyword": keyword, "natural": natural}
+
+
+def run(queries, k: int, mode: str, shortcut: bool) -> dict:
+    retrieval.RETRIEVAL_MODE = mode
+    retrieval.LEXICAL_SHORTCUT = shortcut
+    retrieval.clear_query_cache()
+    before = retrieval.retrieval_stats()["lexical_shortcut"]
+    latencies, hits, rr, ood = [], 0, 0.0, 0
+    with quiet_logs():
+        for query, expected in queries:
+            t0 = time.perf_counter()
+            retrieved, is_ood, _ = retrieval.search(query, top_k=k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            ids = [r["idx"] for r in retrieved]
+            if expected in ids:
+                hits += 1
+                rr += 1.0 / (ids.index(expected) + 1)
+            ood += is_ood
+    lat = np.array(latencies)
+    n = len(queries)
+    return {"mode": mode + ("+shortcut" if shortcut else ""), f"recall@{k}": round(hits / n, 4),
+            "mrr": round(rr / n, 4), "ood_rate": round(ood / n, 4),
+            "shortcut_rate": round((retrieval.retrieval_stats()["lexical_shortcut"] - before) / n, 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 3), "p99_ms": round(float(np.percentile(lat, 99)), 3)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="dense vs hybrid retrieval: recall / latency / OOD")
+    ap.add_argument("--queries", type=int, default=1000, help="max corpus lines to derive queries from")
+    ap.add_argument("--k", type=int, default=retrieval.DEFAULT_TOP_K)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    retrieval.QUERY_LRU_SIZE = 0
+    sets = build_queries(args.queries)
+    retrieval.search("warm-up query")
+    results = []
+    print(f"{'set':>8} {'mode':>16} {'recall':>7} {'mrr':>7} {'ood':>6} {'shortcut':>9} {'p50_ms':>8} {'p99_ms':>8}")
+    for name, queries in sets.items():
+        for mode, shortcut in MODES.values():
+            r = {"set": name, **run(queries, args.k, mode, shortcut)}
+            results.append(r)
+            print(f"{name:>8} {r['mode']:>16} {r[f'recall@{args.k}']:>7} {r['mrr']:>7} {r['ood_rate']:>6} "
+                  f"{r['shortcut_rate']:>9} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
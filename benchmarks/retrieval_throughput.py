@@ -0,0 +1,63 @@
+# benchmarks/retrieval_throughput.py
+"""
+Queries/sec of retrieval.search at increasing caller concurrency, with and without
+micro-batching. Uses help-doc lines (first words) as queries; the exact-text query
+LRU is disabled so every call really encodes.
+
+    python -m benchmarks.retrieval_throughput --queries 512 --concurrency 1 8 32 128
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import retrieval
+from telemetry import quiet_logs
+
+
+def load_queries(path: str, n: int):
+    lines = [ln.strip() for ln in Path(path).read_text(encoding="utf-8").splitlines() if ln.strip()]
+    base = [" ".join(ln.split()[5:14]) for ln in lines]  # skip the "If you are on the homepage" prefix
+    return [base[i % len(base)] for i in range(n)]
+
+
+def run(queries, concurrency: int, batching: bool) -> dict:
+    retrieval.BATCHING_ENABLED = batching
+    retrieval.clear_query_cache()
+    before = retrieval._encode_batcher.stats()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, quiet_logs():
+        t0 = time.perf_counter()
+        list(pool.map(retrieval.search, queries))
+        elapsed = time.perf_counter() - t0
+    after = retrieval._encode_batcher.stats()
+    batches = after["batches"] - before["batches"]
+    return {"concurrency": concurrency, "batching": batching, "queries": len(queries),
+            "seconds": round(elapsed, 4), "qps": round(len(queries) / elapsed, 1),
+            "avg_batch": round((after["items"] - before["items"]) / batches, 2) if batches else 1.0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="retrieval.search throughput vs concurrency")
+    ap.add_argument("--doc", default="amazon_help_doc.txt")
+    ap.add_argument("--queries", type=int, default=512)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    retrieval.QUERY_LRU_SIZE = 0
+    queries = load_queries(args.doc, args.queries)
+    retrieval.search(queries[0])  # warm-up
+    results = []
+    print(f"{'conc':>5} {'batching':>9} {'qps':>9} {'avg_batch':>10}")
+    for conc in args.concurrency:
+        for batching in (False, True):
+            r = run(queries, conc, batching)
+            results.append(r)
+            print(f"{conc:>5} {str(batching):>9} {r['qps']:>9} {r['avg_batch']:>10}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
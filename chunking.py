@@ -0,0 +1,131 @@
+# chunking.py
+"""
+Streaming document reader + chunker for ingestion.
+
+Documents are read line by line (never whole), grouped into blocks (each non-empty
+line, or each blank-line separated paragraph) and blocks longer than the embedding
+model's window are split on sentence boundaries into chunks of at most
+CHUNK_MAX_TOKENS, with CHUNK_OVERLAP_TOKENS of trailing context repeated at the start
+of the next chunk. Every chunk keeps the source file and line span it came from.
+"""
+import os
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+CHUNK_UNITS = ("line", "paragraph")
+CHUNK_UNIT = os.environ.get("CHUNK_UNIT", "line")
+# MiniLM truncates at 256 word pieces; count_tokens undercounts word pieces a little, so leave headroom
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "160"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "32"))
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate: words and punctuation marks."""
+    return len(TOKEN_RE.findall(text))
+
+
+def read_lines(path) -> Iterator[Tuple[int, str]]:
+    """Yield (line_no, text) from a UTF-8 file, one line at a time (1-based line numbers)."""
+    with open(Path(path), "r", encoding="utf-8", errors="ignore") as f:
+        for line_no, line in enumerate(f, 1):
+            yield line_no, line.rstrip("\r\n")
+
+
+def iter_blocks(lines: Iterable[Tuple[int, str]], unit: str = CHUNK_UNIT) -> Iterator[Tuple[int, int, str]]:
+    """(line_start, line_end, text) per non-empty line, or per paragraph of consecutive non-empty lines."""
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"chunk unit must be one of {CHUNK_UNITS}, got {unit!r}")
+    start, end, parts = None, None, []
+    for line_no, text in lines:
+        text = text.strip()
+        if unit == "line":
+            if text:
+                yield line_no, line_no, text
+            continue
+        if text:
+            start = line_no if start is None else start
+            end = line_no
+            parts.append(text)
+        elif parts:
+            yield start, end, " ".join(parts)
+            start, parts = None, []
+    if parts:
+        yield start, end, " ".join(parts)
+
+
+def _word_windows(sentence: str, max_tokens: int, overlap: int, count: Callable[[str], int]) -> List[str]:
+    """Split one over-long sentence into overlapping word windows."""
+    words = sentence.split()
+    sizes = [count(w) for w in words]
+    pieces, i = [], 0
+    while i < len(words):
+        j, total = i, 0
+        while j < len(words) and (total + sizes[j] <= max_tokens or j == i):
+            total += sizes[j]
+            j += 1
+        pieces.append(" ".join(words[i:j]))
+        if j >= len(words):
+            break
+        # step back so the next window repeats about `overlap` tokens
+        back, k = 0, j
+        while k - 1 > i and back + sizes[k - 1] <= overlap:
+            k -= 1
+            back += sizes[k]
+        i = k
+    return pieces
+
+
+def split_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS,
+               count: Callable[[str], int] = count_tokens) -> List[str]:
+    """
+    Pack sentences into chunks of <= max_tokens, carrying up to overlap tokens of sentences forward.
+    A single word longer than max_tokens becomes a chunk of its own; blank text gives no chunks.
+    """
+    if not text.strip():
+        return []
+    if count(text) <= max_tokens:
+        return [text]
+    units = []
+    for sentence in SENTENCE_SPLIT_RE.split(text):
+        if not sentence.strip():
+            continue
+        if count(sentence) > max_tokens:
+            units.extend(_word_windows(sentence, max_tokens, overlap, count))
+        else:
+            units.append(sentence)
+    chunks, current, size = [], [], 0
+    for unit in units:
+        n = count(unit)
+        if current and size + n > max_tokens:
+            chunks.append(" ".join(current))
+            carry, carried = [], 0
+            for prev in reversed(current):
+                m = count(prev)
+                if carried + m > overlap or carried + m + n > max_tokens:
+                    break
+                carry.insert(0, prev)
+                carried += m
+            current, size = carry, carried
+        current.append(unit)
+        size += n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def iter_chunks(lines: Iterable[Tuple[int, str]], source: str = None, unit: str = CHUNK_UNIT,
+                max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS,
+                count: Callable[[str], int] = count_tokens) -> Iterator[Dict]:
+    """Stream {"text", "source", "line_start", "line_end"} chunks from (line_no, text) pairs."""
+    for start, end, text in iter_blocks(lines, unit):
+        for chunk in split_text(text, max_tokens, overlap, count):
+            yield {"text": chunk, "source": source, "line_start": start, "line_end": end}
+
+
+def chunk_file(path, unit: str = CHUNK_UNIT, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict]:
+    return iter_chunks(read_lines(path), source=Path(path).name, unit=unit, max_tokens=max_tokens, overlap=overlap)
@@ -0,0 +1,223 @@
+# coalesce.py
+"""
+Single-flight coalescing of identical in-flight chat requests.
+
+When a question spikes, many copies of it arrive within the same second. The first
+request for a normalized query (the leader) runs the pipeline; copies that arrive
+while it is still running (followers) share its outcome instead of searching,
+generating and verifying again:
+  - do():     followers await the leader's result, at most COALESCE_MAX_WAIT
+              seconds, then run the work themselves
+  - lead() / follow(): followers replay the leader's stream items from the start,
+              as they are produced
+A leader's exception (or error result) reaches every follower. A leader that is
+cancelled hands the work over: the first of its waiting followers runs it again and
+the others follow that one (at most once per request; after that it runs alone).
+A leader whose own request ends early (client gone, deadline passed) while followers
+still wait hands its running call to them instead (handoff): the call goes on under
+its deadline moved out to the latest follower's, and is cancelled when the last
+follower leaves. Coalescing is per process (one event loop).
+"""
+import asyncio
+import os
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Tuple
+
+from deadlines import Deadline, current as current_deadline
+from telemetry import get_logger
+
+log = get_logger("coalesce")
+
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "1") == "1"
+COALESCE_MAX_WAIT = float(os.environ.get("COALESCE_MAX_WAIT", "60"))  # seconds a follower waits for the leader
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(query: str) -> str:
+    """Case, spacing and punctuation folded: "Track my order?" and "track my  order" are one question."""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
+
+
+class LeaderAborted(Exception):
+    """The leader of a shared stream stopped before finishing (client gone, cancelled)."""
+
+
+class _Flight:
+    def __init__(self):
+        self.result = asyncio.get_running_loop().create_future()
+        self.items = []               # stream items produced so far
+        self.changed = asyncio.Event()
+        self.finished = False
+        self.error = None
+        self.followers = 0
+        self.deadline = None          # the leader's request deadline
+        self.waiting = []             # deadlines of the followers waiting on result
+        self.detached = None          # the call's deadline once handed off to the followers
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    def __init__(self, max_wait: float = COALESCE_MAX_WAIT, enabled: bool = COALESCE_ENABLED):
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self.takeovers = 0
+        self.handoffs = 0
+        self.errors_shared = 0
+        self.llm_calls_saved = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], _took_over: bool = False) -> Tuple[Any, bool]:
+        """Run fn() once per key among concurrent callers. Returns (result, shared) where shared = a follower's copy."""
+        flight = self._calls.get(key) if self.enabled else None
+        if flight is None:
+            self.takeovers += _took_over
+            return await self._lead_call(key, fn), False
+        self.followers += 1
+        flight.followers += 1
+        waiter = current_deadline()
+        flight.waiting.append(waiter)
+        if flight.detached is not None and waiter is not None:
+            flight.detached.extend(waiter.expires)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight.result), self.max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            log.warning(f"leader for {key!r} still running after {self.max_wait:g}s; running it separately")
+            return await fn(), False
+        except asyncio.CancelledError:
+            if not flight.result.cancelled() or asyncio.current_task().cancelling():
+                raise  # this follower itself was cancelled (possibly together with the leader)
+            if _took_over:  # the leader this follower took over from was cancelled too: stop coalescing
+                return await fn(), False
+            return await self.do(key, fn, _took_over=True)
+        except Exception:
+            self.errors_shared += 1
+            raise
+        finally:
+            flight.waiting.remove(waiter)
+            if flight.detached is not None and not flight.waiting and not flight.result.done():
+                log.info(f"last follower of {key!r} left; cancelling the handed-off call")
+                reason = waiter.reason if waiter is not None and waiter.cancelled else "disconnected"
+                flight.detached.cancel(reason)
+        return result, True
+
+    async def _lead_call(self, key: str, fn):
+        flight = _Flight()
+        flight.deadline = current_deadline()
+        if self.enabled:
+            self._calls[key] = flight
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.result.cancel()
+            raise
+        except BaseException as e:
+            flight.result.set_exception(e)
+            flight.result.exception()  # retrieved, even when nobody followed
+            raise
+        else:
+            flight.result.set_result(result)
+            return result
+        finally:
+            if flight.detached is not None:
+                flight.detached.disarm()
+            if self._calls.get(key) is flight:
+                del self._calls[key]
+
+    def handoff(self, key: str, deadline: Deadline) -> bool:
+        """
+        The request with this deadline, if it leads key's call, is done with it (client
+        gone, deadline passed). If followers still wait, keep the call running for them:
+        its deadline is moved out to the latest follower's and armed. Returns whether
+        the call was handed off.
+        """
+        flight = self._calls.get(key) if self.enabled else None
+        if flight is None or flight.deadline is not deadline:
+            return False
+        waiting = [d for d in flight.waiting if d is None or not d.cancelled]
+        if not waiting:
+            return False
+        expires = [d.expires for d in waiting if d is not None]
+        if expires:
+            deadline.extend(max(expires))
+        deadline.arm()
+        flight.detached = deadline
+        self.handoffs += 1
+        log.info(f"handing {key!r} over to {len(waiting)} waiting follower(s)")
+        return True
+
+    def streaming(self, key: str) -> bool:
+        return self.enabled and key in self._streams
+
+    def lead(self, key: str, items: AsyncIterator) -> AsyncIterator:
+        """Register key's shared stream now and return items, recorded for follow() as they are consumed."""
+        flight = _Flight()
+        if self.enabled:
+            self._streams[key] = flight
+        self.leaders += 1
+        return self._record(key, flight, items)
+
+    async def _record(self, key: str, flight: _Flight, items: AsyncIterator):
+        try:
+            async for item in items:
+                flight.items.append(item)
+                flight.notify()
+                yield item
+            flight.finished = True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            if not flight.finished and flight.error is None:  # closed early or cancelled
+                flight.error = LeaderAborted(f"shared stream for {key!r} stopped early")
+            flight.finished = True
+            flight.notify()
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def follow(self, key: str) -> AsyncIterator:
+        """Replay key's in-flight stream (see streaming) from its first item; raises the leader's error if it failed."""
+        flight = self._streams[key]
+        self.followers += 1
+        flight.followers += 1
+        return self._replay(key, flight)
+
+    async def _replay(self, key: str, flight: _Flight):
+        i = 0
+        while True:
+            changed = flight.changed
+            while i < len(flight.items):
+                yield flight.items[i]
+                i += 1
+            if flight.finished:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LeaderAborted(f"no progress on shared stream for {key!r} in {self.max_wait:g}s")
+        if flight.error is not None:
+            self.errors_shared += 1
+            raise flight.error
+
+    def record_saved(self, n: int = 1):
+        """A follower got an answer that the leader had to generate (and verify) with the LLM."""
+        self.llm_calls_saved += n
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "leaders": self.leaders, "followers": self.followers,
+                "timeouts": self.timeouts, "takeovers": self.takeovers, "handoffs": self.handoffs, "errors_shared": self.errors_shared,
+                "llm_calls_saved": self.llm_calls_saved, "in_flight": len(self._calls) + len(self._streams)}
+
+
+COALESCER = SingleFlight()
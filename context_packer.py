@@ -0,0 +1,101 @@
+# context_packer.py
+"""
+Chooses which retrieved lines go into the LLM prompt.
+
+Retrieval returns a fixed top_k, but prefill time on CPU grows with every context
+token. pack_context keeps the best lines only:
+  - score gap: walking the scores from the best down, the first drop of more than
+    PACK_SCORE_GAP sets a cutoff; lines below it, or below PACK_MIN_RELATIVE x the
+    best score, are cut (hybrid results are in fused order, so the cutoff is
+    computed on the sorted scores and applied per line)
+  - near duplicates: a line whose word set overlaps an already kept line by
+    PACK_DUP_JACCARD or more (overlapping chunks, repeated help text) is dropped
+  - budget: lines are added best first while they fit in CONTEXT_TOKEN_BUDGET
+The first-ranked line is always kept. Kept lines stay in retrieval order.
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+from chunking import count_tokens
+
+CONTEXT_PACKING = os.environ.get("CONTEXT_PACKING", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "400"))
+PACK_SCORE_GAP = float(os.environ.get("PACK_SCORE_GAP", "0.15"))
+PACK_MIN_RELATIVE = float(os.environ.get("PACK_MIN_RELATIVE", "0.5"))
+PACK_DUP_JACCARD = float(os.environ.get("PACK_DUP_JACCARD", "0.8"))
+
+WORD_RE = re.compile(r"\w+")
+
+_totals = {"requests": 0, "lines_in": 0, "lines_used": 0, "tokens_in": 0, "tokens_used": 0}
+_totals_lock = threading.Lock()
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(WORD_RE.findall(text.lower()))
+
+
+def _line_tokens(r: Dict) -> int:
+    return count_tokens(f"[{r['line_no']}] {r['text']}")
+
+
+def score_cutoff(scores: List[float]) -> float:
+    """Lowest score still kept: just above the first gap wider than PACK_SCORE_GAP, and the relative floor."""
+    ordered = sorted(scores, reverse=True)
+    cutoff = ordered[-1]
+    for hi, lo in zip(ordered, ordered[1:]):
+        if hi - lo > PACK_SCORE_GAP:
+            cutoff = hi
+            break
+    return max(cutoff, ordered[0] * PACK_MIN_RELATIVE) if ordered[0] > 0 else cutoff
+
+
+def pack_context(retrieved: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Dict], Dict]:
+    """
+    retrieved: lines best first (as returned by retrieval.search).
+    Returns (lines to put in the prompt, stats) where stats counts lines/tokens in and
+    used, tokens_saved, and lines dropped per reason (gap, duplicate, budget).
+    """
+    tokens = [_line_tokens(r) for r in retrieved]
+    stats = {"lines_in": len(retrieved), "tokens_in": sum(tokens), "dropped_gap": 0, "dropped_duplicate": 0,
+             "dropped_budget": 0}
+    if not CONTEXT_PACKING or not retrieved:
+        kept = list(retrieved)
+    else:
+        cutoff = score_cutoff([r["score"] for r in retrieved])
+        kept, kept_words, used = [], [], 0
+        for i, r in enumerate(retrieved):
+            if i and r["score"] < cutoff:
+                stats["dropped_gap"] += 1
+                continue
+            words = _words(r["text"])
+            if any(len(words & w) >= PACK_DUP_JACCARD * len(words | w) for w in kept_words):
+                stats["dropped_duplicate"] += 1
+                continue
+            if kept and used + tokens[i] > budget:
+                stats["dropped_budget"] += 1
+                continue
+            kept.append(r)
+            kept_words.append(words)
+            used += tokens[i]
+    stats["lines_used"] = len(kept)
+    stats["tokens_used"] = sum(_line_tokens(r) for r in kept)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_used"]
+    return kept, stats
+
+
+def record_packing(stats: Dict):
+    """Add one generation prompt's packing stats to the process totals (packer_stats)."""
+    with _totals_lock:
+        _totals["requests"] += 1
+        for key in ("lines_in", "lines_used", "tokens_in", "tokens_used"):
+            _totals[key] += stats[key]
+
+
+def packer_stats() -> Dict:
+    with _totals_lock:
+        stats = dict(_totals)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_used"]
+    stats["tokens_saved_rate"] = stats["tokens_saved"] / stats["tokens_in"] if stats["tokens_in"] else 0.0
+    return stats
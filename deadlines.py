@@ -0,0 +1,194 @@
+# deadlines.py
+"""
+Per-request deadlines and cancellation.
+
+Each chat request runs inside request_deadline(): a Deadline REQUEST_TIMEOUT seconds
+out, kept in a context variable so it follows the request into executor threads
+(workers.run_in copies the context) and down through retrieval, generation and
+verification:
+  - blocking code calls check() between steps and fails fast once the request is
+    cancelled
+  - code holding an external resource (an Ollama socket, an `ollama run` process)
+    registers a kill hook with on_cancel(); Deadline.cancel() runs the hooks from the
+    cancelling thread, so a blocked worker returns at once instead of finishing
+    work nobody will read
+The request's owner on the event loop cancels its Deadline: main when the client
+disconnects or the time runs out, or the timer started by Deadline.arm(). A deadline
+can be extended while it runs (a coalesced call handed over to its followers, see
+coalesce.py), so expiry is enforced by that cancel rather than by shortening the
+timeouts of individual calls.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from telemetry import get_logger
+
+log = get_logger("deadlines")
+
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "90"))  # seconds per chat request, end to end
+
+REASONS = ("disconnected", "deadline")
+_counts = {r: 0 for r in REASONS}
+_counts_lock = threading.Lock()
+
+
+class RequestCancelled(RuntimeError):
+    """The client went away; the request's remaining work was dropped."""
+
+
+class DeadlineExceeded(RequestCancelled):
+    """The request ran out of time (REQUEST_TIMEOUT)."""
+
+
+def error_for(reason: str) -> RequestCancelled:
+    if reason == "deadline":
+        return DeadlineExceeded("request deadline exceeded")
+    return RequestCancelled("client disconnected")
+
+
+class Deadline:
+    def __init__(self, seconds: float = None):
+        self.expires = time.monotonic() + (REQUEST_TIMEOUT if seconds is None else seconds)
+        self.reason = None  # one of REASONS once cancelled
+        self._hooks = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._counted = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def error(self) -> RequestCancelled:
+        return error_for(self.reason)
+
+    def check(self):
+        """Raise the cancellation error if the request was cancelled."""
+        if self.reason is not None:
+            raise self.error()
+
+    def record(self, reason: str):
+        """Count the request as cancelled for reason, once (also when its work is handed off, not killed)."""
+        with _counts_lock:
+            if not self._counted:
+                self._counted = True
+                _counts[reason] += 1
+
+    def cancel(self, reason: str):
+        """Mark the request cancelled (first reason wins) and run the registered kill hooks."""
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            hooks = list(self._hooks.values())
+            self._hooks.clear()
+        self.disarm()
+        self.record(reason)
+        log.info(f"request cancelled ({reason}); stopping {len(hooks)} running call(s)")
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                log.warning(f"cancel hook failed: {e}")
+
+    def extend(self, expires: float):
+        """Move the deadline out to expires (time.monotonic()); an armed timer follows it."""
+        self.expires = max(self.expires, expires)
+
+    def arm(self):
+        """Cancel with "deadline" once the deadline passes (a timer on the running event loop)."""
+        self.disarm()
+        self._timer = asyncio.get_running_loop().call_later(self.remaining(), self._expire)
+
+    def _expire(self):
+        self._timer = None
+        if self.remaining() > 0:  # extended meanwhile
+            self.arm()
+        else:
+            self.cancel("deadline")
+
+    def disarm(self):
+        """Stop the timer started by arm() (the request is over)."""
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    @contextmanager
+    def on_cancel(self, hook: Callable[[], None]):
+        """Run hook if the request is cancelled while inside the block (if it already was: run it and raise)."""
+        key = next(self._ids)
+        with self._lock:
+            cancelled = self.reason is not None
+            if not cancelled:
+                self._hooks[key] = hook
+        if cancelled:
+            hook()
+            raise self.error()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._hooks.pop(key, None)
+
+
+_CURRENT = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def request_deadline(seconds: float = None):
+    """Run the block as one request with a Deadline seconds out (default REQUEST_TIMEOUT)."""
+    deadline = Deadline(seconds)
+    token = _CURRENT.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _CURRENT.reset(token)
+
+
+def check():
+    deadline = _CURRENT.get()
+    if deadline is not None:
+        deadline.check()
+
+
+@contextmanager
+def on_cancel(hook: Callable[[], None]):
+    """Deadline.on_cancel for the current request; a no-op outside one."""
+    deadline = _CURRENT.get()
+    if deadline is None:
+        yield
+        return
+    with deadline.on_cancel(hook):
+        yield
+
+
+@contextmanager
+def reraise_cancelled():
+    """Inside: an error caused by the current request being cancelled (a killed process, a shut socket)
+    is raised as that RequestCancelled instead."""
+    try:
+        yield
+    except RequestCancelled:
+        raise
+    except Exception:
+        check()
+        raise
+
+
+def cancellation_stats() -> dict:
+    with _counts_lock:
+        return dict(_counts)
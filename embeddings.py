@@ -1,16 +1,204 @@
 # embeddings.py
-from sentence_transformers import SentenceTransformer
+"""
+Query/corpus embedders. get_embedder returns an object with the SentenceTransformer
+encode() interface, from one of two backends:
+  - torch: the SentenceTransformer model itself (MODEL_PATH)
+  - onnx:  the same model exported to ONNX Runtime with dynamic int8 quantization
+           (export_onnx / `python embeddings.py --export-onnx`), run with a fixed
+           thread budget (EMBED_THREADS) and without importing torch
+EMBED_BACKEND picks the default; a model_path that holds an ONNX export always loads
+with ONNX Runtime. embedder_id names the embedding space; ingest records it in the
+snapshot manifest and retrieval checks it against the serving index.
+"""
+import argparse
+import json
+import os
+import threading
 from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-DEFAULT_MODEL_PATH = r"C:\amrita_uni\Projects\BeyondChats\model"
+import numpy as np
 
-@lru_cache(maxsize=1)
-def get_embedder(model_path: str = DEFAULT_MODEL_PATH) -> SentenceTransformer:
+from telemetry import get_logger
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# MODEL_PATH: a local model directory or a hub name. Without it, the original local
+# copy is used when present, else MiniLM L6 v2 from the hub cache.
+LEGACY_MODEL_PATH = r"C:\amrita_uni\Projects\BeyondChats\model"
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH") or (
+    LEGACY_MODEL_PATH if Path(LEGACY_MODEL_PATH).exists() else "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")  # "torch" or "onnx"
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "models/onnx-int8")
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", "0"))  # ONNX Runtime intra-op threads; 0 = library default
+ONNX_CONFIG_FILE = "embedder.json"
+EMBED_BACKENDS = ("torch", "onnx")
+
+log = get_logger("embeddings")
+_load_lock = threading.Lock()
+
+
+class OnnxEmbedder:
+    """
+    encode()-compatible embedder over an export_onnx directory: tokenizers for the
+    tokenizer, ONNX Runtime for the transformer, pooling + normalization in NumPy.
+    """
+
+    def __init__(self, model_dir: str, threads: int = EMBED_THREADS):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("the onnx embedding backend needs onnxruntime and tokenizers "
+                              "(pip install onnxruntime tokenizers)") from e
+        model_dir = Path(model_dir)
+        self.config = json.loads((model_dir / ONNX_CONFIG_FILE).read_text(encoding="utf-8"))
+        self.model_id = self.config["id"]
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.inter_op_num_threads = 1
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_dir / self.config["file"]), opts,
+                                            providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **_) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.empty((len(texts), self.config["dim"]), dtype="float32")
+        order = np.argsort([len(t) for t in texts], kind="stable")  # similar lengths pad less
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            enc = self.tokenizer.encode_batch([texts[i] for i in rows])
+            mask = np.array([e.attention_mask for e in enc], dtype="int64")
+            feed = {"input_ids": np.array([e.ids for e in enc], dtype="int64"), "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.array([e.type_ids for e in enc], dtype="int64")
+            hidden = self.session.run(None, feed)[0]
+            if self.config["pooling"] == "cls":
+                vecs = hidden[:, 0]
+            else:
+                m = mask[..., None].astype("float32")
+                vecs = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+            if self.config["normalize"]:
+                vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+            out[rows] = vecs
+        return out[0] if single else out
+
+
+def _is_onnx(model_path: str) -> bool:
+    return (Path(model_path) / ONNX_CONFIG_FILE).exists()
+
+
+def _model_name(model_path: str) -> str:
+    return str(model_path).replace("\\", "/").rstrip("/").rsplit("/", 1)[-1]
+
+
+def _resolve(model_path: str = None) -> str:
+    if model_path is None:
+        model_path = ONNX_MODEL_DIR if EMBED_BACKEND == "onnx" else DEFAULT_MODEL_PATH
+    return str(Path(model_path)) if Path(model_path).exists() else model_path
+
+
+@lru_cache(maxsize=2)
+def _load(model_path: str):
+    if _is_onnx(model_path):
+        log.info(f"Loading ONNX embedder from: {model_path} (threads={EMBED_THREADS or 'default'})")
+        return OnnxEmbedder(model_path, EMBED_THREADS)
+    if EMBED_BACKEND == "onnx" and model_path == ONNX_MODEL_DIR:
+        raise FileNotFoundError(f"no ONNX export in {model_path}; run python embeddings.py --export-onnx")
+    # imported here: torch + sentence_transformers take seconds to import, which
+    # should not count against process start (see retrieval.warm_up)
+    from sentence_transformers import SentenceTransformer
+    log.info(f"Loading SentenceTransformer from: {model_path}")
+    return SentenceTransformer(model_path)
+
+
+def get_embedder(model_path: str = None) -> "SentenceTransformer":
+    """
+    Return a cached embedder for model_path (default: EMBED_BACKEND's model).
+    Concurrent first callers (warm-up and an early request) share one load.
+    """
+    model_path = _resolve(model_path)
+    with _load_lock:
+        return _load(model_path)
+
+
+def embedder_id(model_path: str = None) -> str:
+    """Name of the embedding space model_path produces, e.g. "torch:all-MiniLM-L6-v2" or "onnx-int8:all-MiniLM-L6-v2"."""
+    model_path = _resolve(model_path)
+    if _is_onnx(model_path):
+        return json.loads((Path(model_path) / ONNX_CONFIG_FILE).read_text(encoding="utf-8"))["id"]
+    return f"torch:{_model_name(model_path)}"
+
+
+def export_onnx(model_path: str = DEFAULT_MODEL_PATH, out_dir: str = ONNX_MODEL_DIR, quantize: bool = True,
+                opset: int = 14) -> dict:
     """
-    Return a cached SentenceTransformer instance loaded from model_path.
+    Export the SentenceTransformer at model_path to out_dir: the transformer as ONNX
+    (dynamic batch/sequence axes), int8 dynamically quantized weights unless quantize
+    is False, the fast tokenizer and embedder.json (pooling, normalization, id).
+    Needs torch, sentence_transformers and onnxruntime; serving then needs only the latter.
     """
-    model_path = str(Path(model_path))
-    print(f"[embeddings] Loading SentenceTransformer from: {model_path}")
-    model = SentenceTransformer(model_path)
-    return model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_path, device="cpu")
+    pooling = next((m for m in st if type(m).__name__ == "Pooling"), None)
+    pooling_mode = "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean"
+    normalize = any(type(m).__name__ == "Normalize" for m in st)
+    transformer = st[0].auto_model.eval()
+
+    class _Hidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+    sample = st.tokenizer(["warm-up"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    fp32 = out / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(_Hidden(transformer), tuple(sample[n] for n in names), str(fp32), input_names=names,
+                          output_names=["last_hidden_state"], opset_version=opset,
+                          dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names},
+                                        "last_hidden_state": {0: "batch", 1: "seq"}})
+    model_file = fp32.name
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32), str(out / "model.int8.onnx"), weight_type=QuantType.QInt8)
+        model_file = "model.int8.onnx"
+    st.tokenizer.save_pretrained(str(out))
+    config = {"id": f"onnx-{'int8' if quantize else 'fp32'}:{_model_name(model_path)}",
+              "source": str(model_path), "file": model_file, "dim": st.get_sentence_embedding_dimension(),
+              "max_seq_length": st.max_seq_length, "pooling": pooling_mode, "normalize": normalize,
+              "pad_id": st.tokenizer.pad_token_id, "pad_token": st.tokenizer.pad_token}
+    (out / ONNX_CONFIG_FILE).write_text(json.dumps(config, indent=1), encoding="utf-8")
+    log.info(f"exported {model_path} -> {out / model_file} ({config['id']})")
+    return config
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Embedding model utilities")
+    ap.add_argument("--export-onnx", action="store_true", help="export MODEL_PATH for the onnx backend")
+    ap.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    ap.add_argument("--out", default=ONNX_MODEL_DIR)
+    ap.add_argument("--no-quantize", action="store_true", help="keep fp32 weights")
+    args = ap.parse_args()
+    if args.export_onnx:
+        export_onnx(args.model, args.out, quantize=not args.no_quantize)
+    else:
+        log.info(f"backend={EMBED_BACKEND} embedder={embedder_id()}")
@@ -0,0 +1,345 @@
+# evaluate.py
+"""
+Offline evaluation of the active corpus snapshot.
+
+Retrieval: the whole query set is encoded in one batch and searched with one matrix
+search; recall / hit rate, MRR and nDCG at every k, and the OOD precision/recall curve
+over a sweep of thresholds, are computed from those arrays in a single pass.
+
+Faithfulness (--faithfulness): every in-domain query goes through prompt -> generate ->
+verify on a thread pool, with a token-bucket limit on LLM calls.
+
+Results are cached in storage/eval/<corpus version>.json, keyed by the embedding or
+LLM model and every setting that affects them; re-runs only compute what changed.
+
+    python evaluate.py --k 1 3 5 10 --mode dense hybrid
+    python evaluate.py --eval-set my_queries.jsonl --faithfulness --concurrency 4 --rate 2
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+import embeddings
+import retrieval
+from ann import ANN_EF_SEARCH, ANN_NPROBE, configure
+from generator import FALLBACK_TEXT, OLLAMA_MODEL, build_generation_prompt, run_ollama_mistral
+from storage import STORAGE_DIR, corpus_version
+from telemetry import get_logger
+from verifier import LOCAL_VERIFY_ENABLED, VERIFY_ACCEPT_SIM, VERIFY_REJECT_SIM, verify_answer
+
+log = get_logger("evaluate")
+
+EVAL_CACHE_DIR = Path(os.environ.get("EVAL_CACHE_DIR", str(STORAGE_DIR / "eval")))
+EVAL_MODES = ("dense", "hybrid")
+EVAL_CONCURRENCY = int(os.environ.get("EVAL_CONCURRENCY", "4"))
+EVAL_RATE = float(os.environ.get("EVAL_RATE", "2.0"))  # LLM calls per second across all runner threads
+
+# The notebook's keyword-labelled set plus off-topic questions that must fall back.
+# A line is relevant to a query when it contains the keyword (case-insensitive).
+DEFAULT_EVAL_SET = [
+    {"query": "track my orders", "keyword": "track"},
+    {"query": "search for Crocs", "keyword": "Crocs"},
+    {"query": "redeem gift card", "keyword": "gift card"},
+    {"query": "check prime membership", "keyword": "Prime"},
+    {"query": "return an item", "keyword": "Return or Replace"},
+    {"query": "list a new product", "keyword": "Add a Product"},
+    {"query": "manage inventory", "keyword": "Manage Inventory"},
+    {"query": "create a promotion", "keyword": "Promotions"},
+    {"query": "fulfillment by amazon", "keyword": "Fulfillment by Amazon"},
+    {"query": "contact seller support", "keyword": "Contact Seller"},
+    {"query": "What's the weather in Paris tomorrow?", "ood": True},
+    {"query": "Who won the football world cup in 2018?", "ood": True},
+    {"query": "How do I bake sourdough bread?", "ood": True},
+    {"query": "Explain quantum entanglement simply", "ood": True},
+    {"query": "What is the capital of Australia?", "ood": True},
+]
+
+
+def load_eval_set(path: str = None) -> List[Dict]:
+    """
+    JSONL, one query per line: {"query": ..., "keyword": str or [str]} or
+    {"query": ..., "line_nos": [...]} for in-domain queries, {"query": ..., "ood": true} otherwise.
+    """
+    if path is None:
+        return list(DEFAULT_EVAL_SET)
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def relevant_ids(snap: retrieval.Snapshot, items: List[Dict]) -> List[np.ndarray]:
+    """Doc ids relevant to each query, from one pass over the corpus lines."""
+    keywords = [[k.lower() for k in ([it["keyword"]] if isinstance(it.get("keyword"), str) else it.get("keyword", []))]
+                for it in items]
+    line_nos = [set(it.get("line_nos", [])) for it in items]
+    found = [[] for _ in items]
+    for row in range(len(snap.lines)):
+        meta = snap.lines.row(row)
+        text = meta["text"].lower()
+        for q, (kws, nos) in enumerate(zip(keywords, line_nos)):
+            if any(k in text for k in kws) or meta["line_no"] in nos:
+                found[q].append(int(meta["id"]))
+    return [np.array(ids, dtype="int64") for ids in found]
+
+
+def rank(snap: retrieval.Snapshot, queries: List[str], Q: np.ndarray, k: int, mode: str):
+    """
+    One matrix search for all queries -> (ids (n, k) padded with -1, max cosine (n,), BM25 strength (n,)).
+    Hybrid mode fuses each query's dense candidates with its BM25 ranking like retrieval.search.
+    """
+    hybrid = mode == "hybrid" and snap.bm25 is not None
+    D, I = retrieval.search_vectors(snap, Q, k * retrieval.FUSION_CANDIDATES if hybrid else k)
+    ids = np.full((len(queries), k), -1, dtype="int64")
+    max_score = np.zeros(len(queries), dtype="float32")
+    strength = np.zeros(len(queries), dtype="float32")
+    if not hybrid:
+        ids[:, :I.shape[1]] = I[:, :k]
+        max_score[:] = np.where(I[:, 0] >= 0, D[:, 0], 0.0)
+        return ids, max_score, strength
+    for j, query in enumerate(queries):
+        ranked, strength[j] = retrieval._fuse(snap, query, Q[j:j + 1], D[j], I[j], k)
+        ids[j, :len(ranked)] = [doc_id for doc_id, _ in ranked]
+        max_score[j] = max((score for _, score in ranked), default=0.0)
+    return ids, max_score, strength
+
+
+def ranking_metrics(ids: np.ndarray, relevant: List[np.ndarray], ks: List[int]) -> Dict:
+    """hit@k (the notebook's recall_at_k), recall@k, MRR@k and binary-gain nDCG@k, averaged over queries."""
+    if not len(ids):
+        return {}
+    rel = np.vstack([np.isin(row, r) for row, r in zip(ids, relevant)])  # (n, kmax) bool
+    n_rel = np.array([len(r) for r in relevant])
+    discounts = 1.0 / np.log2(np.arange(2, ids.shape[1] + 2))
+    ideal = np.cumsum(discounts)
+    found = rel.any(axis=1)
+    first = rel.argmax(axis=1)  # rank of the first relevant line (0 when there is none; masked by found)
+    out = {}
+    for k in ks:
+        top = rel[:, :k]
+        dcg = top @ discounts[:k]
+        idcg = ideal[np.minimum(n_rel, k) - 1]
+        out[f"hit@{k}"] = float(top.any(axis=1).mean())
+        out[f"recall@{k}"] = float((top.sum(axis=1) / n_rel).mean())
+        out[f"mrr@{k}"] = float(np.where(found & (first < k), 1.0 / (first + 1), 0.0).mean())
+        out[f"ndcg@{k}"] = float((dcg / idcg).mean())
+    return out
+
+
+def ood_curve(max_score: np.ndarray, strength: np.ndarray, is_ood: np.ndarray, thresholds: np.ndarray) -> Dict:
+    """
+    OOD detection at every threshold at once: a query falls back when max_score < t and it
+    has no strong keyword match (retrieval.LEXICAL_MIN_STRENGTH), as in retrieval.search.
+    """
+    pred = (max_score[None, :] < thresholds[:, None]) & (strength < retrieval.LEXICAL_MIN_STRENGTH)[None, :]
+    tp = (pred & is_ood).sum(axis=1)
+    flagged = pred.sum(axis=1)
+    precision = np.divide(tp, flagged, out=np.ones(len(thresholds)), where=flagged > 0)
+    recall = tp / max(int(is_ood.sum()), 1)
+    false_fallback = (pred & ~is_ood).sum(axis=1) / max(int((~is_ood).sum()), 1)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(thresholds)),
+                   where=(precision + recall) > 0)
+    best = int(np.argmax(f1))
+    return {"thresholds": thresholds.round(4).tolist(), "precision": precision.round(4).tolist(),
+            "recall": recall.round(4).tolist(), "false_fallback_rate": false_fallback.round(4).tolist(),
+            "f1": f1.round(4).tolist(), "best_threshold": float(thresholds[best]), "best_f1": float(f1[best])}
+
+
+class RateLimiter:
+    """Token bucket shared by the runner threads: at most rate calls per second, bursts of up to burst."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate, self.burst = rate, burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def _faithfulness_one(query: str, retrieved: List[Dict], limiter: RateLimiter) -> Dict:
+    t0 = time.perf_counter()
+    try:
+        limiter.wait()
+        gen = run_ollama_mistral(build_generation_prompt(query, retrieved))
+        limiter.wait()  # verification may call the LLM too
+        verified, final = verify_answer(query, retrieved, gen)
+    except Exception as e:
+        log.warning(f"query={query!r} generation failed: {e}")
+        return {"verified": False, "fallback": True, "error": str(e), "seconds": round(time.perf_counter() - t0, 3)}
+    return {"verified": verified, "fallback": final.strip() == FALLBACK_TEXT, "error": None,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+class EvalCache:
+    """storage/eval/<corpus version>.json: {"retrieval": {key: result}, "faithfulness": {key: record}}."""
+
+    def __init__(self, version: str, enabled: bool = True):
+        self.path = EVAL_CACHE_DIR / f"{version}.json"
+        self.enabled = enabled
+        self.data = {"retrieval": {}, "faithfulness": {}}
+        if enabled and self.path.exists():
+            self.data.update(json.loads(self.path.read_text(encoding="utf-8")))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(**parts) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def get(self, section: str, key: str):
+        return self.data[section].get(key) if self.enabled else None
+
+    def put(self, section: str, key: str, value):
+        with self._lock:
+            self.data[section][key] = value
+
+    def save(self):
+        if not self.enabled:
+            return
+        EVAL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def evaluate_retrieval(snap, items, relevant, Q, ks, modes, thresholds, cache: EvalCache, config: Dict) -> Dict:
+    queries = [it["query"] for it in items]
+    is_ood = np.array([bool(it.get("ood")) for it in items])
+    in_domain = np.flatnonzero(~is_ood & np.array([len(r) > 0 for r in relevant]))
+    results = {}
+    for mode in modes:
+        key = cache.key(kind="retrieval", mode=mode, ks=ks, thresholds=thresholds.tolist(), **config)
+        cached = cache.get("retrieval", key)
+        if cached is not None:
+            results[mode] = {**cached, "cached": True}
+            continue
+        t0 = time.perf_counter()
+        ids, max_score, strength = rank(snap, queries, Q, max(ks), mode)
+        result = {"queries": len(queries), "in_domain": len(in_domain), "ood": int(is_ood.sum()),
+                  **ranking_metrics(ids[in_domain], [relevant[i] for i in in_domain], ks),
+                  "ood_curve": ood_curve(max_score, strength, is_ood, thresholds),
+                  "seconds": round(time.perf_counter() - t0, 3)}
+        cache.put("retrieval", key, result)
+        results[mode] = {**result, "cached": False}
+    return results
+
+
+def evaluate_faithfulness(items, top_k: int, threshold: float, concurrency: int, rate: float, cache: EvalCache) -> Dict:
+    """
+    fallback / verified rates over in-domain queries; each (model, prompt) is generated once per corpus version.
+    The queries are encoded in one batch and retrieved with one index search (retrieval.search_many).
+    """
+    queries = [it["query"] for it in items if not it.get("ood")]
+    hits = retrieval.search_many(queries, top_k, threshold, retrieval.encode_texts(queries)) if queries else []
+    limiter = RateLimiter(rate)
+    records, todo = [None] * len(queries), []
+    for i, (query, (retrieved, is_ood, _)) in enumerate(zip(queries, hits)):
+        if is_ood:
+            records[i] = {"verified": False, "fallback": True, "error": None, "seconds": 0.0, "ood": True}
+            continue
+        key = cache.key(kind="faithfulness", model=OLLAMA_MODEL, prompt=build_generation_prompt(query, retrieved),
+                        verifier=[LOCAL_VERIFY_ENABLED, VERIFY_ACCEPT_SIM, VERIFY_REJECT_SIM, embeddings.embedder_id()])
+        records[i] = cache.get("faithfulness", key)
+        if records[i] is None:
+            todo.append((i, key, query, retrieved))
+
+    def run(job):
+        i, key, query, retrieved = job
+        records[i] = _faithfulness_one(query, retrieved, limiter)
+        if records[i]["error"] is None:
+            cache.put("faithfulness", key, records[i])
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="eval-llm") as pool:
+        list(pool.map(run, todo))
+    n = max(len(records), 1)
+    return {"queries": len(records), "generated": len(todo), "seconds": round(time.perf_counter() - t0, 3),
+            "fallback_rate": sum(r["fallback"] for r in records) / n,
+            "verified_rate": sum(bool(r["verified"]) for r in records) / n,
+            "errors": sum(r["error"] is not None for r in records), "model": OLLAMA_MODEL}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline retrieval / faithfulness evaluation of the active snapshot")
+    ap.add_argument("--eval-set", help="JSONL eval set (default: built-in keyword set + off-topic queries)")
+    ap.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    ap.add_argument("--mode", nargs="+", choices=EVAL_MODES, default=list(EVAL_MODES))
+    ap.add_argument("--thresholds", type=float, nargs=3, default=[0.0, 0.8, 0.02], metavar=("START", "STOP", "STEP"),
+                    help="OOD threshold sweep")
+    ap.add_argument("--nprobe", type=int, help="override ANN_NPROBE for IVF indexes")
+    ap.add_argument("--ef-search", type=int, help="override ANN_EF_SEARCH for HNSW indexes")
+    ap.add_argument("--faithfulness", action="store_true", help="also generate + verify answers (needs Ollama)")
+    ap.add_argument("--top-k", type=int, default=retrieval.DEFAULT_TOP_K, help="lines given to the LLM")
+    ap.add_argument("--threshold", type=float, default=retrieval.DEFAULT_THRESHOLD, help="OOD threshold for generation")
+    ap.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    ap.add_argument("--rate", type=float, default=EVAL_RATE, help="LLM calls per second (0 = unlimited)")
+    ap.add_argument("--no-cache", action="store_true", help="recompute everything and do not store results")
+    ap.add_argument("--json", help="write the report to this file")
+    args = ap.parse_args()
+
+    snap = retrieval.current_snapshot()
+    configure(snap.index, args.nprobe, args.ef_search)
+    version = snap.version if snap.version != "legacy" else "legacy-" + hashlib.sha1(corpus_version().encode()).hexdigest()[:12]
+    cache = EvalCache(version, enabled=not args.no_cache)
+    items = load_eval_set(args.eval_set)
+    start, stop, step = args.thresholds
+    thresholds = np.arange(start, stop + step / 2, step)
+    ks = sorted(set(args.k))
+
+    t0 = time.perf_counter()
+    relevant = relevant_ids(snap, items)
+    for it, r in zip(items, relevant):
+        if not it.get("ood") and not len(r):
+            log.warning(f"no relevant lines for {it['query']!r}; skipped in ranking metrics")
+    Q = retrieval.encode_texts([it["query"] for it in items])
+    # the query embedder can differ from the one the index was built with (e.g. EMBED_BACKEND=onnx)
+    config = {"model": snap.manifest.get("model"), "embedder": embeddings.embedder_id(),
+              "embed_backend": embeddings.EMBED_BACKEND, "index_type": snap.index_type, "nprobe": args.nprobe or ANN_NPROBE,
+              "ef_search": args.ef_search or ANN_EF_SEARCH, "fusion_candidates": retrieval.FUSION_CANDIDATES,
+              "rrf_k": retrieval.RRF_K, "lexical_min_strength": retrieval.LEXICAL_MIN_STRENGTH,
+              "eval_set": EvalCache.key(items=items)}
+    report = {"corpus_version": version, "config": config,
+              "retrieval": evaluate_retrieval(snap, items, relevant, Q, ks, args.mode, thresholds, cache, config)}
+    if args.faithfulness:
+        report["faithfulness"] = evaluate_faithfulness(items, args.top_k, args.threshold, args.concurrency, args.rate, cache)
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    cache.save()
+
+    print(f"corpus {version} ({len(snap.lines)} lines, {snap.index_type}), {len(items)} queries")
+    for mode, r in report["retrieval"].items():
+        metrics = "  ".join(f"{name}@{k}={r.get(f'{name}@{k}', float('nan')):.3f}"
+                            for k in ks for name in ("hit", "recall", "mrr", "ndcg"))
+        curve = r["ood_curve"]
+        i = int(np.argmin(np.abs(np.array(curve["thresholds"]) - retrieval.DEFAULT_THRESHOLD)))
+        print(f"[{mode}{' cached' if r['cached'] else ''}] {metrics}")
+        print(f"    OOD @ {curve['thresholds'][i]:.2f} (DEFAULT_THRESHOLD): precision={curve['precision'][i]:.3f} "
+              f"recall={curve['recall'][i]:.3f} false_fallback={curve['false_fallback_rate'][i]:.3f}; "
+              f"best F1 {curve['best_f1']:.3f} at threshold {curve['best_threshold']:.2f}")
+    if args.faithfulness:
+        f = report["faithfulness"]
+        print(f"[faithfulness {f['model']}] fallback_rate={f['fallback_rate']:.3f} verified_rate={f['verified_rate']:.3f} "
+              f"generated={f['generated']}/{f['queries']} errors={f['errors']} in {f['seconds']}s")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,355 @@
 # generator.py
+import codecs
+import http.client
+import json
+import os
+import queue
+import socket
 import subprocess
-from typing import List, Dict
+import threading
+import time
+from functools import lru_cache
+from typing import List, Dict, Iterator
+from urllib.parse import urlsplit
+
+import deadlines
+from context_packer import pack_context
+from telemetry import get_logger
+
+log = get_logger("generator")
+
+# Ollama HTTP API (preferred); the CLI below is kept as a fallback
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://127.0.0.1:11434")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "mistral")
+OLLAMA_BACKEND = os.environ.get("OLLAMA_BACKEND", "http")  # "http" or "subprocess"
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "4"))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "2"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_FALLBACK = os.environ.get("OLLAMA_FALLBACK", "1") == "1"
 
 # Ollama command (local)
-OLLAMA_CMD = ["ollama", "run", "mistral"]
+OLLAMA_CMD = ["ollama", "run", OLLAMA_MODEL]
 
 # Exact fallback text used across the app
 FALLBACK_TEXT = "Sorry, I cannot answer that from the provided document. Would you like to contact support?"
 
+
+class OllamaUnavailableError(RuntimeError):
+    """Raised when the Ollama HTTP server cannot be reached at all."""
+
+
+class SubprocessBackend:
+    """
+    Runs `ollama run <model>` once per prompt. Slow (one process spawn per call)
+    but has no dependency on the Ollama server being reachable over HTTP.
+    """
+    name = "subprocess"
+
+    def __init__(self, cmd: List[str] = None):
+        self.cmd = list(cmd or OLLAMA_CMD)
+
+    def generate(self, prompt: str, timeout: float = 60) -> str:
+        proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, encoding='utf-8')
+        try:
+            with deadlines.on_cancel(proc.kill):
+                out, err = proc.communicate(prompt, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"ollama timed out: {e}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"ollama error (code {proc.returncode}):\n{err}")
+        return out.strip()
+
+    def stream(self, prompt: str, timeout: float = 60) -> Iterator[str]:
+        """Yield stdout chunks as the CLI prints them; the process is killed after timeout or on cancel."""
+        proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        watchdog = threading.Timer(timeout, proc.kill)
+        watchdog.start()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        try:
+            with deadlines.on_cancel(proc.kill):
+                proc.stdin.write(prompt.encode("utf-8"))
+                proc.stdin.close()
+                while True:
+                    chunk = os.read(proc.stdout.fileno(), 256)
+                    if not chunk:
+                        break
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield text
+                proc.wait()
+            if not watchdog.is_alive():
+                raise RuntimeError(f"ollama timed out after {timeout}s")
+            if proc.returncode != 0:
+                raise RuntimeError(f"ollama error (code {proc.returncode}):\n{proc.stderr.read().decode('utf-8', errors='ignore')}")
+        finally:
+            watchdog.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+class HTTPBackend:
+    """
+    Long-lived client for Ollama's REST API (/api/generate).
+    Keeps a pool of keep-alive connections, caps concurrent generations with a
+    semaphore and retries requests that fail before the server answered.
+    """
+    name = "http"
+
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = OLLAMA_MODEL,
+                 max_concurrency: int = OLLAMA_MAX_CONCURRENCY, retries: int = OLLAMA_RETRIES,
+                 connect_timeout: float = OLLAMA_CONNECT_TIMEOUT, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 11434
+        self.model = model
+        self.retries = max(0, retries)
+        self.connect_timeout = connect_timeout
+        self.keep_alive = keep_alive
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def _connect(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+
+    def _release(self, conn: http.client.HTTPConnection, reusable: bool = True):
+        deadline = deadlines.current()
+        if reusable and not (deadline and deadline.cancelled):  # a cancelled request's socket may be shut
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def _acquire_slot(self, timeout: float):
+        """Wait for a generation slot, giving up early if the request is cancelled meanwhile."""
+        end = time.monotonic() + timeout
+        while not self._slots.acquire(timeout=min(0.25, max(0.0, end - time.monotonic()))):
+            deadlines.check()
+            if time.monotonic() >= end:
+                raise RuntimeError(f"ollama busy: no free slot within {timeout}s")
+
+    def _post(self, path: str, payload: Dict, timeout: float, conns: List = None):
+        """
+        Send a JSON POST and return (conn, response) once headers arrived.
+        Connection-level failures (refused, reset, stale keep-alive socket) are retried;
+        a read timeout is not, since the server may still be generating.
+        Every connection tried is appended to conns (for _shutdown on cancel).
+        """
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        last_err = None
+        for attempt in range(self.retries + 1):
+            deadlines.check()
+            conn = self._connect()
+            if conns is not None:
+                conns.append(conn)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                conn.sock.settimeout(timeout)
+                conn.request("POST", path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except socket.timeout as e:
+                conn.close()
+                raise RuntimeError(f"ollama timed out: {e}")
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                last_err = e
+                if attempt < self.retries:
+                    time.sleep(0.1 * (2 ** attempt))
+        raise OllamaUnavailableError(f"ollama unreachable at {self.host}:{self.port}: {last_err}")
+
+    def generate(self, prompt: str, timeout: float = 60) -> str:
+        self._acquire_slot(timeout)
+        conns = []
+        try:
+            payload = {"model": self.model, "prompt": prompt, "stream": False, "keep_alive": self.keep_alive}
+            with deadlines.on_cancel(lambda: _shutdown(conns)):
+                conn, resp = self._post("/api/generate", payload, timeout, conns)
+                try:
+                    data = resp.read()
+                except OSError as e:  # timed out, or shut by a cancel
+                    conn.close()
+                    raise RuntimeError(f"ollama timed out: {e}")
+            if resp.status != 200:
+                self._release(conn, reusable=not resp.will_close)
+                raise RuntimeError(f"ollama error (HTTP {resp.status}):\n{data.decode('utf-8', errors='ignore')}")
+            self._release(conn, reusable=not resp.will_close)
+            return json.loads(data).get("response", "").strip()
+        finally:
+            self._slots.release()
+
+    def stream(self, prompt: str, timeout: float = 60) -> Iterator[str]:
+        """
+        Yield response fragments from a streaming /api/generate call.
+        timeout bounds the wait for each fragment, not the whole generation;
+        cancelling the request (deadlines.py) closes the stream, which stops Ollama generating.
+        """
+        self._acquire_slot(timeout)
+        conn = None
+        conns = []
+        finished = False
+        try:
+            payload = {"model": self.model, "prompt": prompt, "stream": True, "keep_alive": self.keep_alive}
+            with deadlines.on_cancel(lambda: _shutdown(conns)):
+                conn, resp = self._post("/api/generate", payload, timeout, conns)
+                if resp.status != 200:
+                    raise RuntimeError(f"ollama error (HTTP {resp.status}):\n{resp.read().decode('utf-8', errors='ignore')}")
+                while True:
+                    try:
+                        line = resp.readline()
+                    except OSError as e:  # timed out, or shut by a cancel
+                        raise RuntimeError(f"ollama timed out: {e}")
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    part = json.loads(line)
+                    if part.get("error"):
+                        raise RuntimeError(f"ollama error: {part['error']}")
+                    if part.get("response"):
+                        yield part["response"]
+                    if part.get("done"):
+                        resp.read()  # drain the terminating chunk so the connection can be reused
+                        finished = True
+                        break
+        finally:
+            if conn is not None:
+                # an abandoned stream leaves unread bytes on the socket; never pool it
+                self._release(conn, reusable=finished and not resp.will_close)
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _shutdown(conns: List[http.client.HTTPConnection]):
+    """Cancel hook: shut the request's sockets so a blocked read returns now and Ollama drops the generation."""
+    for conn in conns:
+        sock = conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+@lru_cache(maxsize=1)
+def get_backend(kind: str = OLLAMA_BACKEND):
+    """
+    Return the process-wide generation backend ("http" or "subprocess").
+    """
+    log.info(f"using {kind} backend for model {OLLAMA_MODEL!r}")
+    if kind == "subprocess":
+        return SubprocessBackend()
+    return HTTPBackend()
+
+
 def run_ollama_mistral(prompt: str, timeout: int = 60) -> str:
     """
-    Run local Ollama Mistral and return stdout text.
-    Raises RuntimeError on non-zero exit or timeout.
+    Generate a completion for prompt with local Ollama Mistral and return the text.
+    Uses the pooled HTTP backend and falls back to `ollama run` when the server is unreachable.
+    timeout caps this call; the request's deadline (deadlines.py) stops it earlier by cancelling.
+    Raises RuntimeError on errors or timeout, RequestCancelled once the request is cancelled.
+    """
+    backend = get_backend()
+    with deadlines.reraise_cancelled():
+        try:
+            return backend.generate(prompt, timeout=timeout)
+        except OllamaUnavailableError as e:
+            if not OLLAMA_FALLBACK:
+                raise
+            log.warning(f"{e}; falling back to subprocess")
+            return SubprocessBackend().generate(prompt, timeout=timeout)
+
+
+def stream_ollama_mistral(prompt: str, timeout: int = 60) -> Iterator[str]:
+    """
+    Like run_ollama_mistral but yields text fragments as the model produces them.
+    Falls back to the CLI only if the server was unreachable before anything was yielded.
     """
-    try:
-        res = subprocess.run(OLLAMA_CMD, input=prompt, text=True, capture_output=True, encoding='utf-8', timeout=timeout)
-    except subprocess.TimeoutExpired as e:
-        raise RuntimeError(f"ollama timed out: {e}")
-    if res.returncode != 0:
-        raise RuntimeError(f"ollama error (code {res.returncode}):\n{res.stderr}")
-    return res.stdout.strip()
+    backend = get_backend()
+    with deadlines.reraise_cancelled():
+        try:
+            yield from backend.stream(prompt, timeout=timeout)
+        except OllamaUnavailableError as e:
+            if not OLLAMA_FALLBACK:
+                raise
+            log.warning(f"{e}; falling back to subprocess")
+            yield from SubprocessBackend().stream(prompt, timeout=timeout)
+
+GREETINGS = ["hello", "hi", "greetings", "good morning",
+             "good afternoon", "good evening", "hey",
+             "how are you doing","yo","are you fine", "howdy","what's up"]
 
 def detect_greeting(text: str) -> bool:
-    greetings=["hello", "hi", "greetings", "good morning", 
-               "good afternoon", "good evening", "hey",
-               "how are you doing","yo","are you fine", "howdy","what's up"]
-    return any(greet in text.lower() for greet in greetings)
-def build_generation_prompt(query: str, retrieved: List[Dict]) -> str:
-    ctx = "\n".join([f"[{r['line_no']}] {r['text']}" for r in retrieved]) if retrieved else ""
-
-    greeting_note = ""
-    if detect_greeting(query):
-        greeting_note = "The user greeted you. First reply with a warm and short greeting (like 'Hi there!'), " \
-                        "then continue answering the question using the context below."
+    return any(greet in text.lower() for greet in GREETINGS)
 
-    if not retrieved:
-        return (
-            f"User question: {query}\n\n"
-            "This question cannot be answered from the provided knowledge base. "
-            f"Reply exactly: \"{FALLBACK_TEXT}\""
-        )
 
-    prompt = f"""
-You are a professional Amazon Help Assistant. Follow these rules strictly:
-{greeting_note}
+# Static instruction prefixes: byte-identical for every request, so the model server
+# can reuse their prompt (KV) cache; everything request-specific follows them, query last.
+GENERATION_PREFIX = f"""You are a professional Amazon Help Assistant. Follow these rules strictly:
 1) Use ONLY the information in the CONTEXT block below. Do NOT invent facts.
 2) If the CONTEXT does NOT contain the answer, respond exactly:
    "{FALLBACK_TEXT}"
 3) Provide step-by-step actionable directions that start from the Amazon homepage.
 4) When referencing context, cite the line numbers in square brackets (e.g., [23]).
 5) Be concise, professional, and polite.
+6) If the user greets you, first reply with a warm and short greeting (like 'Hi there!'),
+   then continue answering the question using the context.
 
+"""
 
-CONTEXT:
-{ctx}
-
-User Question:
-{query}
+VERIFICATION_PREFIX = """Task:
+Based only on the CONTEXT below, does the Proposed Answer rely ONLY on the provided CONTEXT (no external facts or assumptions)?
+Answer with a single word: YES or NO.
 
-Answer:
 """
-    return prompt.strip()
 
 
-def build_verification_prompt(query: str, retrieved: List[Dict], answer: str) -> str:
+def _context_block(retrieved: List[Dict], pack_stats: Dict = None, packed: List[Dict] = None) -> str:
+    if packed is not None:
+        lines = packed
+    else:
+        lines, stats = pack_context(retrieved)
+        if pack_stats is not None:
+            pack_stats.update(stats)
+    return "\n".join(f"[{r['line_no']}] {r['text']}" for r in lines)
+
+
+def build_generation_prompt(query: str, retrieved: List[Dict], pack_stats: Dict = None) -> str:
     """
-    Build a verification prompt that asks the model to answer YES or NO if the answer
-    strictly relies on the provided context.
+    GENERATION_PREFIX + packed CONTEXT (see context_packer) + question.
+    When pack_stats is given it receives the packing stats (tokens saved etc.).
     """
-    ctx = "\n".join([f"[{r['line_no']}] {r['text']}" for r in retrieved])
-    verification = f"""
-CONTEXT:
-{ctx}
-
-User Question:
-{query}
+    if not retrieved:
+        return (
+            f"User question: {query}\n\n"
+            "This question cannot be answered from the provided knowledge base. "
+            f"Reply exactly: \"{FALLBACK_TEXT}\""
+        )
+    greeting_note = "The user greeted you.\n" if detect_greeting(query) else ""
+    ctx = _context_block(retrieved, pack_stats)
+    return f"{GENERATION_PREFIX}CONTEXT:\n{ctx}\n\n{greeting_note}User Question:\n{query}\n\nAnswer:"
 
-Proposed Answer:
-{answer}
 
-Task:
-Based only on the CONTEXT above, does the Proposed Answer rely ONLY on the provided CONTEXT (no external facts or assumptions)?
-Answer with a single word: YES or NO.
-"""
-    return verification.strip()
+def build_verification_prompt(query: str, retrieved: List[Dict], answer: str, packed: List[Dict] = None) -> str:
+    """
+    Build a verification prompt that asks the model to answer YES or NO if the answer
+    strictly relies on the provided context (the same packed lines the answer was generated from).
+    packed: pack_context(retrieved)'s lines, when the caller already has them.
+    """
+    ctx = _context_block(retrieved, packed=packed)
+    return f"{VERIFICATION_PREFIX}CONTEXT:\n{ctx}\n\nProposed Answer:\n{answer}\n\nUser Question:\n{query}\n\nVerdict (YES or NO):"
@@ -1,49 +1,380 @@
 # ingest.py
+import argparse
 import faiss
+import json
 import numpy as np
-import pickle
+import multiprocessing
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from embeddings import get_embedder
+from ann import ANN_INDEX_TYPE, INDEX_TYPES, build_index, index_kind
+from chunking import CHUNK_UNIT, CHUNK_UNITS, chunk_file, iter_chunks
+from embeddings import get_embedder, embedder_id, DEFAULT_MODEL_PATH
+from lexical import BM25Writer
+from storage import (STORAGE_DIR, INDEX_FILE, EMB_FILE, TEXTS_FILE, IDS_FILE, LEGACY_META_FILE, STORE_FORMAT,
+                     LineStore, LineWriter, NpyAppender, current_dir, current_version, new_snapshot, commit_snapshot,
+                     load_legacy, line_id, line_key, open_lines, read_manifest, write_lock)
+from generator import build_generation_prompt, run_ollama_mistral
+from verifier import verify_answer
+from telemetry import get_logger
 
-STORAGE_DIR = Path("storage")
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
-INDEX_PATH = STORAGE_DIR / "faiss.index"
-META_PATH = STORAGE_DIR / "meta.pkl"
-EMB_VEC_PATH = STORAGE_DIR / "embeddings.npy"
+log = get_logger("ingest")
 
-def ingest_lines(lines, model_path: str = None):
+ANSWERS_PATH = STORAGE_DIR / "answers.json"
+
+INGEST_MODES = ("replace", "append", "delete")
+ENCODE_BATCH_SIZE = int(os.environ.get("ENCODE_BATCH_SIZE", "256"))  # chunks encoded + written per step
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", "1"))  # > 1: encode in that many worker processes
+ENCODE_SUB_BATCH = 32  # texts per model.encode call in a worker
+
+def _load_existing():
     """
-    Ingest lines (list of strings) into FAISS IndexFlatIP after embedding + L2 normalization.
-    Writes index, embeddings and metadata to storage.
+    Open the active corpus as (rows, ids, vectors, index): rows in citation order
+    (a memory-mapped LineStore, or a list for legacy storage), their FAISS ids, their
+    normalized vectors (memory-mapped) and the ID-mapped FAISS index.
+    Pre-snapshot storage is upgraded from embeddings.npy without re-encoding.
+    Returns ([], [], None, None) when there is no usable stored corpus.
     """
-    model = get_embedder(model_path) if model_path else get_embedder()
-    texts = [ln.strip() for ln in lines if ln and ln.strip()]
-    if not texts:
-        raise ValueError("No lines provided for ingestion")
+    src = current_dir()
+    if (src / TEXTS_FILE).exists():
+        rows = LineStore(src)
+        vectors = np.load(str(src / EMB_FILE), mmap_mode="r")
+        index = faiss.read_index(str(src / INDEX_FILE))
+        return rows, rows.ids, vectors, index
+    if (src / LEGACY_META_FILE).exists() and (src / EMB_FILE).exists():
+        log.info("upgrading pre-snapshot storage to content-addressed ids")
+        try:
+            rows, vectors = load_legacy(src)
+        except ValueError as e:
+            log.warning(f"{e}; rebuilding from scratch")
+            return [], [], None, None
+        ids = np.array([r["id"] for r in rows], dtype="int64")
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+        index.add_with_ids(vectors, ids)
+        return rows, ids, vectors, index
+    return [], [], None, None
+
+def _batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    print(f"[ingest] Encoding {len(texts)} lines ...")
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True, batch_size=32)
+def _encode(model, texts):
+    vecs = model.encode(texts, convert_to_numpy=True, batch_size=32).astype("float32")
     # normalize for cosine search using inner product
-    faiss.normalize_L2(embeddings.astype("float32"))
-    dim = embeddings.shape[1]
-    print(f"[ingest] building IndexFlatIP with dim={dim} ...")
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings.astype("float32"))
-    faiss.write_index(index, str(INDEX_PATH))
-    np.save(str(EMB_VEC_PATH), embeddings)
-    metadata = [{"line_no": i+1, "text": t} for i, t in enumerate(texts)]
-    with open(str(META_PATH), "wb") as f:
-        pickle.dump(metadata, f)
-    print(f"[ingest] saved index -> {INDEX_PATH}, meta -> {META_PATH}, embeddings -> {EMB_VEC_PATH}")
-    return True
-
-def ingest_file(path="amazon_help_doc.txt", model_path: str = None):
+    faiss.normalize_L2(vecs)
+    return vecs
+
+_worker_model = None
+
+def _init_encode_worker(model_path, threads: int):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = get_embedder(model_path) if model_path else get_embedder()
+
+def _encode_in_worker(texts):
+    return _encode(_worker_model, texts)
+
+class _Encoder:
+    """
+    Encodes batches in the background so chunking, index adds and snapshot writes overlap
+    with encoding. With workers > 1, texts are sorted by length (so each sub-batch pads
+    little) and spread over a process pool whose workers each hold their own model and
+    split the cores between them. Results always come back in input order.
+    """
+
+    def __init__(self, model_path: str = None, workers: int = ENCODE_WORKERS):
+        self.workers = max(1, workers)
+        self._model_path = model_path
+        if self.workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_encode_worker, initargs=(model_path, threads))
+        else:
+            self._pool = ThreadPoolExecutor(1, thread_name_prefix="ingest-encode")
+
+    def _encode_local(self, texts):
+        return _encode(get_embedder(self._model_path) if self._model_path else get_embedder(), texts)
+
+    def submit(self, texts):
+        """Start encoding texts; returns a callable that blocks for the (len(texts), dim) vectors."""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        if self.workers > 1:
+            parts = [order[i:i + ENCODE_SUB_BATCH] for i in range(0, len(order), ENCODE_SUB_BATCH)]
+            futures = [self._pool.submit(_encode_in_worker, [texts[i] for i in part]) for part in parts]
+        else:
+            parts = [order]
+            futures = [self._pool.submit(self._encode_local, [texts[i] for i in order])]
+
+        def result():
+            vecs = [f.result() for f in futures]
+            out = np.empty((len(texts), vecs[0].shape[1]), dtype="float32")
+            for part, v in zip(parts, vecs):
+                out[part] = v
+            return out
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+def ingest_chunks(chunks, model_path: str = None, mode: str = "replace", index_type: str = None,
+                  batch_size: int = ENCODE_BATCH_SIZE, workers: int = ENCODE_WORKERS, reencode: bool = False):
+    """
+    Incrementally update the stored corpus from an iterable of chunks
+    ({"text"} + optional "source", "line_start", "line_end"; see chunking.iter_chunks).
+     - replace: the corpus becomes exactly these chunks (line numbers follow their order)
+     - append:  chunks not already present are added after the existing ones
+     - delete:  chunks matching these texts are removed
+    Each chunk is content-addressed (storage.line_key / line_id), so unchanged chunks keep their
+    cached embedding and only the delta is encoded. Chunks are consumed batch_size at a time:
+    encoded, added to the index and appended to a new storage snapshot (index, embeddings,
+    metadata, manifest) on disk, so memory does not grow with the input; the snapshot becomes
+    active only once fully written. Encoding runs in the background (workers > 1: in that many
+    processes) while earlier batches are written, in input order.
+    index_type (see ann.INDEX_TYPES) defaults to the active snapshot's type, or ANN_INDEX_TYPE
+    for a new corpus; a flat index is updated in place, approximate types are rebuilt from
+    the stored vectors.
+    reencode ignores the stored vectors (the embedder changed, see reembed).
+    Concurrent ingests (threads or processes) run one at a time (storage.write_lock), each
+    starting from the snapshot the previous one committed.
+    Returns a summary dict of the changes, including the new snapshot version.
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"mode must be one of {INGEST_MODES}, got {mode!r}")
+    with write_lock():
+        return _ingest_chunks(chunks, model_path, mode, index_type, batch_size, workers, reencode)
+
+def _ingest_chunks(chunks, model_path, mode, index_type, batch_size, workers, reencode):
+    active = current_version()
+    old_type = index_kind(read_manifest(active)) if active else "flat"
+    index_type = index_type or (old_type if active else ANN_INDEX_TYPE)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type must be one of {INDEX_TYPES}, got {index_type!r}")
+
+    old_rows, old_ids, old_vectors, index = _load_existing()
+    if index is not None and (index_type != "flat" or old_type != "flat" or reencode):
+        index = None  # HNSW / IVF do not support remove_ids well; rebuild from the vectors below
+    if reencode:
+        old_row = lambda doc_id: None
+    elif isinstance(old_rows, LineStore):
+        def old_row(doc_id):
+            try:
+                return old_rows.row_of(doc_id)
+            except KeyError:
+                return None
+    else:
+        old_row = {int(i): n for n, i in enumerate(old_ids)}.get
+
+    seen = set()
+    stats = {"chunks": 0, "added": 0, "reused": 0, "batches": 0, "next_no": 1}
+    encoder = None
+    t0 = time.perf_counter()
+    version, staging = new_snapshot()
+    lines_out = LineWriter(staging)
+    lexical_out = BM25Writer(staging)  # BM25 postings for hybrid retrieval, built alongside
+    vectors_out = None
+
+    def write(rows, vecs):
+        nonlocal vectors_out
+        if vectors_out is None:
+            vectors_out = NpyAppender(staging / EMB_FILE, np.float32, (vecs.shape[1],))
+        lines_out.append(rows)
+        lexical_out.add([r["text"] for r in rows])
+        vectors_out.append(vecs)
+
+    def copy_old(keep):
+        for batch in _batches(enumerate(old_rows), batch_size):
+            batch = [(i, r) for i, r in batch if keep(r["id"])]
+            if batch:
+                seen.update(r["id"] for _, r in batch)
+                stats["next_no"] = max(stats["next_no"], max(r["line_no"] for _, r in batch) + 1)
+                write([r for _, r in batch], np.asarray(old_vectors[[i for i, _ in batch]], dtype="float32"))
+
+    def finish(rows, cached, fresh, result):
+        new_vecs = result() if result else None
+        if new_vecs is not None and index is not None:
+            index.add_with_ids(new_vecs, np.array([r["id"] for r in fresh], dtype="int64"))
+        # vectors in row order: cached rows for kept chunks, fresh rows for new ones
+        fresh_iter = iter(range(len(fresh)))
+        vecs = np.vstack([old_vectors[o] if o is not None else new_vecs[next(fresh_iter)] for o in cached])
+        write(rows, vecs.astype("float32"))
+        stats["added"] += len(fresh)
+        stats["reused"] += len(rows) - len(fresh)
+        stats["batches"] += 1
+        if stats["added"] and stats["batches"] % 20 == 0:
+            log.info(f"{len(lines_out)} lines written, {stats['added'] / (time.perf_counter() - t0):.0f} lines/s encoded")
+
+    def add_new(chunk_iter):
+        nonlocal encoder
+        pending = deque()  # batches being encoded, oldest first
+        for batch in _batches(chunk_iter, batch_size):
+            rows = []
+            for c in batch:
+                stats["chunks"] += 1
+                text = (c["text"] or "").strip()
+                doc_id = line_id(line_key(text)) if text else None
+                if doc_id is None or doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                rows.append({"id": doc_id, "line_no": stats["next_no"], "text": text, "source": c.get("source"),
+                             "line_start": c.get("line_start"), "line_end": c.get("line_end")})
+                stats["next_no"] += 1
+            if not rows:
+                continue
+            cached = [old_row(r["id"]) for r in rows]
+            fresh = [r for r, o in zip(rows, cached) if o is None]
+            result = None
+            if fresh:
+                if encoder is None:
+                    encoder = _Encoder(model_path, workers)
+                result = encoder.submit([r["text"] for r in fresh])
+            pending.append((rows, cached, fresh, result))
+            while len(pending) > 2 * max(1, workers):
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+
+    try:
+        if mode == "delete":
+            drop = {line_id(line_key(c["text"].strip())) for c in chunks if c["text"] and c["text"].strip()}
+            copy_old(lambda doc_id: doc_id not in drop)
+            stats["reused"] = len(lines_out)
+        else:
+            if mode == "append":
+                copy_old(lambda doc_id: True)
+                stats["reused"] = len(lines_out)
+            add_new(chunks)
+            if not stats["chunks"]:
+                raise ValueError("No lines provided for ingestion")
+        count = lines_out.close()
+        lexical_out.close()
+        if vectors_out is not None:
+            vectors_out.close()
+        if not count:
+            raise ValueError("Ingestion would leave the corpus empty")
+
+        removed = [int(i) for i in old_ids if int(i) not in seen]
+        index_params = {}
+        if index is None:
+            vectors = np.load(str(staging / EMB_FILE), mmap_mode="r")
+            log.info(f"building {index_type} index over {count} lines with dim={vectors.shape[1]} ...")
+            index, index_params = build_index(index_type, vectors, np.load(str(staging / IDS_FILE)))
+            del vectors
+        elif removed:
+            index.remove_ids(np.array(removed, dtype="int64"))
+        faiss.write_index(index, str(staging / INDEX_FILE))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+    elapsed = time.perf_counter() - t0
+    summary = {"mode": mode, "lines": count, "added": stats["added"], "removed": len(removed),
+               "reused": stats["reused"], "seconds": round(elapsed, 2),
+               "lines_per_sec": round(stats["added"] / elapsed, 1) if elapsed else 0.0}
+    commit_snapshot(version, staging, {"model": str(model_path or DEFAULT_MODEL_PATH),
+                                       "embedder": embedder_id(model_path), "dim": int(index.d),
+                                       "lines": count, "index_type": index_type, "index_params": index_params,
+                                       "format": STORE_FORMAT, "ingest": summary})
+    summary["version"] = version
+    log.info(f"{summary}; saved snapshot -> {STORAGE_DIR / 'snapshots' / version}")
+    return summary
+
+def ingest_lines(lines, model_path: str = None, mode: str = "replace", index_type: str = None, source: str = None):
+    """Ingest an iterable of text lines (each non-empty line is chunked on its own)."""
+    return ingest_chunks(iter_chunks(enumerate(lines, 1), source=source, unit="line"),
+                         model_path=model_path, mode=mode, index_type=index_type)
+
+def ingest_file(path="amazon_help_doc.txt", model_path: str = None, mode: str = "replace", index_type: str = None,
+                unit: str = CHUNK_UNIT, workers: int = ENCODE_WORKERS):
+    """Stream a document from disk through the chunker into ingest_chunks."""
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"{path} not found")
-    with p.open("r", encoding="utf-8") as f:
-        lines = [ln.strip() for ln in f.readlines() if ln.strip()]
-    return ingest_lines(lines, model_path=model_path)
+    return ingest_chunks(chunk_file(p, unit=unit), model_path=model_path, mode=mode, index_type=index_type,
+                         workers=workers)
+
+def reembed(model_path: str = None, workers: int = ENCODE_WORKERS):
+    """Re-encode the active corpus (same chunks and order) with the current embedder into a new snapshot."""
+    rows = open_lines(current_dir())
+    chunks = ({"text": r["text"], "source": r.get("source"), "line_start": r.get("line_start"),
+               "line_end": r.get("line_end")} for r in rows)
+    return ingest_chunks(chunks, model_path=model_path, mode="replace", workers=workers, reencode=True)
+
+def precompute_answers(metadata=None, path: Path = ANSWERS_PATH):
+    """
+    Generate and verify an answer for every corpus line (the line itself is the question
+    and the only context), storing verified ones in answers.json keyed by line_key.
+    The router serves these for high-confidence retrieval hits without calling the LLM.
+    Lines whose text is unchanged since the last run are not regenerated.
+    """
+    if metadata is None:
+        metadata = list(open_lines(current_dir()))
+    existing = {}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+
+    answers = {}
+    for i, meta in enumerate(metadata, 1):
+        key = line_key(meta["text"])
+        if key in existing:
+            answers[key] = existing[key]
+            continue
+        retrieved = [{"idx": i - 1, "line_no": int(meta["line_no"]), "text": meta["text"], "score": 1.0}]
+        try:
+            gen = run_ollama_mistral(build_generation_prompt(meta["text"], retrieved))
+            verified, final = verify_answer(meta["text"], retrieved, gen)
+        except Exception as e:
+            log.warning(f"line {meta['line_no']}: generation failed: {e}")
+            continue
+        if verified:
+            answers[key] = {"line_no": int(meta["line_no"]), "answer": final}
+        log.info(f"precomputed {i}/{len(metadata)} line={meta['line_no']} verified={verified}")
+
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(answers, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    log.info(f"saved {len(answers)} precomputed answers -> {path}")
+    return len(answers)
 
 if __name__ == "__main__":
-    ingest_file()
+    ap = argparse.ArgumentParser(description="Build the FAISS index from a help document")
+    ap.add_argument("path", nargs="?", default="amazon_help_doc.txt")
+    ap.add_argument("--mode", choices=INGEST_MODES, default="replace")
+    ap.add_argument("--chunk-unit", choices=CHUNK_UNITS, default=CHUNK_UNIT,
+                    help="a document is split per non-empty line or per blank-line separated paragraph")
+    ap.add_argument("--workers", type=int, default=ENCODE_WORKERS,
+                    help="encoding processes (each loads the model; cores are split between them)")
+    ap.add_argument("--index-type", choices=INDEX_TYPES,
+                    help="FAISS index type (see ann.py; default: keep the active one, else ANN_INDEX_TYPE)")
+    ap.add_argument("--reembed", action="store_true",
+                    help="re-encode the active corpus with the current embedder (EMBED_BACKEND / MODEL_PATH) "
+                         "instead of reading a document")
+    ap.add_argument("--precompute-answers", action="store_true",
+                    help="also generate + verify a fast-path answer for every line (needs Ollama)")
+    args = ap.parse_args()
+    if args.reembed:
+        summary = reembed(workers=args.workers)
+    else:
+        summary = ingest_file(args.path, mode=args.mode, index_type=args.index_type, unit=args.chunk_unit,
+                              workers=args.workers)
+    log.info(f"encoded {summary['added']} lines in {summary['seconds']}s ({summary['lines_per_sec']} lines/s)")
+    if args.precompute_answers:
+        precompute_answers()
@@ -0,0 +1,132 @@
+# lexical.py
+"""
+BM25 inverted index over the corpus rows, stored next to the FAISS index in every
+snapshot as CSR arrays:
+
+    bm25_indptr.npy   (V+1,) int64   postings of term t are [indptr[t], indptr[t+1])
+    bm25_rows.npy     (P,)   int32   line store row of each posting (ascending per term)
+    bm25_tf.npy       (P,)   uint16  term frequency in that row
+    bm25_doclen.npy   (N,)   int32   tokens per row
+    bm25_terms.json   terms in term-id order + k1, b, avgdl
+
+Exact keyword queries ("Crocs", "gift card", order ids) score weakly in MiniLM space
+but strongly here; retrieval fuses both rankings.
+"""
+import json
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from storage import (BM25_DOCLEN_FILE, BM25_INDPTR_FILE, BM25_ROWS_FILE, BM25_TERMS_FILE, BM25_TF_FILE,
+                     NpyAppender)
+
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("a an and are as at be by can do for from how i if in is it me my of on or so that the "
+                      "this to want was what when where which with you your".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Writer:
+    """Builds the BM25 files for rows appended in line store order (postings spill to disk)."""
+
+    def __init__(self, directory: Path, k1: float = BM25_K1, b: float = BM25_B):
+        self.directory = Path(directory)
+        self.k1, self.b = k1, b
+        self.terms = {}
+        self.rows = 0
+        self.tokens = 0
+        self._term_ids = NpyAppender(self.directory / "bm25_terms.tmp.npy", np.int32)
+        self._post_rows = NpyAppender(self.directory / "bm25_rows.tmp.npy", np.int32)
+        self._tf = NpyAppender(self.directory / BM25_TF_FILE, np.uint16)
+        self._doclen = NpyAppender(self.directory / BM25_DOCLEN_FILE, np.int32)
+
+    def add(self, texts: List[str]):
+        term_ids, post_rows, tfs, lens = [], [], [], []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            for term, c in counts.items():
+                term_ids.append(self.terms.setdefault(term, len(self.terms)))
+                post_rows.append(self.rows)
+                tfs.append(min(c, 65535))
+            n = sum(counts.values())
+            lens.append(n)
+            self.tokens += n
+            self.rows += 1
+        self._term_ids.append(term_ids)
+        self._post_rows.append(post_rows)
+        self._tf.append(tfs)
+        self._doclen.append(lens)
+
+    def close(self):
+        for appender in (self._term_ids, self._post_rows, self._tf, self._doclen):
+            appender.close()
+        term_ids = np.load(self._term_ids.path)
+        order = np.argsort(term_ids, kind="stable")  # stable: rows stay ascending within a term
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.terms)), out=indptr[1:])
+        del term_ids
+        np.save(self.directory / BM25_INDPTR_FILE, indptr)
+        np.save(self.directory / BM25_ROWS_FILE, np.load(self._post_rows.path)[order])
+        np.save(self.directory / BM25_TF_FILE, np.load(self.directory / BM25_TF_FILE)[order])
+        self._term_ids.path.unlink()
+        self._post_rows.path.unlink()
+        meta = {"k1": self.k1, "b": self.b, "avgdl": self.tokens / self.rows if self.rows else 0.0,
+                "terms": sorted(self.terms, key=self.terms.get)}
+        (self.directory / BM25_TERMS_FILE).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+
+class BM25Index:
+    """Read side of the BM25 files (arrays memory-mapped)."""
+
+    def __init__(self, directory: Path):
+        directory = Path(directory)
+        meta = json.loads((directory / BM25_TERMS_FILE).read_text(encoding="utf-8"))
+        self.k1, self.b, self.avgdl = meta["k1"], meta["b"], meta["avgdl"] or 1.0
+        self.terms = {t: i for i, t in enumerate(meta["terms"])}
+        self.indptr = np.load(directory / BM25_INDPTR_FILE, mmap_mode="r")
+        self.rows = np.load(directory / BM25_ROWS_FILE, mmap_mode="r")
+        self.tf = np.load(directory / BM25_TF_FILE, mmap_mode="r")
+        self.doc_len = np.load(directory / BM25_DOCLEN_FILE, mmap_mode="r")
+        n = len(self.doc_len)
+        df = np.diff(self.indptr)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype("float32")
+        self.unseen_idf = float(np.log1p((n + 0.5) / 0.5))
+
+    @classmethod
+    def open(cls, directory: Path) -> Optional["BM25Index"]:
+        """The snapshot's BM25 index, or None for snapshots built before it existed."""
+        return cls(directory) if (Path(directory) / BM25_TERMS_FILE).exists() else None
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray, float]:
+        """
+        Top-k rows by BM25 -> (rows, scores, strength). strength is the top score over the
+        score of a document containing every query term once at average length (clipped to
+        1); query terms missing from the corpus count against it.
+        """
+        terms = set(tokenize(query))
+        known = [self.terms[t] for t in terms if t in self.terms]
+        ideal = sum(float(self.idf[t]) for t in known) + self.unseen_idf * (len(terms) - len(known))
+        if not known:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0.0
+        rows, contrib = [], []
+        for t in known:
+            start, end = self.indptr[t], self.indptr[t + 1]
+            r = np.asarray(self.rows[start:end])
+            tf = np.asarray(self.tf[start:end], dtype="float32")
+            norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_len[r], dtype="float32") / self.avgdl)
+            rows.append(r)
+            contrib.append(self.idf[t] * tf * (self.k1 + 1) / (tf + norm))
+        uniq, inv = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(contrib)).astype("float32")
+        top = np.argsort(-scores, kind="stable")[:k]
+        return uniq[top].astype(np.int64), scores[top], min(1.0, float(scores[top[0]]) / ideal)
@@ -1,18 +1,70 @@
 # main.py
+import time
+_IMPORT_START = time.perf_counter()  # startup report: how long importing the app takes
+
+import asyncio
+import hmac
+import io
 import json
+import os
 import uuid
 from datetime import datetime
 from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from contextlib import asynccontextmanager, contextmanager
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pathlib import Path
 
-from retrieval import search
-from generator import build_generation_prompt, run_ollama_mistral, FALLBACK_TEXT
-from verifier import verify_answer
-from ingest import ingest_file  # optional re-ingest if you wire an upload endpoint
+import retrieval
+import storage
+from retrieval import search, encode_query, lexical_shortcut, retrieval_stats
+from context_packer import packer_stats, record_packing
+from generator import build_generation_prompt, run_ollama_mistral, stream_ollama_mistral, FALLBACK_TEXT
+from verifier import verify_answer, verifier_stats
+from router import greeting_reply, precomputed_answer, record_route, router_stats
+from answer_cache import ANSWER_CACHE, CACHE_ENABLED
+from coalesce import COALESCER, LeaderAborted, normalize
+from deadlines import DeadlineExceeded, RequestCancelled, cancellation_stats, error_for, request_deadline
+from verdicts import OPTIMISTIC_VERIFY, VERDICT_WAIT, VERDICTS, VERIFY_BUDGET, verdict
+from batch import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, run_batch
+from workers import ADMISSION, BATCH_POOL, LLM_POOL, OverloadedError, iterate_in, pool_stats, run_cpu, run_llm
+from telemetry import REQUEST_SECONDS, STAGE_SECONDS, get_logger, register_collector, render as render_metrics, trace_context
+from ingest import ingest_lines, INGEST_MODES
 
-APP = FastAPI()
 ROOT = Path(__file__).parent
+log = get_logger("main")
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+# Startup: the server binds its port immediately; the embedding model and the index
+# load in a background warm-up. /healthz = process alive, /readyz = warmed up.
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "10"))
+_startup = {"state": "starting", "import_s": round(IMPORT_SECONDS, 3), "warmup_s": None, "warmup": {}, "error": None}
+
+async def _warm_up():
+    """Run retrieval.warm_up off the event loop; retry until it succeeds (e.g. nothing ingested yet)."""
+    while True:
+        _startup["state"] = "warming"
+        t0 = time.perf_counter()
+        try:
+            _startup["warmup"] = await run_cpu(retrieval.warm_up)
+        except Exception as e:
+            _startup.update(state="failed", error=str(e))
+            log.warning(f"warm-up failed, retrying in {WARMUP_RETRY_SECONDS:g}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            continue
+        _startup.update(state="ready", error=None, warmup_s=round(time.perf_counter() - t0, 3))
+        log.info(f"ready: import {_startup['import_s']}s, warm-up {_startup['warmup_s']}s {_startup['warmup']}")
+        return
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    task = asyncio.create_task(_warm_up())
+    yield
+    task.cancel()
+
+APP = FastAPI(lifespan=_lifespan)
+
+TRACE_IDS = os.environ.get("TRACE_IDS", "0") == "1"  # trace id on every /chat response, not only when asked for
 
 # Create support folders
 SUPPORT_DIR = ROOT / "support"
@@ -137,6 +189,7 @@ CHAT_HTML = """
     .user{align-self:flex-end;background:linear-gradient(180deg,var(--primary),#0266c8);color:white;}
     .assistant{align-self:flex-start;background:linear-gradient(180deg,#fff,#fbfdff);border:1px solid #eef3fb;color:#08263a}
     .sources{font-size:12px;color:var(--muted);margin-top:6px}
+    .verifying::after{content:"  · verifying…";font-size:12px;color:var(--muted)}
 
     /* Composer */
     .composer{
@@ -263,6 +316,7 @@ function appendMessage(role, text, small=false){
   }
   // smooth scroll
   messagesEl.scrollTop = messagesEl.scrollHeight;
+  return d;
 }
 
 /* Stars interaction */
@@ -283,54 +337,112 @@ queryEl.addEventListener("keydown", (e) => {
   }
 });
 
-/* Send message */
+/* Read a Server-Sent Events stream from a fetch() response; onEvent(name, data) per event */
+async function readEvents(res, onEvent){
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  while(true){
+    const {value, done} = await reader.read();
+    if(done) break;
+    buf += decoder.decode(value, {stream: true});
+    let sep;
+    while((sep = buf.indexOf("\n\n")) >= 0){
+      const raw = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let name = "message", data = "";
+      raw.split("\n").forEach(line => {
+        if(line.startsWith("event:")) name = line.slice(6).trim();
+        else if(line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      onEvent(name, data ? JSON.parse(data) : null);
+    }
+  }
+}
+
+const FALLBACK_TEXT = __FALLBACK_TEXT__;
+
+/* Show the final answer in its bubble (it replaces the streamed text); on fallback open the support modal */
+function showAnswer(bubble, j, q){
+  const answerText = j.answer || "No answer returned.";
+  bubble.textContent = answerText;
+  lastAnswerText = answerText;
+  lastResponseWasFallback = !!j.is_ood || (j.answer && j.answer.includes("Sorry, I cannot answer that"));
+
+  // Show feedback bar only if answer is not fallback
+  if(!lastResponseWasFallback){
+    feedbackBar.style.display = "block";
+  } else {
+    feedbackBar.style.display = "none";
+    // auto open support modal on fallback
+    openSupportModal(q);
+  }
+}
+
+/* Send message (streams tokens into the answer bubble as they arrive) */
 sendBtn.addEventListener("click", async () => {
   const q = queryEl.value.trim();
   if(!q) return;
   appendMessage("user", q);
   queryEl.value = "";
-  appendMessage("assistant", "…thinking…");
+  const bubble = appendMessage("assistant", "…thinking…");
 
   try {
-    const res = await fetch("/chat", {
+    const res = await fetch("/chat/stream", {
       method: "POST",
       headers: {"content-type":"application/json"},
       body: JSON.stringify({ query: q })
     });
-    const j = await res.json();
-
-    // remove thinking placeholder if present
-    if(messagesEl.lastChild && messagesEl.lastChild.textContent === "…thinking…"){
-      messagesEl.removeChild(messagesEl.lastChild);
+    if(!res.ok){
+      const j = await res.json();
+      throw new Error(j.error || ("HTTP " + res.status));
     }
 
-    // append answer
-    const answerText = j.answer || "No answer returned.";
-    appendMessage("assistant", answerText);
-    lastAnswerText = answerText;
-    lastRetrieval = j.retrieved || [];
-    lastResponseWasFallback = !!j.is_ood || (j.answer && j.answer.includes("Sorry, I cannot answer that"));
-
-    // show sources if present
-    if(lastRetrieval && lastRetrieval.length){
-      const src = lastRetrieval.map(x => `[${x.line_no}]`).join(", ");
-      appendMessage("assistant", "Sources: " + src, true);
-    }
-
-    // Show feedback bar only if answer is not fallback
-    if(!lastResponseWasFallback){
-      feedbackBar.style.display = "block";
-    } else {
-      feedbackBar.style.display = "none";
-      // auto open support modal on fallback
-      openSupportModal(q);
+    let streamed = "";
+    let j = null;
+    let verifying = false;
+    await readEvents(res, (name, data) => {
+      if(name === "sources"){
+        lastRetrieval = data.retrieved || [];
+        // show sources if present
+        if(!data.is_ood && lastRetrieval.length){
+          const src = lastRetrieval.map(x => `[${x.line_no}]`).join(", ");
+          appendMessage("assistant", "Sources: " + src, true);
+        }
+      } else if(name === "token"){
+        streamed += data.text;
+        bubble.textContent = streamed;
+        messagesEl.scrollTop = messagesEl.scrollHeight;
+      } else if(name === "done"){
+        j = data;
+        showAnswer(bubble, j, q);
+        // optimistic mode: the answer is shown now, its verdict follows
+        verifying = j.verification === "verifying";
+        if(verifying) bubble.classList.add("verifying");
+      } else if(name === "verdict"){
+        verifying = false;
+        bubble.classList.remove("verifying");
+        if(!data.verified) showAnswer(bubble, {...j, answer: data.answer}, q);  // retracted
+      } else if(name === "error"){
+        if(verifying){  // no verdict: the unverified answer does not stand
+          verifying = false;
+          bubble.classList.remove("verifying");
+          showAnswer(bubble, {...j, answer: FALLBACK_TEXT}, q);
+        }
+        throw new Error(data.error);
+      }
+    });
+    if(!j) throw new Error("stream ended without an answer");
+    if(verifying){
+      bubble.classList.remove("verifying");
+      showAnswer(bubble, {...j, answer: FALLBACK_TEXT}, q);
     }
 
-    console.log("DEBUG /chat:", {is_ood: j.is_ood, verified: j.verified, max_score: j.max_score});
+    console.log("DEBUG /chat/stream:", {route: j.route, is_ood: j.is_ood, verified: j.verified, max_score: j.max_score, ttft_ms: j.ttft_ms, total_ms: j.total_ms});
   } catch(err) {
-    // remove thinking if present
-    if(messagesEl.lastChild && messagesEl.lastChild.textContent === "…thinking…"){
-      messagesEl.removeChild(messagesEl.lastChild);
+    // remove thinking if nothing was streamed
+    if(bubble.textContent === "…thinking…"){
+      messagesEl.removeChild(bubble);
     }
     appendMessage("assistant", "Error: " + String(err));
   }
@@ -420,12 +532,26 @@ window.addEventListener('load', ()=> setTimeout(()=> { try { queryEl.focus(); }
 </html>
 
 """
+CHAT_HTML = CHAT_HTML.replace("__FALLBACK_TEXT__", json.dumps(FALLBACK_TEXT))
 
 
 @APP.get("/", response_class=HTMLResponse)
 async def home():
     return HTMLResponse(CHAT_HTML)
 
+def _busy(e: OverloadedError) -> JSONResponse:
+    log.info(f"rejected: {e}")
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+def _trace_id(request: Request, payload: dict):
+    """Caller-supplied X-Trace-Id, a fresh id when the body asks for one ("trace": true) or TRACE_IDS=1, else None."""
+    trace_id = request.headers.get("x-trace-id")
+    if trace_id:
+        return trace_id[:64]
+    if TRACE_IDS or payload.get("trace"):
+        return uuid.uuid4().hex[:16]
+    return None
+
 @APP.post("/chat")
 async def chat(request: Request):
     payload = await request.json()
@@ -433,27 +559,473 @@ async def chat(request: Request):
     if not query:
         return JSONResponse({"error":"empty query"}, status_code=400)
 
-    # Retrieval
-    retrieved, is_ood, max_score = search(query)
-    print(f"[main] /chat retrieved={len(retrieved)} is_ood={is_ood} max_score={max_score:.4f}")
+    trace_id = _trace_id(request, payload)
+    optimistic = bool(payload.get("optimistic", OPTIMISTIC_VERIFY))
+    with trace_context(trace_id), request_deadline() as deadline:
+        t0 = time.perf_counter()
+        # identical questions already in flight share that request's answer (coalesce.py)
+        key = _flight_key(query, optimistic)
+        work = asyncio.ensure_future(COALESCER.do(key, lambda: _admitted_answer(query, optimistic)))
+        try:
+            result, shared = await _until_done(request, work, deadline, key)
+        except OverloadedError as e:
+            return _busy(e)
+        except RequestCancelled as e:
+            return _cancelled(e, t0)
+        if shared:
+            result = _shared_result(result, t0)
+    if trace_id is None or isinstance(result, JSONResponse):
+        return result
+    return JSONResponse({**result, "trace_id": trace_id}, headers={"X-Trace-Id": trace_id})
+
+async def _disconnected(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _until_done(request: Request, work: asyncio.Future, deadline, key: str):
+    """
+    Await work unless the client disconnects or the request's deadline passes first;
+    then raise RequestCancelled. If this request leads key's coalesced call and
+    followers still wait on it, the call is handed off to them (coalesce.py);
+    otherwise its deadline is cancelled (which kills the running Ollama call, see
+    deadlines.py) and so is the task. The abandoned task's own outcome is retrieved
+    (and dropped) when it ends.
+    """
+    gone = asyncio.ensure_future(_disconnected(request))
+    try:
+        done, _ = await asyncio.wait({work, gone}, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        deadline.cancel("disconnected")
+        _abandon(work)
+        raise
+    finally:
+        gone.cancel()
+    if work in done:
+        return work.result()
+    reason = "disconnected" if gone in done else "deadline"
+    if COALESCER.handoff(key, deadline):
+        deadline.record(reason)
+        work.add_done_callback(_retrieve)
+        raise error_for(reason)
+    deadline.cancel(reason)
+    _abandon(work)
+    raise deadline.error()
+
+def _retrieve(work: asyncio.Future):
+    """Done callback for work nobody awaits any more: fetch its outcome, so it is not logged as never retrieved."""
+    if not work.cancelled():
+        work.exception()
+
+def _abandon(work: asyncio.Future):
+    work.cancel()
+    work.add_done_callback(_retrieve)
+
+def _cancelled(e: RequestCancelled, t0: float) -> JSONResponse:
+    """504 when the deadline passed; 499 (nobody reads it) when the client went away."""
+    log.info(f"cancelled after {_ms_since(t0):.0f} ms: {e}")
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, route="cancelled")
+    return JSONResponse({"error": str(e)}, status_code=504 if isinstance(e, DeadlineExceeded) else 499)
+
+def _flight_key(query: str, optimistic: bool) -> str:
+    """Coalescing key: an optimistic answer (not yet verified) is only shared with optimistic requests."""
+    key = normalize(query)
+    return f"optimistic:{key}" if optimistic else key
+
+async def _admitted_answer(query: str, optimistic: bool = False):
+    ticket = await ADMISSION.acquire()
+    result = None
+    try:
+        result = await _answer(query, optimistic, ticket)
+        return result
+    finally:
+        if not (isinstance(result, dict) and result.get("verification") == "verifying"):
+            ticket.release()  # else the background verification releases it
+
+def _shared_result(result, t0: float):
+    """A follower's copy of the leader's /chat result: marked coalesced, timed from the follower's arrival."""
+    if isinstance(result, JSONResponse):
+        COALESCER.errors_shared += 1
+        return result
+    if result["route"] == "llm":
+        COALESCER.record_saved()
+    log.info(f"coalesced with an in-flight request (route={result['route']})")
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, route="coalesced")
+    return {**result, "coalesced": True, "timings": {"coalesced_wait_ms": _ms_since(t0), "total_ms": _ms_since(t0)}}
+
+def _ms_since(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 3)
+
+@contextmanager
+def _stage(name: str, timings: dict):
+    """Time one pipeline stage into the response timings (ms) and the rag_stage_seconds histogram."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        timings[f"{name}_ms"] = round(elapsed * 1000, 3)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+
+async def _route(query: str, timings: dict):
+    """
+    Run the cheap stages and any fast path that can answer without the LLM.
+    Returns (result, q_emb, retrieved, max_score); result is a complete response
+    when a fast path answered, else None and generation should proceed.
+    Per-stage wall times (ms) are recorded into timings.
+    """
+    # Pure greetings get a template reply; no retrieval needed
+    reply = greeting_reply(query)
+    if reply is not None:
+        record_route("greeting")
+        return {"answer": reply, "is_ood": False, "retrieved": [], "verified": True, "max_score": 0.0,
+                "cached": False, "route": "greeting"}, None, [], 0.0
+
+    # Decisive exact-keyword hit (LEXICAL_SHORTCUT): skip query encoding and the embedding-keyed cache
+    q_emb = None
+    with _stage("lexical", timings):
+        shortcut = await run_cpu(lexical_shortcut, query)
+    if shortcut is not None:
+        retrieved, is_ood, max_score = shortcut
+    else:
+        # Semantic cache: a paraphrase of an already-verified question skips generate/verify
+        with _stage("encode", timings):
+            q_emb = await run_cpu(encode_query, query)
+        cached = ANSWER_CACHE.get(q_emb) if CACHE_ENABLED else None
+        if cached is not None:
+            log.info("cache hit")
+            record_route("cache")
+            return {**cached, "cached": True, "route": "cache"}, q_emb, cached["retrieved"], cached["max_score"]
+
+        # Retrieval (dense + BM25 fused in hybrid mode)
+        with _stage("search", timings):
+            retrieved, is_ood, max_score = await run_cpu(search, query, q_emb=q_emb)
+    log.info(f"retrieved={len(retrieved)} is_ood={is_ood} max_score={max_score:.4f}")
 
     # If OOD return fallback and let UI open support modal
     if is_ood:
-        return {"answer": FALLBACK_TEXT, "is_ood": True, "retrieved": retrieved, "max_score": max_score, "verified": False}
+        record_route("ood")
+        return {"answer": FALLBACK_TEXT, "is_ood": True, "retrieved": retrieved, "max_score": max_score,
+                "verified": False, "cached": False, "route": "ood"}, q_emb, retrieved, max_score
+
+    # High-confidence hit on a line with a precomputed, pre-verified answer
+    answer = precomputed_answer(retrieved, max_score)
+    if answer is not None:
+        record_route("precomputed")
+        return {"answer": answer, "is_ood": False, "retrieved": retrieved, "verified": True, "max_score": max_score,
+                "cached": False, "route": "precomputed"}, q_emb, retrieved, max_score
+
+    record_route("llm")
+    return None, q_emb, retrieved, max_score
+
+async def _answer(query: str, optimistic: bool = False, ticket=None):
+    start = time.perf_counter()
+    timings = {}
+    result, q_emb, retrieved, max_score = await _route(query, timings)
+    if result is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=result["route"])
+        return {**result, "timings": {**timings, "total_ms": _ms_since(start)}}
 
     # Build prompt and generate
-    prompt = build_generation_prompt(query, retrieved)
-    print(f"[main] Prompt length: {len(prompt)}")
+    packing = {}
+    with _stage("prompt", timings):
+        prompt = build_generation_prompt(query, retrieved, packing)
+    record_packing(packing)
+    log.info(f"Prompt length: {len(prompt)} context lines={packing['lines_used']}/{packing['lines_in']} "
+             f"tokens_saved={packing['tokens_saved']}")
     try:
-        gen = run_ollama_mistral(prompt)
+        with _stage("generate", timings):
+            gen = await run_llm(run_ollama_mistral, prompt)
+    except RequestCancelled:
+        raise
     except Exception as e:
-        print(f"[main] generator error: {e}")
+        log.error(f"generator error: {e}")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route="error")
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    if optimistic and gen.strip() != FALLBACK_TEXT:
+        # Answer now; the verdict is polled from /chat/verdict/{response_id} (verdicts.py).
+        # The request's admission slot stays taken until its verification is done.
+        response_id = VERDICTS.start(_verify_later(query, retrieved, gen, q_emb, max_score, ticket))
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route="llm")
+        return {"answer": gen, "is_ood": False, "retrieved": retrieved, "verified": None, "max_score": max_score,
+                "verification": "verifying", "response_id": response_id, "cached": False, "route": "llm",
+                "context": packing, "timings": {**timings, "total_ms": _ms_since(start)}}
+
     # Verify (strict)
-    verified, final = verify_answer(query, retrieved, gen)
-    print(f"[main] verification: verified={verified}")
-    return {"answer": final, "is_ood": False, "retrieved": retrieved, "verified": verified, "max_score": max_score}
+    verified, final = await _verify(query, retrieved, gen, q_emb, max_score, timings)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route="llm")
+    return {"answer": final, "is_ood": False, "retrieved": retrieved, "verified": verified, "max_score": max_score,
+            "cached": False, "route": "llm", "context": packing, "timings": {**timings, "total_ms": _ms_since(start)}}
+
+async def _verify(query: str, retrieved, answer: str, q_emb, max_score: float, timings: dict):
+    """verify_answer in LLM_POOL; a verified answer goes into the answer cache. Returns (verified, final_answer)."""
+    with _stage("verify", timings):
+        verified, final = await run_llm(verify_answer, query, retrieved, answer)
+    log.info(f"verification: verified={verified}")
+    if verified and CACHE_ENABLED and q_emb is not None:
+        ANSWER_CACHE.put(q_emb, {"answer": final, "is_ood": False, "retrieved": retrieved, "verified": True,
+                                 "max_score": max_score})
+    return verified, final
+
+async def _verify_later(query: str, retrieved, answer: str, q_emb, max_score: float, ticket=None):
+    """
+    _verify for an optimistic answer, after its response went out: under a deadline of
+    its own (VERIFY_BUDGET seconds, which stops a hung verifier call), holding the
+    request's admission ticket (released when done).
+    """
+    try:
+        with request_deadline(VERIFY_BUDGET) as deadline:
+            deadline.arm()
+            try:
+                return await _verify(query, retrieved, answer, q_emb, max_score, {})
+            finally:
+                deadline.disarm()
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _chat_events(query: str, ticket, trace_id: str = None, optimistic: bool = False):
+    """
+    Server-Sent Events for one chat turn, as (event, data) pairs (see _sse_stream):
+      sources -> retrieved lines, sent before generation starts
+      token   -> generated text fragments as the model produces them
+      done    -> final answer + verification verdict + timings (+ trace_id)
+      verdict -> optimistic only: done carried the unverified answer ("verifying"),
+                 this is its verdict (a retracted answer is replaced by FALLBACK_TEXT)
+      error   -> generation failed or the request's deadline passed
+    ticket (the admission slot) is released when the stream ends. A client that goes
+    away (the stream is cancelled or closed) cancels the request's deadline, which
+    stops the running Ollama call.
+    """
+    traced = {"trace_id": trace_id} if trace_id else {}
+    t0 = time.perf_counter()
+    try:
+        with trace_context(trace_id), request_deadline() as deadline:
+            deadline.arm()
+            try:
+                async for item in _chat_turn(query, t0, traced, optimistic):
+                    yield item
+            except RequestCancelled as e:
+                REQUEST_SECONDS.observe(time.perf_counter() - t0, route="cancelled")
+                log.info(f"/chat/stream cancelled: {e}")
+                if isinstance(e, DeadlineExceeded):
+                    yield "error", {"error": str(e), **traced}
+            except (asyncio.CancelledError, GeneratorExit):
+                deadline.cancel("disconnected")
+                raise
+            finally:
+                deadline.disarm()
+    finally:
+        ticket.release()
+
+async def _chat_turn(query: str, t0: float, traced: dict, optimistic: bool = False):
+    """The events of _chat_events, run inside the request's deadline."""
+    timings = {}
+    result, q_emb, retrieved, max_score = await _route(query, timings)
+    yield "sources", {"retrieved": retrieved, "is_ood": bool(result and result["is_ood"]), "max_score": max_score}
+    if result is not None:
+        if not result["is_ood"]:
+            yield "token", {"text": result["answer"]}
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, route=result["route"])
+        yield "done", {**{k: v for k, v in result.items() if k != "retrieved"},
+                       "total_ms": (time.perf_counter() - t0) * 1000, "timings": timings, **traced}
+        return
+
+    packing = {}
+    with _stage("prompt", timings):
+        prompt = build_generation_prompt(query, retrieved, packing)
+    record_packing(packing)
+    parts = []
+    ttft_ms = None
+    try:
+        with _stage("generate", timings):
+            async for tok in iterate_in(LLM_POOL, stream_ollama_mistral(prompt)):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - t0) * 1000
+                parts.append(tok)
+                yield "token", {"text": tok}
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        log.error(f"generator error: {e}")
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, route="error")
+        yield "error", {"error": str(e), **traced}
+        return
+    gen_ms = (time.perf_counter() - t0) * 1000
+    answer = "".join(parts).strip()
+    done = {"is_ood": False, "max_score": max_score, "cached": False, "route": "llm", "ttft_ms": ttft_ms,
+            "generate_ms": gen_ms, "context": packing, **traced}
+    optimistic = optimistic and answer != FALLBACK_TEXT
+    if optimistic:
+        # the answer goes out now; the verdict follows as the stream's last event (verdicts.py)
+        yield "done", {**done, "answer": answer, "verified": None, "verification": "verifying",
+                       "total_ms": gen_ms, "timings": dict(timings)}
+
+    verified, final = await _verify(query, retrieved, answer, q_emb, max_score, timings)
+    total_ms = (time.perf_counter() - t0) * 1000
+    REQUEST_SECONDS.observe(total_ms / 1000, route="llm")
+    log.info(f"/chat/stream verified={verified} ttft_ms={ttft_ms or 0:.1f} total_ms={total_ms:.1f}")
+    if optimistic:
+        VERDICTS.record(verified)
+        yield "verdict", {**verdict(verified, final), "verify_ms": timings["verify_ms"], "total_ms": total_ms}
+        return
+    yield "done", {**done, "answer": final, "verified": verified, "total_ms": total_ms, "timings": timings}
+
+async def _sse_stream(events, trace_id: str = None, shared: bool = False):
+    """
+    Format (event, data) pairs as SSE. shared: a follower replaying another request's
+    stream; its done/error events are marked coalesced and carry its own trace id.
+    """
+    t0 = time.perf_counter()
+    traced = {"trace_id": trace_id} if trace_id else {}
+    try:
+        async for event, data in events:
+            if shared and event in ("done", "error"):
+                data = {**{k: v for k, v in data.items() if k != "trace_id"}, "coalesced": True, **traced}
+                if event == "done" and data["route"] == "llm":
+                    COALESCER.record_saved()
+                if event == "done":
+                    REQUEST_SECONDS.observe(time.perf_counter() - t0, route="coalesced")
+            yield _sse(event, data)
+    except LeaderAborted as e:
+        log.warning(str(e))
+        yield _sse("error", {"error": "the shared request was interrupted, please retry", "coalesced": True, **traced})
+
+@APP.post("/chat/stream")
+async def chat_stream(request: Request):
+    payload = await request.json()
+    query = payload.get("query", "").strip()
+    if not query:
+        return JSONResponse({"error":"empty query"}, status_code=400)
+    optimistic = bool(payload.get("optimistic", OPTIMISTIC_VERIFY))
+    # an identical question already streaming is replayed to this client instead of run again
+    key = _flight_key(query, optimistic)
+    ticket = None
+    if not COALESCER.streaming(key):
+        try:
+            ticket = await ADMISSION.acquire()
+        except OverloadedError as e:
+            return _busy(e)
+        if COALESCER.streaming(key):  # an identical stream started while this one queued
+            ticket.release()
+            ticket = None
+    trace_id = _trace_id(request, payload)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if trace_id:
+        headers["X-Trace-Id"] = trace_id
+    if ticket is None:
+        return StreamingResponse(_sse_stream(COALESCER.follow(key), trace_id, shared=True),
+                                 media_type="text/event-stream", headers=headers)
+    # the background task covers a client that disconnects before the stream starts
+    return StreamingResponse(_sse_stream(COALESCER.lead(key, _chat_events(query, ticket, trace_id, optimistic))),
+                             media_type="text/event-stream", headers=headers, background=BackgroundTask(ticket.release))
+
+@APP.get("/chat/verdict/{response_id}")
+async def chat_verdict(response_id: str, wait: float = VERDICT_WAIT):
+    """Verdict for an optimistic /chat answer; waits up to wait seconds while its verification is still running."""
+    result = await VERDICTS.get(response_id, min(max(wait, 0.0), VERDICT_WAIT))
+    if result is None:
+        return JSONResponse({"error": "unknown or expired response_id"}, status_code=404)
+    return result
+
+async def _batch_lines(items, top_k: int, start: int, ticket):
+    try:
+        async for result in iterate_in(BATCH_POOL, run_batch(items, top_k, concurrency=BATCH_CONCURRENCY, start=start)):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    finally:
+        ticket.release()
+
+@APP.post("/chat/batch")
+async def chat_batch(request: Request):
+    """
+    Answer many questions in one request: {"queries": [...]} or {"items": [{"id", "query"}]},
+    optional "top_k" and "start" (index to resume from). Streams one JSON line per
+    question, in input order (see batch.py). Takes a single admission slot.
+    """
+    payload = await request.json()
+    items = payload.get("items") or [{"id": i, "query": q} for i, q in enumerate(payload.get("queries", []))]
+    items = [{"id": it.get("id", i), "query": str(it.get("query", "")).strip()} for i, it in enumerate(items)]
+    if not items or any(not it["query"] for it in items):
+        return JSONResponse({"error": "empty query"}, status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"at most {BATCH_MAX_ITEMS} queries per batch"}, status_code=413)
+    try:
+        top_k = int(payload.get("top_k", retrieval.DEFAULT_TOP_K))
+        start = int(payload.get("start", 0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "top_k and start must be integers"}, status_code=400)
+    if top_k < 1 or start < 0:
+        return JSONResponse({"error": "top_k must be >= 1 and start >= 0"}, status_code=400)
+    try:
+        ticket = await ADMISSION.acquire()
+    except OverloadedError as e:
+        return _busy(e)
+    log.info(f"/chat/batch items={len(items)} start={start}")
+    return StreamingResponse(_batch_lines(items, top_k, start, ticket), media_type="application/x-ndjson",
+                             background=BackgroundTask(ticket.release))
+
+# Probes for the orchestrator: liveness never waits on the model; readiness only once warm
+@APP.get("/healthz")
+async def healthz():
+    return {"status": "ok", "state": _startup["state"]}
+
+@APP.get("/readyz")
+async def readyz():
+    return JSONResponse(_startup, status_code=200 if _startup["state"] == "ready" else 503)
+
+# Runtime counters: admission queue, executor queues, answer cache, routes, context packing, verifier tiers,
+# coalescing, cancelled requests and optimistic verdicts
+@APP.get("/stats")
+async def stats():
+    return {"admission": ADMISSION.stats(), "pools": pool_stats(), "answer_cache": ANSWER_CACHE.stats(),
+            "routes": router_stats(), "retrieval": retrieval_stats(), "context": packer_stats(),
+            "verifier": verifier_stats(), "coalescing": COALESCER.stats(), "cancellations": cancellation_stats(),
+            "optimistic": VERDICTS.stats(), "startup": _startup}
+
+# The same counters plus stage/request latency histograms, in Prometheus text format
+def _counter_items(stats: dict, label: str, keys=None):
+    return [({label: k}, v) for k, v in stats.items() if (keys is None or k in keys) and isinstance(v, int)]
+
+register_collector("rag_requests_total", "counter", "Chat requests by the route that answered them (ood = fallback).",
+                   lambda: _counter_items(router_stats(), "route"))
+register_collector("rag_verification_total", "counter", "Verifier decisions by tier and outcome.",
+                   lambda: _counter_items(verifier_stats(), "outcome"))
+register_collector("rag_answer_cache_lookups_total", "counter", "Semantic answer cache lookups.",
+                   lambda: _counter_items(ANSWER_CACHE.stats(), "result", ("hits", "misses")))
+register_collector("rag_answer_cache_entries", "gauge", "Entries in the semantic answer cache.",
+                   lambda: [(None, ANSWER_CACHE.stats()["entries"])])
+register_collector("rag_retrieval_total", "counter", "Retrieval calls by path (dense, hybrid, lexical shortcut).",
+                   lambda: _counter_items(retrieval_stats(), "path"))
+register_collector("rag_context_tokens_total", "counter", "Retrieved-context tokens before packing (in) and sent to the LLM (used).",
+                   lambda: [({"kind": "in"}, packer_stats()["tokens_in"]), ({"kind": "used"}, packer_stats()["tokens_used"])])
+register_collector("rag_admission_total", "counter", "Chat requests admitted or rejected with 503.",
+                   lambda: _counter_items(ADMISSION.stats(), "result", ("admitted", "rejected")))
+register_collector("rag_inflight_requests", "gauge", "Chat requests running the pipeline.",
+                   lambda: [(None, ADMISSION.in_flight)])
+register_collector("rag_queue_depth", "gauge", "Chat requests waiting for an admission slot, and tasks waiting for an executor thread.",
+                   lambda: [({"queue": "admission"}, ADMISSION.waiting)] +
+                           [({"queue": name}, p["queued"]) for name, p in pool_stats().items()])
+
+register_collector("rag_coalesced_requests_total", "counter", "Chat requests that ran the pipeline (leader) or shared an identical in-flight one (follower).",
+                   lambda: [({"role": "leader"}, COALESCER.leaders), ({"role": "follower"}, COALESCER.followers)])
+register_collector("rag_llm_calls_saved_total", "counter", "LLM generations (+ verifications) avoided by coalescing identical requests.",
+                   lambda: [(None, COALESCER.llm_calls_saved)])
+register_collector("rag_cancelled_requests_total", "counter", "Chat requests cut short: client disconnected or deadline (REQUEST_TIMEOUT) passed.",
+                   lambda: _counter_items(cancellation_stats(), "reason"))
+register_collector("rag_optimistic_verdicts_total", "counter", "Background verdicts on answers sent before verification (retracted = replaced by the fallback).",
+                   lambda: _counter_items(VERDICTS.counts, "verdict"))
+register_collector("rag_ready", "gauge", "1 once the background warm-up has loaded the model and index.",
+                   lambda: [(None, int(_startup["state"] == "ready"))])
+register_collector("rag_startup_seconds", "gauge", "Time to import the app and to warm up the model and index.",
+                   lambda: [({"phase": "import"}, _startup["import_s"])] +
+                           ([({"phase": "warmup"}, _startup["warmup_s"])] if _startup["warmup_s"] is not None else []))
+
+@APP.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 # Feedback endpoint: saves a txt file with rating and comments
 @APP.post("/feedback")
@@ -462,7 +1034,7 @@ async def feedback(user: str = Form(...), rating: int = Form(...), comments: str
     fname = FEEDBACK_DIR / f"feedback_{ts}_{uuid.uuid4().hex}.txt"
     with open(fname, "w", encoding="utf-8") as f:
         f.write(f"user: {user}\nrating: {rating}\ncomments:\n{comments}\n\nanswer:\n{answer}\n")
-    print(f"[main] saved feedback -> {fname}")
+    log.info(f"saved feedback -> {fname}")
     return {"status":"saved", "path": str(fname)}
 
 # Support endpoint: saves a JSON file with user support request
@@ -473,13 +1045,64 @@ async def support(name: str = Form(...), email: str = Form(None), message: str =
     data = {"name": name, "email": email, "message": message, "ts": ts}
     with open(fname, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"[main] saved support -> {fname}")
+    log.info(f"saved support -> {fname}")
     return {"status":"saved", "path": str(fname)}
 
-# Optional: upload new context and re-ingest
+# Admin: snapshot versions, hot reload and rollback.
+# With ADMIN_TOKEN set, a matching X-Admin-Token header is required; without it only
+# loopback clients are let in (fail closed).
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+def _admin_denied(request: Request):
+    if ADMIN_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get("x-admin-token", "").encode("utf-8"),
+                                      ADMIN_TOKEN.encode("utf-8"))
+    else:
+        allowed = request.client is not None and request.client.host in LOOPBACK_HOSTS
+    if not allowed:
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return None
+
+@APP.get("/admin/snapshots")
+async def admin_snapshots(request: Request):
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    return {"active": storage.current_version(), "serving": retrieval.current_snapshot().info(),
+            "snapshots": storage.list_snapshots()}
+
+@APP.post("/admin/rollback")
+async def admin_rollback(request: Request):
+    """Activate payload["version"], or the snapshot before the active one, and reload."""
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    payload = await request.json() if (await request.body()) else {}
+    version = payload.get("version") or storage.previous_version()
+    if not version:
+        return JSONResponse({"error": "no earlier snapshot to roll back to"}, status_code=400)
+    try:
+        await run_cpu(_activate, version)
+        snap = await run_cpu(retrieval.reload)
+    except (FileNotFoundError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {"status": "rolled back", "serving": snap.info()}
+
+def _activate(version: str):
+    with storage.write_lock():  # not in the middle of an ingest that would commit over it
+        storage.activate(version)
+
+# Upload context and re-ingest incrementally (mode: replace | append | delete)
 @APP.post("/upload_context")
-async def upload_context(file: UploadFile = File(...)):
-    text = (await file.read()).decode("utf-8", errors="ignore")
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    ingest_file(lines)
-    return {"status":"ingested", "lines": len(lines)}
+async def upload_context(file: UploadFile = File(...), mode: str = Form("replace")):
+    if mode not in INGEST_MODES:
+        return JSONResponse({"error": f"mode must be one of {list(INGEST_MODES)}"}, status_code=400)
+    # stream the spooled upload through the chunker instead of reading it into memory
+    lines = io.TextIOWrapper(file.file, encoding="utf-8", errors="ignore")
+    try:
+        summary = await run_cpu(ingest_lines, lines, mode=mode, source=file.filename)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    await run_cpu(retrieval.reload)  # other workers pick it up within RELOAD_CHECK_SECONDS
+    return {"status":"ingested", **summary}
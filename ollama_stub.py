@@ -0,0 +1,116 @@
+# ollama_stub.py
+"""
+Deterministic stand-in for the Ollama REST API, for local testing without a model.
+
+Implements POST /api/generate (streaming NDJSON and non-streaming) and GET /api/tags.
+Verification prompts are answered "YES"; generation prompts get a short answer
+built from the first CONTEXT line so citations stay grounded.
+
+    python ollama_stub.py --port 11434 --tokens-per-sec 50
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CTX_LINE_RE = re.compile(r"^\[(\d+)\]\s*(.+)$", re.MULTILINE)
+
+
+def stub_completion(prompt: str) -> str:
+    """Return the canned completion for prompt."""
+    if "YES or NO" in prompt:
+        return "YES"
+    m = CTX_LINE_RE.search(prompt)
+    if not m:
+        return "Sorry, I cannot answer that from the provided document. Would you like to contact support?"
+    return f"Start from the Amazon homepage. {m.group(2).strip()} [{m.group(1)}]"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    disable_nagle_algorithm = True
+    tokens_per_sec = 0.0           # 0 = no artificial delay
+    model = "mistral"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):  # the client gave up (e.g. timed out)
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": f"{self.model}:latest"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": "invalid json"})
+        if self.path != "/api/generate":
+            return self._send_json(404, {"error": "not found"})
+
+        text = stub_completion(payload.get("prompt", ""))
+        tokens = re.findall(r"\S+\s*", text)
+        delay = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+        if payload.get("stream", True) is False:
+            time.sleep(delay * len(tokens))
+            return self._send_json(200, {"model": payload.get("model", self.model), "response": text, "done": True})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for tok in tokens:
+                time.sleep(delay)
+                self._write_chunk({"response": tok, "done": False})
+            self._write_chunk({"response": "", "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _write_chunk(self, obj):
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, tokens_per_sec: float = 0.0):
+    """
+    Start the stub in a daemon thread. Returns (server, base_url); call server.shutdown() to stop.
+    port=0 picks a free port.
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"tokens_per_sec": tokens_per_sec})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stub Ollama server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--tokens-per-sec", type=float, default=0.0)
+    args = ap.parse_args()
+    server, url = start_stub_server(args.host, args.port, args.tokens_per_sec)
+    print(f"[ollama_stub] serving on {url} (tokens/sec={args.tokens_per_sec or 'unlimited'})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
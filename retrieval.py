@@ -1,47 +1,488 @@
 # retrieval.py
 import faiss
-import pickle
+import os
+import queue
+import threading
+import time
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from pathlib import Path
-from embeddings import get_embedder
+import deadlines
+from ann import RERANK_FACTOR, RERANKED_TYPES, configure, index_kind
+from embeddings import embedder_id, get_embedder
+from lexical import BM25Index
+from search_service import SEARCH_SERVICE_URL, SearchServiceClient
+from storage import EMB_FILE, current_dir, current_version, open_lines, read_index, read_manifest
+from telemetry import get_logger
 
-STORAGE_DIR = Path("storage")
-INDEX_PATH = STORAGE_DIR / "faiss.index"
-META_PATH = STORAGE_DIR / "meta.pkl"
+log = get_logger("retrieval")
 
 DEFAULT_TOP_K = 5
 DEFAULT_THRESHOLD = 0.20
 
-# Load index & metadata at import time
-if not INDEX_PATH.exists() or not META_PATH.exists():
-    raise FileNotFoundError("Run ingest.py first to create storage/faiss.index and storage/meta.pkl")
+# Micro-batching: concurrent queries are encoded / searched together. A batch takes the
+# queries that queued up while the previous one ran; lingering (BATCH_MAX_WAIT_MS > 0)
+# to fill it only adds latency unless encoding a batch costs about the same as one query.
+BATCHING_ENABLED = os.environ.get("BATCHING_ENABLED", "1") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "0"))
+QUERY_LRU_SIZE = int(os.environ.get("QUERY_LRU_SIZE", "4096"))  # exact-text query embedding cache
 
-_index = faiss.read_index(str(INDEX_PATH))
-with open(str(META_PATH), "rb") as f:
-    _metadata = pickle.load(f)
+RELOAD_CHECK_SECONDS = float(os.environ.get("RELOAD_CHECK_SECONDS", "2"))  # how often to look for a new snapshot
 
-_embedder = get_embedder()
+# Shared search service (search_service.py): when set, encode/search go there and the
+# model + index are only loaded in this process if the service is unreachable.
+SEARCH_SERVICE_RETRY_SECONDS = float(os.environ.get("SEARCH_SERVICE_RETRY_SECONDS", "30"))
 
-def search(query: str, top_k: int = DEFAULT_TOP_K, threshold: float = DEFAULT_THRESHOLD):
+# Hybrid retrieval (opt-in): dense (FAISS) + BM25 (lexical.py) rankings fused with reciprocal
+# rank fusion. It changes the ranking and OOD detection: a query with a keyword match of
+# LEXICAL_MIN_STRENGTH or more is never OOD, whatever its cosine score.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "dense")  # "dense" or "hybrid"
+FUSION_CANDIDATES = int(os.environ.get("FUSION_CANDIDATES", "4"))  # each ranking contributes top_k * this
+RRF_K = 60
+LEXICAL_MIN_STRENGTH = float(os.environ.get("LEXICAL_MIN_STRENGTH", "0.7"))  # keyword match this strong is never OOD
+# Lexical shortcut: a decisive BM25 hit is answered without encoding the query at all
+LEXICAL_SHORTCUT = os.environ.get("LEXICAL_SHORTCUT", "0") == "1"
+LEXICAL_SHORTCUT_STRENGTH = float(os.environ.get("LEXICAL_SHORTCUT_STRENGTH", "0.9"))
+LEXICAL_SHORTCUT_MARGIN = float(os.environ.get("LEXICAL_SHORTCUT_MARGIN", "2.0"))  # top BM25 score / runner-up
+
+# Embedder vs index: a snapshot built by another embedder (model or backend) is checked
+# on warm-up by re-encoding a sample of its lines; below the cosine floor it is either
+# re-encoded (EMBED_REINGEST=1) or refused.
+EMBED_COMPAT_SAMPLE = int(os.environ.get("EMBED_COMPAT_SAMPLE", "64"))
+EMBED_COMPAT_MIN_COSINE = float(os.environ.get("EMBED_COMPAT_MIN_COSINE", "0.98"))
+EMBED_REINGEST = os.environ.get("EMBED_REINGEST", "0") == "1"
+
+class Snapshot:
     """
-    Returns: (retrieved_list, is_ood, max_score)
-     - retrieved_list: list of {idx,line_no,text,score}
-     - is_ood: True when max_score < threshold
+    One immutable version of the corpus: FAISS index + metadata (+ manifest).
+    Searches take a reference to the current Snapshot and use only it, so a reload
+    that swaps in a new one never disturbs searches already in flight (read-copy-update).
+    """
+
+    def __init__(self, directory: Path, version: str = None):
+        self.version = version or "legacy"
+        self.manifest = read_manifest(version) if version else {}
+        self.lines = open_lines(directory)  # memory-mapped; legacy meta.pkl is unpickled
+        self.index = read_index(directory)
+        self.index_type = index_kind(self.manifest)
+        configure(self.index)  # nprobe / efSearch
+        # stored vectors: exact re-rank for quantized indexes, cosine scores for lexical-only hits
+        self.vectors = np.load(directory / EMB_FILE, mmap_mode="r") if version else None
+        self.bm25 = BM25Index.open(directory) if version else None
+
+    def info(self) -> dict:
+        return {"version": self.version, "lines": len(self.lines), "ntotal": int(self.index.ntotal),
+                "index_type": self.index_type,
+                **{k: self.manifest.get(k) for k in ("model", "dim", "created", "checksum")}}
+
+    def rerank(self, queries: np.ndarray, candidates: np.ndarray, k: int):
+        """Exact inner-product scores for each query's candidate ids -> top-k (scores, ids)."""
+        D = np.full((len(queries), k), np.finfo("float32").min, dtype="float32")
+        I = np.full((len(queries), k), -1, dtype="int64")
+        for j, (q, cand) in enumerate(zip(queries, candidates)):
+            cand = cand[cand >= 0]
+            if not len(cand):
+                continue
+            rows = [self.lines.row_of(int(c)) for c in cand]
+            scores = np.asarray(self.vectors[rows], dtype="float32") @ q
+            order = np.argsort(-scores)[:k]
+            D[j, :len(order)] = scores[order]
+            I[j, :len(order)] = cand[order]
+        return D, I
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+_last_check = 0.0
+
+def reload(force: bool = False) -> Snapshot:
+    """
+    Load the snapshot CURRENT points at, if it is not the one already serving, and
+    swap it in. Returns the snapshot now serving.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        version = current_version()
+        if _snapshot is not None and not force and _snapshot.version == (version or "legacy"):
+            return _snapshot
+        snap = Snapshot(current_dir(), version)
+        previous = _snapshot.version if _snapshot is not None else None
+        _snapshot = snap  # atomic reference swap; old readers keep their own reference
+    log.info(f"serving snapshot {snap.version} ({len(snap.lines)} lines; previous={previous})")
+    return snap
+
+def current_snapshot() -> Snapshot:
+    """The snapshot to use for a new search; polls CURRENT every RELOAD_CHECK_SECONDS."""
+    global _last_check
+    now = time.monotonic()
+    if _snapshot is None or now - _last_check >= RELOAD_CHECK_SECONDS:
+        _last_check = now
+        try:
+            return reload()
+        except Exception as e:
+            if _snapshot is None:
+                raise
+            log.warning(f"reload failed, keeping {_snapshot.version}: {e}")
+    return _snapshot
+
+_remote = SearchServiceClient(SEARCH_SERVICE_URL) if SEARCH_SERVICE_URL else None
+_remote_down_until = 0.0
+
+def _call_remote(method: str, *args):
+    """
+    Call the shared search service; returns None (and skips the service for
+    SEARCH_SERVICE_RETRY_SECONDS) when it fails, so callers fall back to in-process.
+    """
+    global _remote_down_until
+    if _remote is None or time.monotonic() < _remote_down_until:
+        return None
+    try:
+        return getattr(_remote, method)(*args)
+    except Exception as e:
+        _remote_down_until = time.monotonic() + SEARCH_SERVICE_RETRY_SECONDS
+        log.warning(f"search service {SEARCH_SERVICE_URL} failed, using in-process search: {e}")
+        return None
+
+# The index & metadata load on first use (or in warm_up), not at import: importing
+# this module must stay fast and must not fail when storage is still empty.
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and processes them in one call.
+
+    A background thread takes every waiting item (up to max_batch) and calls
+    fn(items) -> results, resolving each caller's Future with its result (or the
+    batch's exception). With max_wait_ms > 0 it also lingers that long under load to
+    fill the batch; a lone caller on an idle batcher is processed immediately.
     """
-    q_emb = _embedder.encode([query], convert_to_numpy=True)
+
+    def __init__(self, fn, max_batch: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._last_size = 0
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut))
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+        return fut
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (len(batch) == 1 and self._last_size <= 1):
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self._last_size = len(batch)
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": (self.items / self.batches) if self.batches else 0.0}
+
+
+def _encode_batch(queries):
+    q_emb = get_embedder().encode(list(queries), convert_to_numpy=True, batch_size=len(queries))
     q_emb = q_emb.astype("float32")
     faiss.normalize_L2(q_emb)
-    D, I = _index.search(q_emb, top_k)
-    scores = D[0].tolist()
-    ids = I[0].tolist()
-    retrieved = []
-    for score, doc_idx in zip(scores, ids):
-        if doc_idx < 0:
-            continue
-        meta = _metadata[doc_idx]
-        retrieved.append({"idx": int(doc_idx), "line_no": int(meta["line_no"]), "text": meta["text"], "score": float(score)})
-    max_score = max(scores) if scores else 0.0
-    is_ood = max_score < threshold
-    # Debug log (printed to uvicorn console)
-    print(f"[retrieval] query={query!r} top_k={top_k} max_score={max_score:.4f} is_ood={is_ood}")
-    return retrieved, is_ood, float(max_score)
+    return [q_emb[i:i + 1] for i in range(len(queries))]
+
+def search_vectors(snap: Snapshot, queries: np.ndarray, k: int):
+    """One index search for an (n, dim) query matrix -> (D, I); quantized indexes are re-ranked exactly."""
+    if snap.index_type in RERANKED_TYPES:
+        return snap.rerank(queries, snap.index.search(queries, k * RERANK_FACTOR)[1], k)
+    return snap.index.search(queries, k)
+
+def _search_batch(requests):
+    """
+    requests: [(snapshot, q_emb (1, dim), top_k)] -> [(scores, ids)], with one
+    index.search per snapshot present in the batch (normally just one).
+    """
+    results = [None] * len(requests)
+    groups = {}
+    for i, (snap, _, _) in enumerate(requests):
+        groups.setdefault(id(snap), []).append(i)
+    for rows in groups.values():
+        snap = requests[rows[0]][0]
+        k = max(requests[i][2] for i in rows)
+        D, I = search_vectors(snap, np.vstack([requests[i][1] for i in rows]), k)
+        for j, i in enumerate(rows):
+            top_k = requests[i][2]
+            results[i] = (D[j, :top_k], I[j, :top_k])
+    return results
+
+_encode_batcher = MicroBatcher(_encode_batch, name="encode-batcher")
+_search_batcher = MicroBatcher(_search_batch, name="search-batcher")
+
+
+def _wait(fut: Future):
+    """A micro-batcher result; stops waiting once the current request is cancelled."""
+    poll = 0.25 if deadlines.current() is not None else None
+    while True:
+        try:
+            return fut.result(timeout=poll)
+        except FutureTimeout:
+            deadlines.check()
+
+_query_lru = OrderedDict()
+_query_lru_lock = threading.Lock()
+
+def encode_query(query: str) -> np.ndarray:
+    """
+    Embed a query the same way the corpus was embedded: (1, dim) float32, L2-normalized.
+    Repeated query texts are served from an LRU; new ones are micro-batched with
+    concurrent callers when BATCHING_ENABLED.
+    """
+    with _query_lru_lock:
+        q_emb = _query_lru.get(query)
+        if q_emb is not None:
+            _query_lru.move_to_end(query)
+            return q_emb
+    q_emb = _call_remote("encode", query)
+    if q_emb is None:
+        if BATCHING_ENABLED:
+            q_emb = _wait(_encode_batcher.submit(query))
+        else:
+            q_emb = _encode_batch([query])[0]
+    with _query_lru_lock:
+        _query_lru[query] = q_emb
+        while len(_query_lru) > QUERY_LRU_SIZE:
+            _query_lru.popitem(last=False)
+    return q_emb
+
+def encode_texts(texts):
+    """(n, dim) float32 L2-normalized embeddings for arbitrary texts (e.g. answer sentences)."""
+    vecs = _call_remote("encode_texts", list(texts))
+    if vecs is None:
+        vecs = get_embedder().encode(list(texts), convert_to_numpy=True).astype("float32")
+        faiss.normalize_L2(vecs)
+    return vecs
+
+def embedder_compatibility(snap: Snapshot) -> dict:
+    """
+    Whether the current embedder produces vectors the snapshot's index can be searched
+    with: same embedder id, or mean cosine >= EMBED_COMPAT_MIN_COSINE between stored and
+    freshly encoded vectors for an evenly spaced sample of lines.
+    """
+    current, built = embedder_id(), snap.manifest.get("embedder")
+    result = {"embedder": current, "index_embedder": built, "compatible": True}
+    if built == current or snap.vectors is None or not len(snap.lines):
+        return result
+    rows = np.unique(np.linspace(0, len(snap.lines) - 1, min(EMBED_COMPAT_SAMPLE, len(snap.lines))).astype(int))
+    fresh = encode_texts([snap.lines.row(int(r))["text"] for r in rows])
+    if fresh.shape[1] != snap.vectors.shape[1]:
+        return {**result, "compatible": False, "reason": f"dim {fresh.shape[1]} != {snap.vectors.shape[1]}"}
+    cosine = np.sum(fresh * np.asarray(snap.vectors[rows], dtype="float32"), axis=1)
+    return {**result, "compatible": bool(cosine.mean() >= EMBED_COMPAT_MIN_COSINE),
+            "mean_cosine": round(float(cosine.mean()), 4), "min_cosine": round(float(cosine.min()), 4)}
+
+def warm_up() -> dict:
+    """
+    Pay the first request's costs up front: load the snapshot and the embedding model,
+    check they match (embedder_compatibility), then run one dummy encode + index
+    search (allocates buffers, touches the mmaps).
+    Behind a search service only the encode runs (through the service).
+    Returns seconds per step; raises if the index or model cannot be loaded.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    snap = None
+    if _remote is None:
+        snap = current_snapshot()
+        timings["index_s"] = round(time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+        get_embedder()
+        timings["model_s"] = round(time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+        compat = embedder_compatibility(snap)
+        if not compat["compatible"]:
+            if not EMBED_REINGEST:
+                raise RuntimeError(f"embedder {compat['embedder']} does not match the index ({compat}); "
+                                   f"run python ingest.py --reembed or set EMBED_REINGEST=1")
+            log.warning(f"embedder changed, re-encoding the corpus: {compat}")
+            from ingest import reembed  # ingest imports the answer pipeline; only needed here
+            reembed()
+            snap = reload(force=True)
+        timings["embedder_check_s"] = round(time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+    q_emb = encode_texts(["warm-up"])
+    timings["encode_s"] = round(time.perf_counter() - t0, 3)
+    if snap is not None:
+        t0 = time.perf_counter()
+        search_vectors(snap, q_emb, DEFAULT_TOP_K)
+        timings["search_s"] = round(time.perf_counter() - t0, 3)
+    return timings
+
+def clear_query_cache():
+    with _query_lru_lock:
+        _query_lru.clear()
+
+_counts = {"dense": 0, "hybrid": 0, "lexical_shortcut": 0}
+_counts_lock = threading.Lock()
+
+def _count(key: str):
+    with _counts_lock:
+        _counts[key] += 1
+
+def retrieval_stats() -> dict:
+    with _counts_lock:
+        return dict(_counts)
+
+def _hit(meta: dict, doc_id: int, score: float) -> dict:
+    hit = {"idx": int(doc_id), "line_no": int(meta["line_no"]), "text": meta["text"], "score": float(score)}
+    if meta.get("source") or meta.get("line_start"):
+        hit.update(source=meta.get("source"), line_start=meta.get("line_start"), line_end=meta.get("line_end"))
+    return hit
+
+def lexical_shortcut(query: str, top_k: int = DEFAULT_TOP_K, threshold: float = DEFAULT_THRESHOLD):
+    """
+    With LEXICAL_SHORTCUT on, answer from BM25 alone when it is decisive: the top row's
+    strength (see lexical.BM25Index.search) is >= LEXICAL_SHORTCUT_STRENGTH and its score is
+    LEXICAL_SHORTCUT_MARGIN times the runner-up's. Returns (retrieved, False, strength)
+    with BM25 strengths in [0, 1] as scores and the query never encoded, else None.
+    """
+    if not LEXICAL_SHORTCUT or RETRIEVAL_MODE != "hybrid":
+        return None
+    remote = _call_remote("shortcut", query, top_k, threshold)
+    if remote is not None:
+        return remote or None
+    snap = current_snapshot()
+    if snap.bm25 is None:
+        return None
+    rows, scores, strength = snap.bm25.search(query, top_k)
+    if not len(rows) or strength < LEXICAL_SHORTCUT_STRENGTH:
+        return None
+    if len(scores) > 1 and scores[0] < LEXICAL_SHORTCUT_MARGIN * scores[1]:
+        return None
+    retrieved = [_hit(snap.lines.row(int(r)), snap.lines.ids[r], strength * sc / scores[0])
+                 for r, sc in zip(rows, scores)]
+    _count("lexical_shortcut")
+    log.info(f"query={query!r} lexical shortcut strength={strength:.4f}")
+    return retrieved, False, float(strength)
+
+def _fuse(snap: Snapshot, query: str, q_emb: np.ndarray, D: np.ndarray, I: np.ndarray, top_k: int):
+    """
+    Reciprocal rank fusion of the dense candidates (D, I) with BM25's top candidates.
+    Returns ([(doc_id, cosine score)] best first, BM25 strength). Lines only BM25 found
+    are scored against the stored vectors, so every score stays a cosine similarity.
+    """
+    rrf, cosine, rows = {}, {}, {}
+    for rank, (score, doc_id) in enumerate(zip(D.tolist(), I.tolist())):
+        if doc_id >= 0:
+            rrf[doc_id] = 1.0 / (RRF_K + rank + 1)
+            cosine[doc_id] = score
+    lex_rows, _, strength = snap.bm25.search(query, len(I))
+    for rank, row in enumerate(lex_rows.tolist()):
+        doc_id = int(snap.lines.ids[row])
+        rrf[doc_id] = rrf.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        rows[doc_id] = row
+    for doc_id, row in rows.items():
+        if doc_id not in cosine:
+            cosine[doc_id] = float(np.asarray(snap.vectors[row], dtype="float32") @ q_emb[0])
+    # equal fused ranks (e.g. the two lists' number ones) are settled by cosine similarity
+    fused = sorted(rrf, key=lambda d: (rrf[d], cosine[d]), reverse=True)[:top_k]
+    return [(doc_id, cosine[doc_id]) for doc_id in fused], strength
+
+def _rank(snap: Snapshot, query: str, q_emb: np.ndarray, D: np.ndarray, I: np.ndarray, top_k: int,
+          threshold: float, hybrid: bool):
+    """One query's index candidates (D, I) -> (retrieved, is_ood, max_score, BM25 strength)."""
+    strength = 0.0
+    if hybrid:
+        ranked, strength = _fuse(snap, query, q_emb, D, I, top_k)
+        _count("hybrid")
+    else:
+        ranked = [(doc_id, score) for score, doc_id in zip(D.tolist(), I.tolist()) if doc_id >= 0]
+        _count("dense")
+    retrieved = [_hit(snap.lines.get(doc_id), doc_id, score) for doc_id, score in ranked]
+    max_score = max((score for _, score in ranked), default=0.0)
+    is_ood = max_score < threshold and strength < LEXICAL_MIN_STRENGTH
+    return retrieved, is_ood, float(max_score), strength
+
+def search(query: str, top_k: int = DEFAULT_TOP_K, threshold: float = DEFAULT_THRESHOLD, q_emb: np.ndarray = None):
+    """
+    Returns: (retrieved_list, is_ood, max_score)
+     - retrieved_list: list of {idx,line_no,text,score} (+ source,line_start,line_end when known)
+     - is_ood: True when max_score < threshold (and, in hybrid mode, no strong keyword match)
+    Pass q_emb (from encode_query) to reuse an embedding already computed for query.
+    In hybrid mode the dense and BM25 rankings are fused; scores stay cosine similarities.
+    Without q_emb, a decisive keyword hit may skip encoding (see lexical_shortcut).
+    """
+    deadlines.check()
+    remote = _call_remote("search", query, top_k, threshold, q_emb)
+    if remote is not None:
+        return remote
+    if q_emb is None:
+        shortcut = lexical_shortcut(query, top_k, threshold)
+        if shortcut is not None:
+            return shortcut
+        q_emb = encode_query(query)
+    snap = current_snapshot()
+    hybrid = RETRIEVAL_MODE == "hybrid" and snap.bm25 is not None
+    k = top_k * FUSION_CANDIDATES if hybrid else top_k
+    if BATCHING_ENABLED:
+        D, I = _wait(_search_batcher.submit((snap, q_emb, k)))
+    else:
+        D, I = _search_batch([(snap, q_emb, k)])[0]
+    retrieved, is_ood, max_score, strength = _rank(snap, query, q_emb, D, I, top_k, threshold, hybrid)
+    # One line per query through the rag.retrieval logger (see telemetry.py)
+    log.info(f"query={query!r} top_k={top_k} max_score={max_score:.4f} lexical={strength:.4f} is_ood={is_ood}")
+    return retrieved, is_ood, max_score
+
+def search_many(queries, top_k: int = DEFAULT_TOP_K, threshold: float = DEFAULT_THRESHOLD, q_embs: np.ndarray = None):
+    """
+    search() for a list of queries with one index search for all of them (bulk jobs).
+    q_embs: their (n, dim) embeddings, e.g. from encode_texts; computed in one batch if omitted.
+    Returns [(retrieved_list, is_ood, max_score)] in query order.
+    """
+    if not len(queries):
+        return []
+    remote = _call_remote("search_many", list(queries), top_k, threshold, q_embs)
+    if remote is not None:
+        return remote
+    if q_embs is None:
+        q_embs = encode_texts(queries)
+    snap = current_snapshot()
+    hybrid = RETRIEVAL_MODE == "hybrid" and snap.bm25 is not None
+    D, I = search_vectors(snap, q_embs, top_k * FUSION_CANDIDATES if hybrid else top_k)
+    results = []
+    for j, query in enumerate(queries):
+        retrieved, is_ood, max_score, _ = _rank(snap, query, q_embs[j:j + 1], D[j], I[j], top_k, threshold, hybrid)
+        results.append((retrieved, is_ood, max_score))
+    log.info(f"search_many queries={len(queries)} top_k={top_k} ood={sum(r[1] for r in results)}")
+    return results
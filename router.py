@@ -0,0 +1,102 @@
+# router.py
+"""
+Fast paths that answer without calling the LLM.
+
+ - greeting:    the query is only a greeting -> template reply, no retrieval either
+ - precomputed: the top retrieved line clears FASTPATH_MIN_SCORE (and beats the
+                runner-up by FASTPATH_MIN_MARGIN) and has a pre-verified answer that
+                `python ingest.py --precompute-answers` stored in storage/answers.json
+
+Every /chat response records which route served it ("greeting", "precomputed",
+"cache", "ood" or "llm") so the share of LLM traffic avoided can be measured.
+"""
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from generator import GREETINGS
+from ingest import ANSWERS_PATH
+from storage import line_key
+from telemetry import get_logger
+
+log = get_logger("router")
+
+FASTPATH_ENABLED = os.environ.get("FASTPATH_ENABLED", "1") == "1"
+FASTPATH_MIN_SCORE = float(os.environ.get("FASTPATH_MIN_SCORE", "0.80"))
+FASTPATH_MIN_MARGIN = float(os.environ.get("FASTPATH_MIN_MARGIN", "0.05"))
+
+GREETING_REPLY = ("Hi there! I'm your Amazon Help Assistant. Ask me how to do something on Amazon, "
+                  "for example tracking an order or listing a product, and I'll walk you through it "
+                  "step by step from the Amazon homepage.")
+
+# words that may accompany a greeting without turning it into a question
+_FILLER = {"there", "bot", "assistant", "amazon", "team", "everyone", "all", "again", "and",
+           "thanks", "thank", "you", "today", "so", "oh", "ok", "okay", "dear", "friend"}
+_GREETING_RES = [re.compile(rf"\b{re.escape(g)}\b") for g in sorted(GREETINGS, key=len, reverse=True)]
+
+ROUTES = ("greeting", "precomputed", "cache", "ood", "llm")
+_route_counts = {r: 0 for r in ROUTES}
+_lock = threading.Lock()
+
+_answers = {}
+_answers_mtime = None
+
+
+def is_pure_greeting(text: str) -> bool:
+    """True when text is a greeting and nothing else (e.g. "hi there!", "good morning")."""
+    t = text.lower()
+    matched = False
+    for rx in _GREETING_RES:
+        t, n = rx.subn(" ", t)
+        matched = matched or n > 0
+    rest = [w for w in re.findall(r"[a-z']+", t) if w not in _FILLER]
+    return matched and not rest
+
+
+def greeting_reply(query: str) -> Optional[str]:
+    if FASTPATH_ENABLED and is_pure_greeting(query):
+        return GREETING_REPLY
+    return None
+
+
+def _load_answers() -> Dict:
+    """(Re)load answers.json when it changed on disk."""
+    global _answers, _answers_mtime
+    try:
+        mtime = ANSWERS_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        _answers, _answers_mtime = {}, None
+        return _answers
+    if mtime != _answers_mtime:
+        with open(ANSWERS_PATH, "r", encoding="utf-8") as f:
+            _answers = json.load(f)
+        _answers_mtime = mtime
+        log.info(f"loaded {len(_answers)} precomputed answers")
+    return _answers
+
+
+def precomputed_answer(retrieved: List[Dict], max_score: float) -> Optional[str]:
+    """Pre-verified answer for the top retrieved line, if retrieval is confident enough."""
+    if not FASTPATH_ENABLED or not retrieved or max_score < FASTPATH_MIN_SCORE:
+        return None
+    if len(retrieved) > 1 and retrieved[0]["score"] - retrieved[1]["score"] < FASTPATH_MIN_MARGIN:
+        return None
+    with _lock:
+        answers = _load_answers()
+    entry = answers.get(line_key(retrieved[0]["text"]))
+    return entry["answer"] if entry else None
+
+
+def record_route(route: str):
+    with _lock:
+        _route_counts[route] += 1
+
+
+def router_stats() -> Dict:
+    with _lock:
+        stats = dict(_route_counts)
+    total = sum(stats.values())
+    stats["llm_avoided_rate"] = (total - stats["llm"]) / total if total else 0.0
+    return stats
@@ -0,0 +1,246 @@
+# search_service.py
+"""
+Optional out-of-process embedding + retrieval server for multi-worker deployments.
+
+One process holds the SentenceTransformer and the FAISS snapshot (with a fixed torch
+thread budget) and serves every uvicorn worker over local HTTP or a Unix socket, so
+model memory no longer grows with the number of web workers and their torch pools
+stop contending for cores. Concurrent requests from all workers share retrieval's
+micro-batcher.
+
+    python search_service.py --listen unix:///tmp/rag-search.sock --threads 4
+    SEARCH_SERVICE_URL=unix:///tmp/rag-search.sock python -m uvicorn main:APP --workers 4
+
+With SEARCH_SERVICE_URL set, retrieval.encode_query / search / search_many call this
+service transparently and fall back to in-process mode if it is unreachable.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from telemetry import get_logger
+
+log = get_logger("search_service")
+
+SEARCH_SERVICE_URL = os.environ.get("SEARCH_SERVICE_URL")  # http://host:port or unix:///path.sock
+SEARCH_SERVICE_TIMEOUT = float(os.environ.get("SEARCH_SERVICE_TIMEOUT", "10"))
+
+
+def pack_vector(vec: np.ndarray) -> Dict:
+    vec = np.ascontiguousarray(vec, dtype="<f4")
+    return {"shape": list(vec.shape), "b64": base64.b64encode(vec.tobytes()).decode("ascii")}
+
+
+def unpack_vector(obj: Dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(obj["b64"]), dtype="<f4").reshape(obj["shape"]).astype("float32")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class SearchServiceClient:
+    """Keep-alive client (one connection per calling thread) for the search service."""
+
+    def __init__(self, url: str, timeout: float = SEARCH_SERVICE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            parts = urlsplit(self.url)
+            if parts.scheme == "unix":
+                conn = _UnixHTTPConnection(parts.path, self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _post(self, path: str, payload: Dict) -> Dict:
+        body = json.dumps(payload).encode("utf-8")
+        for attempt in range(2):  # one retry for a keep-alive socket the server closed
+            conn = self._connection()
+            try:
+                conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+                continue
+            if resp.status != 200:
+                raise RuntimeError(f"search service error (HTTP {resp.status}): {data[:200]!r}")
+            return json.loads(data)
+
+    def encode(self, query: str) -> np.ndarray:
+        return unpack_vector(self._post("/encode", {"query": query})["embedding"])
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        return unpack_vector(self._post("/encode", {"texts": texts})["embedding"])
+
+    def search(self, query: str, top_k: int, threshold: float, q_emb: np.ndarray = None) -> Tuple[List[Dict], bool, float]:
+        payload = {"query": query, "top_k": top_k, "threshold": threshold}
+        if q_emb is not None:
+            payload["embedding"] = pack_vector(q_emb)
+        out = self._post("/search", payload)
+        return out["retrieved"], out["is_ood"], out["max_score"]
+
+    def search_many(self, queries: List[str], top_k: int, threshold: float,
+                    q_embs: np.ndarray = None) -> List[Tuple[List[Dict], bool, float]]:
+        payload = {"queries": list(queries), "top_k": top_k, "threshold": threshold}
+        if q_embs is not None:
+            payload["embeddings"] = pack_vector(q_embs)
+        out = self._post("/search_many", payload)
+        return [(r["retrieved"], r["is_ood"], r["max_score"]) for r in out["results"]]
+
+    def shortcut(self, query: str, top_k: int, threshold: float):
+        """retrieval.lexical_shortcut on the service; False when BM25 was not decisive."""
+        out = self._post("/shortcut", {"query": query, "top_k": top_k, "threshold": threshold})
+        return (out["retrieved"], out["is_ood"], out["max_score"]) if out.get("hit") else False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def address_string(self):
+        return "unix" if isinstance(self.client_address, str) else super().address_string()
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        import retrieval
+        if self.path == "/healthz":
+            self._send_json(200, {"status": "ok", "snapshot": retrieval.current_snapshot().info(),
+                                  "torch_threads": _torch_threads()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        import retrieval
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/encode":
+                vec = (retrieval.encode_texts(payload["texts"]) if "texts" in payload
+                       else retrieval.encode_query(payload["query"]))
+                return self._send_json(200, {"embedding": pack_vector(vec)})
+            if self.path == "/search":
+                q_emb = unpack_vector(payload["embedding"]) if "embedding" in payload else None
+                retrieved, is_ood, max_score = retrieval.search(
+                    payload["query"], top_k=int(payload.get("top_k", retrieval.DEFAULT_TOP_K)),
+                    threshold=float(payload.get("threshold", retrieval.DEFAULT_THRESHOLD)), q_emb=q_emb)
+                return self._send_json(200, {"retrieved": retrieved, "is_ood": is_ood, "max_score": max_score})
+            if self.path == "/search_many":
+                q_embs = unpack_vector(payload["embeddings"]) if "embeddings" in payload else None
+                results = retrieval.search_many(
+                    payload["queries"], top_k=int(payload.get("top_k", retrieval.DEFAULT_TOP_K)),
+                    threshold=float(payload.get("threshold", retrieval.DEFAULT_THRESHOLD)), q_embs=q_embs)
+                return self._send_json(200, {"results": [{"retrieved": r, "is_ood": o, "max_score": m}
+                                                         for r, o, m in results]})
+            if self.path == "/shortcut":
+                hit = retrieval.lexical_shortcut(
+                    payload["query"], top_k=int(payload.get("top_k", retrieval.DEFAULT_TOP_K)),
+                    threshold=float(payload.get("threshold", retrieval.DEFAULT_THRESHOLD)))
+                if hit is None:
+                    return self._send_json(200, {"hit": False})
+                return self._send_json(200, {"hit": True, "retrieved": hit[0], "is_ood": hit[1], "max_score": hit[2]})
+            self._send_json(404, {"error": "not found"})
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            log.warning(f"error: {e}")
+            self._send_json(500, {"error": str(e)})
+
+
+class _UnixHandler(_Handler):
+    disable_nagle_algorithm = False  # TCP_NODELAY does not apply to AF_UNIX
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def _torch_threads():
+    try:
+        import torch
+        return torch.get_num_threads()
+    except ImportError:
+        return None
+
+
+def serve(listen: str, threads: int = None):
+    """Load the model + index in this process and serve until interrupted."""
+    os.environ.pop("SEARCH_SERVICE_URL", None)  # the service itself always searches in-process
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+        import faiss
+        faiss.omp_set_num_threads(threads)
+    import retrieval
+    log.info(f"warm-up: {retrieval.warm_up()}")
+
+    parts = urlsplit(listen)
+    if parts.scheme == "unix":
+        if os.path.exists(parts.path):
+            os.unlink(parts.path)
+        server = _UnixHTTPServer(parts.path, _UnixHandler)
+    else:
+        server = ThreadingHTTPServer((parts.hostname or "127.0.0.1", parts.port or 8765), _Handler)
+        server.daemon_threads = True
+    log.info(f"serving on {listen} (torch threads={_torch_threads()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if parts.scheme == "unix" and os.path.exists(parts.path):
+            os.unlink(parts.path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Shared embedding + retrieval service")
+    ap.add_argument("--listen", default=SEARCH_SERVICE_URL or "http://127.0.0.1:8765",
+                    help="http://host:port or unix:///path.sock")
+    ap.add_argument("--threads", type=int, default=int(os.environ.get("SEARCH_SERVICE_THREADS", "0")) or None,
+                    help="torch/FAISS intra-op threads (default: library default)")
+    args = ap.parse_args()
+    serve(args.listen, args.threads)
@@ -0,0 +1,482 @@
+# storage.py
+"""
+On-disk layout of the retrieval corpus: immutable, versioned snapshots.
+
+    storage/
+      CURRENT                     <- name of the active snapshot (switched atomically)
+      snapshots/<version>/
+        faiss.index               <- loaded with FAISS mmap flags
+        embeddings.npy            <- normalized vectors, opened with mmap_mode="r"
+        texts.bin  offsets.npy    <- UTF-8 text blob + (n+1) int64 byte offsets
+        line_nos.npy  ids.npy     <- citation line numbers + FAISS ids per row
+        id_order.npy              <- argsort of ids, for id -> row lookups
+        spans.npy  source_ids.npy <- (first, last) source line + source file index per row
+        sources.json              <- source file names
+        bm25_*.npy  bm25_terms.json  <- BM25 inverted index in CSR form (see lexical.py)
+        manifest.json
+
+Everything is plain bytes or .npy opened through np.memmap, so uvicorn workers share
+the page cache, startup cost does not grow with the corpus, and nothing is unpickled.
+
+ingest.py writes every build into a fresh snapshot directory and only then points
+CURRENT at it, so a crash mid-write never exposes a half-written index. Builds (and
+rollbacks) hold write_lock(), so two of them, in any threads or processes, cannot
+both start from the same active snapshot and have the later commit drop the other's
+changes. Storage
+created before snapshots existed (meta.pkl files directly under storage/) is still
+readable and is treated as the active corpus until the first snapshot is committed;
+`python storage.py --convert` turns it into a snapshot.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from telemetry import get_logger
+
+log = get_logger("storage")
+
+STORAGE_DIR = Path(os.environ.get("STORAGE_DIR", "storage"))  # snapshots, CURRENT, answers.json, eval cache
+SNAPSHOTS_DIR = STORAGE_DIR / "snapshots"
+CURRENT_PATH = STORAGE_DIR / "CURRENT"
+
+INDEX_FILE = "faiss.index"
+EMB_FILE = "embeddings.npy"
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+LINE_NOS_FILE = "line_nos.npy"
+IDS_FILE = "ids.npy"
+ID_ORDER_FILE = "id_order.npy"
+SPANS_FILE = "spans.npy"
+SOURCE_IDS_FILE = "source_ids.npy"
+SOURCES_FILE = "sources.json"
+BM25_TERMS_FILE = "bm25_terms.json"
+BM25_INDPTR_FILE = "bm25_indptr.npy"
+BM25_ROWS_FILE = "bm25_rows.npy"
+BM25_TF_FILE = "bm25_tf.npy"
+BM25_DOCLEN_FILE = "bm25_doclen.npy"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "write.lock"
+DATA_FILES = (INDEX_FILE, EMB_FILE, TEXTS_FILE, OFFSETS_FILE, LINE_NOS_FILE, IDS_FILE, ID_ORDER_FILE,
+              SPANS_FILE, SOURCE_IDS_FILE, SOURCES_FILE,
+              BM25_TERMS_FILE, BM25_INDPTR_FILE, BM25_ROWS_FILE, BM25_TF_FILE, BM25_DOCLEN_FILE)
+LEGACY_META_FILE = "meta.pkl"  # pickled list of dicts, pre-snapshot storage only
+STORE_FORMAT = 2
+
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", "5"))  # older snapshots are pruned
+
+
+def line_key(text: str) -> str:
+    """Content hash of a corpus line; changes whenever the line's text does."""
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()
+
+
+def line_id(key: str) -> int:
+    """Stable FAISS id derived from a line_key (53 bits, so it survives JSON/JavaScript)."""
+    return int(key[:16], 16) & ((1 << 53) - 1)
+
+
+def current_version() -> Optional[str]:
+    try:
+        return CURRENT_PATH.read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_dir(version: str) -> Path:
+    return SNAPSHOTS_DIR / version
+
+
+def current_dir() -> Path:
+    """Directory holding the active corpus files (the legacy flat layout if no snapshot yet)."""
+    version = current_version()
+    return snapshot_dir(version) if version else STORAGE_DIR
+
+
+def corpus_version() -> str:
+    """
+    Identify the active corpus. Changes whenever a new snapshot is activated, so caches
+    derived from the corpus can tell they are stale (also across processes).
+    """
+    version = current_version()
+    if version:
+        return version
+    parts = []
+    for name in (INDEX_FILE, LEGACY_META_FILE):
+        try:
+            st = (STORAGE_DIR / name).stat()
+            parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except FileNotFoundError:
+            parts.append("missing")
+    return "legacy-" + "-".join(parts)
+
+
+def checksum(directory: Path) -> str:
+    h = hashlib.sha256()
+    for name in DATA_FILES:
+        path = directory / name
+        if not path.exists():
+            continue
+        h.update(name.encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+@contextmanager
+def write_lock():
+    """
+    Hold the corpus write lock (an exclusive lock on STORAGE_DIR/write.lock) for the
+    block: read the active snapshot -> build a new one -> commit it. Blocks until any
+    other writer, in this or another process, is done. Not reentrant.
+    """
+    STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STORAGE_DIR / LOCK_FILE, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10 s; keep waiting
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def new_snapshot() -> Tuple[str, Path]:
+    """Reserve a version name and return (version, staging_dir) to write the files into."""
+    version = datetime.now().strftime("v%Y%m%d_%H%M%S_%f")
+    staging = SNAPSHOTS_DIR / f".{version}.tmp"
+    staging.mkdir(parents=True, exist_ok=False)
+    return version, staging
+
+
+def commit_snapshot(version: str, staging: Path, manifest: Dict) -> Dict:
+    """
+    Seal a staged snapshot: write its manifest (with checksum), move it into place,
+    point CURRENT at it and prune old snapshots. Returns the manifest.
+    """
+    manifest = {**manifest, "version": version, "parent": current_version(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "checksum": checksum(staging)}
+    with open(staging / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(staging, snapshot_dir(version))
+    activate(version, verify=False)
+    prune()
+    return manifest
+
+
+def read_manifest(version: str) -> Dict:
+    if not version or "/" in version or "\\" in version or version.startswith("."):
+        raise ValueError(f"invalid snapshot version {version!r}")
+    with open(snapshot_dir(version) / MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def activate(version: str, verify: bool = True):
+    """Atomically make version the active snapshot; verify checks its files against the manifest."""
+    manifest = read_manifest(version)
+    if verify and checksum(snapshot_dir(version)) != manifest.get("checksum"):
+        raise ValueError(f"snapshot {version} failed checksum verification")
+    tmp = CURRENT_PATH.with_suffix(".tmp")
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, CURRENT_PATH)
+    log.info(f"active snapshot -> {version}")
+
+
+def list_snapshots() -> List[Dict]:
+    """Manifests of all committed snapshots, oldest first."""
+    if not SNAPSHOTS_DIR.exists():
+        return []
+    manifests = []
+    for d in SNAPSHOTS_DIR.iterdir():
+        if d.is_dir() and not d.name.startswith(".") and (d / MANIFEST_FILE).exists():
+            manifests.append(read_manifest(d.name))
+    return sorted(manifests, key=lambda m: m["version"])
+
+
+def previous_version() -> Optional[str]:
+    """The snapshot committed just before the active one, if any."""
+    versions = [m["version"] for m in list_snapshots()]
+    active = current_version()
+    if active not in versions:
+        return None
+    pos = versions.index(active)
+    return versions[pos - 1] if pos > 0 else None
+
+
+def prune(keep: int = None):
+    """Delete all but the newest keep (default SNAPSHOT_KEEP) snapshots (never the active one) and stale staging dirs."""
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    active = current_version()
+    versions = [m["version"] for m in list_snapshots()]
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version != active:
+            shutil.rmtree(snapshot_dir(version), ignore_errors=True)
+    for d in SNAPSHOTS_DIR.glob(".*.tmp"):
+        if time.time() - d.stat().st_mtime > 3600:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+class LineStore:
+    """
+    Read-only corpus lines backed by memory-mapped arrays (see module docstring).
+    Rows are in citation order; get(id) maps a FAISS id back to its line.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._blob = np.memmap(directory / TEXTS_FILE, dtype=np.uint8, mode="r")
+        self.offsets = np.load(directory / OFFSETS_FILE, mmap_mode="r")
+        self.line_nos = np.load(directory / LINE_NOS_FILE, mmap_mode="r")
+        self.ids = np.load(directory / IDS_FILE, mmap_mode="r")
+        self._id_order = np.load(directory / ID_ORDER_FILE, mmap_mode="r")
+        # source file + line span per row (snapshots written before chunking have none)
+        self.spans = self.source_ids = None
+        self.sources = []
+        if (directory / SPANS_FILE).exists():
+            self.spans = np.load(directory / SPANS_FILE, mmap_mode="r")
+            self.source_ids = np.load(directory / SOURCE_IDS_FILE, mmap_mode="r")
+            self.sources = json.loads((directory / SOURCES_FILE).read_text(encoding="utf-8"))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def text(self, row: int) -> str:
+        return bytes(self._blob[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def row(self, row: int) -> Dict:
+        out = {"id": int(self.ids[row]), "line_no": int(self.line_nos[row]), "text": self.text(row)}
+        if self.spans is not None:
+            out.update(source=self.sources[self.source_ids[row]] or None,
+                       line_start=int(self.spans[row, 0]), line_end=int(self.spans[row, 1]))
+        return out
+
+    def row_of(self, doc_id: int) -> int:
+        pos = int(np.searchsorted(self.ids, doc_id, sorter=self._id_order))
+        if pos >= len(self._id_order) or self.ids[self._id_order[pos]] != doc_id:
+            raise KeyError(doc_id)
+        return int(self._id_order[pos])
+
+    def get(self, doc_id: int) -> Dict:
+        return self.row(self.row_of(doc_id))
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+
+class LegacyLineStore:
+    """LineStore interface over a pre-snapshot meta.pkl (trusted local file only)."""
+
+    def __init__(self, directory: Path):
+        with open(directory / LEGACY_META_FILE, "rb") as f:
+            self._meta = pickle.load(f)
+        # older storage used row positions as FAISS ids
+        self._by_id = {int(m.get("id", i)): i for i, m in enumerate(self._meta)}
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def row(self, row: int) -> Dict:
+        m = self._meta[row]
+        return {"id": int(m.get("id", row)), "line_no": int(m["line_no"]), "text": m["text"]}
+
+    def get(self, doc_id: int) -> Dict:
+        return self.row(self._by_id[doc_id])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+
+def open_lines(directory: Path):
+    """Open the line store in directory, whichever format it was written in."""
+    if (directory / TEXTS_FILE).exists():
+        return LineStore(directory)
+    if (directory / LEGACY_META_FILE).exists():
+        return LegacyLineStore(directory)
+    raise FileNotFoundError(f"Run ingest.py first to create the FAISS index and metadata in {STORAGE_DIR}/")
+
+
+class NpyAppender:
+    """
+    Write a .npy file of rows appended batch by batch, without holding them in memory:
+    rows go to a raw side file and are copied behind the .npy header on close().
+    """
+
+    def __init__(self, path: Path, dtype, row_shape: Tuple = ()):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self._part = self.path.with_name(self.path.name + ".part")
+        self._f = open(self._part, "wb")
+
+    def append(self, arr):
+        arr = np.ascontiguousarray(arr, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self._f.write(arr.tobytes())
+        self.rows += len(arr)
+
+    def close(self, block_rows: int = 1 << 16):
+        self._f.close()
+        out = np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype, shape=(self.rows,) + self.row_shape)
+        if self.rows:
+            raw = np.memmap(self._part, dtype=self.dtype, mode="r", shape=(self.rows,) + self.row_shape)
+            for i in range(0, self.rows, block_rows):
+                out[i:i + block_rows] = raw[i:i + block_rows]
+            del raw
+        out.flush()
+        del out
+        self._part.unlink()
+
+
+class LineWriter:
+    """
+    Stream rows into the line store files of a staged snapshot. Memory stays flat in the
+    number of rows except for the final id argsort (8 bytes per row).
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._texts = open(directory / TEXTS_FILE, "wb")
+        self._offsets = NpyAppender(directory / OFFSETS_FILE, np.int64)
+        self._offsets.append([0])
+        self._end = 0
+        self._line_nos = NpyAppender(directory / LINE_NOS_FILE, np.int64)
+        self._ids = NpyAppender(directory / IDS_FILE, np.int64)
+        self._spans = NpyAppender(directory / SPANS_FILE, np.int64, (2,))
+        self._source_ids = NpyAppender(directory / SOURCE_IDS_FILE, np.int32)
+        self._sources = {}
+
+    def append(self, rows: List[Dict]):
+        """rows: [{"id", "line_no", "text"} + optional "source", "line_start", "line_end"]."""
+        ends = []
+        for r in rows:
+            b = r["text"].encode("utf-8")
+            self._texts.write(b)
+            self._end += len(b)
+            ends.append(self._end)
+        self._offsets.append(ends)
+        self._line_nos.append([r["line_no"] for r in rows])
+        self._ids.append([r["id"] for r in rows])
+        self._spans.append([(r.get("line_start") or 0, r.get("line_end") or 0) for r in rows])
+        self._source_ids.append([self._sources.setdefault(r.get("source") or "", len(self._sources)) for r in rows])
+
+    def __len__(self) -> int:
+        return self._ids.rows
+
+    def close(self) -> int:
+        self._texts.close()
+        for appender in (self._offsets, self._line_nos, self._ids, self._spans, self._source_ids):
+            appender.close()
+        ids = np.load(self.directory / IDS_FILE)
+        np.save(self.directory / ID_ORDER_FILE, np.argsort(ids, kind="stable").astype(np.int64))
+        (self.directory / SOURCES_FILE).write_text(json.dumps(list(self._sources)), encoding="utf-8")
+        return len(ids)
+
+
+def write_lines(directory: Path, ids, line_nos, texts):
+    """Write the memory-mappable line store files for rows (ids[i], line_nos[i], texts[i])."""
+    writer = LineWriter(directory)
+    writer.append([{"id": int(i), "line_no": int(n), "text": t} for i, n, t in zip(ids, line_nos, texts)])
+    writer.close()
+
+
+def read_index(directory: Path):
+    """Load the FAISS index, memory-mapped when the index type supports it."""
+    path = str(directory / INDEX_FILE)
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) or faiss.IO_FLAG_MMAP
+    try:
+        return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def load_legacy(src: Path = STORAGE_DIR):
+    """
+    Read pre-snapshot storage (meta.pkl + embeddings.npy) as (rows, vectors) with rows
+    [{"id", "line_no", "text"}] under content-addressed ids. Repeated lines are kept once.
+    """
+    with open(src / LEGACY_META_FILE, "rb") as f:
+        meta = pickle.load(f)
+    vectors = np.load(src / EMB_FILE).astype("float32")
+    if len(vectors) != len(meta):
+        raise ValueError(f"{src}: {len(meta)} metadata rows but {len(vectors)} vectors")
+    faiss.normalize_L2(vectors)
+    rows, keep, seen = [], [], set()
+    for i, m in enumerate(meta):
+        doc_id = line_id(line_key(m["text"]))
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        rows.append({"id": doc_id, "line_no": int(m["line_no"]), "text": m["text"]})
+        keep.append(i)
+    return rows, vectors[keep]
+
+
+def convert_legacy(src: Path = STORAGE_DIR, model: str = None) -> Dict:
+    """
+    Convert pre-snapshot storage (faiss.index + meta.pkl + embeddings.npy) into a
+    snapshot in the current format and activate it. The index is rebuilt from the
+    stored vectors; nothing is re-encoded.
+    """
+    with write_lock():
+        return _convert_legacy(src, model)
+
+
+def _convert_legacy(src: Path, model: str = None) -> Dict:
+    rows, vectors = load_legacy(src)
+    ids = np.array([r["id"] for r in rows], dtype=np.int64)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    index.add_with_ids(vectors, ids)
+    version, staging = new_snapshot()
+    faiss.write_index(index, str(staging / INDEX_FILE))
+    np.save(staging / EMB_FILE, vectors)
+    write_lines(staging, ids, [r["line_no"] for r in rows], [r["text"] for r in rows])
+    from lexical import BM25Writer  # lexical imports this module
+    bm25 = BM25Writer(staging)
+    bm25.add([r["text"] for r in rows])
+    bm25.close()
+    manifest = commit_snapshot(version, staging, {"model": model, "dim": int(vectors.shape[1]), "lines": len(rows),
+                                                  "index_type": "flat", "format": STORE_FORMAT,
+                                                  "converted_from": str(src)})
+    log.info(f"converted {src} -> snapshot {version} ({len(rows)} lines)")
+    return manifest
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Inspect or convert corpus storage")
+    ap.add_argument("--convert", nargs="?", const=str(STORAGE_DIR), metavar="DIR",
+                    help="convert legacy meta.pkl storage in DIR (default storage/) into a snapshot")
+    ap.add_argument("--list", action="store_true", help="list snapshots")
+    args = ap.parse_args()
+    if args.convert:
+        convert_legacy(Path(args.convert))
+    if args.list or not args.convert:
+        active = current_version()
+        for m in list_snapshots():
+            print(("* " if m["version"] == active else "  ") + f"{m['version']}  lines={m.get('lines')}  dim={m.get('dim')}")
@@ -0,0 +1,201 @@
+# telemetry.py
+"""
+Logging and metrics for the service.
+
+Logging: modules log through get_logger(name); records go onto an in-memory queue
+(QueueHandler) and a single listener thread writes them to stdout, so request
+threads never block on the console. Lines keep the "[module] message" shape, with
+the request's trace id when one is set (see trace_context).
+
+Metrics: a small Prometheus text-format registry. Latency histograms are updated in
+place (STAGE_SECONDS, REQUEST_SECONDS); the counters modules already keep for /stats
+are exposed through register_collector callbacks. render() produces the /metrics body.
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # records dropped (not blocked on) beyond this
+
+# latency buckets in seconds: sub-ms FAISS lookups up to multi-second generations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+TRACE_ID = contextvars.ContextVar("trace_id", default=None)
+
+# ----- logging -----
+
+_listener = None
+_dropped = 0
+
+
+class _TraceFilter(logging.Filter):
+    """Adds the short module name and the current trace id (runs in the calling thread, before queueing)."""
+
+    def filter(self, record):
+        record.component = record.name.rsplit(".", 1)[-1]
+        trace = TRACE_ID.get()
+        record.trace = f" trace={trace}" if trace else ""
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def _setup():
+    global _listener
+    root = logging.getLogger("rag")
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("[%(component)s]%(trace)s %(message)s"))
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(_TraceFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(handler.queue, stream)
+    _listener.start()
+    atexit.register(_listener.stop)  # flushes what is still queued
+
+
+_setup()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"rag.{name}")
+
+
+@contextmanager
+def trace_context(trace_id: Optional[str]):
+    """Tag log lines emitted inside the block (including worker threads started via workers.run_in)."""
+    token = TRACE_ID.set(trace_id)
+    try:
+        yield
+    finally:
+        TRACE_ID.reset(token)
+
+@contextmanager
+def quiet_logs(level: int = logging.WARNING):
+    """Only log records at level or above inside the block (benchmarks timing the service)."""
+    root = logging.getLogger("rag")
+    previous = root.level
+    root.setLevel(level)
+    try:
+        yield
+    finally:
+        root.setLevel(previous)
+
+# ----- metrics -----
+
+Labels = Tuple[Tuple[str, str], ...]
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt(name: str, labels: Labels, value: float) -> str:
+    value = int(value) if float(value).is_integer() else repr(float(value))
+    if labels:
+        inner = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{inner}}} {value}"
+    return f"{name} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.doc = name, doc
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            for bound, count in zip(self.buckets, series):
+                yield _fmt(f"{self.name}_bucket", labels + (("le", f"{bound:g}"),), count)
+            yield _fmt(f"{self.name}_bucket", labels + (("le", "+Inf"),), series[-1])
+            yield _fmt(f"{self.name}_sum", labels, series[-2])
+            yield _fmt(f"{self.name}_count", labels, series[-1])
+
+
+class _Collector:
+    """Values read at scrape time from a callback yielding (labels dict or None, value) pairs."""
+
+    def __init__(self, name: str, kind: str, doc: str, fn: Callable[[], Iterable[Tuple[Optional[Dict], float]]]):
+        self.name, self.kind, self.doc, self.fn = name, kind, doc, fn
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self.fn():
+            yield _fmt(self.name, _labels(labels or {}), float(value))
+
+
+def _register(metric):
+    with _registry_lock:
+        if any(m.name == metric.name for m in _registry):
+            raise ValueError(f"metric {metric.name} already registered")
+        _registry.append(metric)
+
+
+def register_collector(name: str, kind: str, doc: str, fn: Callable[[], Iterable[Tuple[Optional[Dict], float]]]):
+    """kind is "counter" or "gauge"; fn yields (labels, value) pairs when /metrics is scraped."""
+    _register(_Collector(name, kind, doc, fn))
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# Wall time of each pipeline stage (lexical, encode, search, prompt, generate, verify) and of whole requests
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Wall time of one pipeline stage.")
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Wall time of a /chat request by the route that answered it.")
+register_collector("rag_log_records_dropped_total", "counter", "Log records dropped because the log queue was full.",
+                   lambda: [(None, _dropped)])
@@ -0,0 +1,109 @@
+# tests/conftest.py
+"""
+Shared fixtures. Storage goes to a temporary directory (never ./storage), and the
+embedder is a deterministic bag-of-words hash, so the suite needs neither the
+MiniLM model nor torch.
+"""
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp(prefix="rag-test-storage-"))
+
+import storage  # noqa: E402  (after STORAGE_DIR is set)
+
+DIM = 64
+
+
+class HashEmbedder:
+    """encode()-compatible embedder: each word hashes to one dimension, rows are L2-normalized."""
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIM
+
+    def encode(self, sentences, convert_to_numpy=True, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), DIM), dtype="float32")
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                out[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % DIM] += 1.0
+            out[i, 0] += 0.01  # no all-zero rows
+        out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out[0] if single else out
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    import embeddings
+    model = HashEmbedder()
+    monkeypatch.setattr(embeddings, "_load", lambda model_path: model)
+    return model
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    """An empty corpus store in tmp_path (storage.py's paths point there for the test)."""
+    monkeypatch.setattr(storage, "STORAGE_DIR", tmp_path)
+    monkeypatch.setattr(storage, "SNAPSHOTS_DIR", tmp_path / "snapshots")
+    monkeypatch.setattr(storage, "CURRENT_PATH", tmp_path / "CURRENT")
+    return tmp_path
+
+
+@pytest.fixture
+def corpus(storage_dir, embedder):
+    """A small ingested corpus; retrieval serves it."""
+    import ingest
+    import retrieval
+    lines = ["To return an item, go to Your Orders and choose Return or Replace Items.",
+             "Track your package from Your Orders by selecting Track Package.",
+             "Prime members get free two-day shipping on eligible items.",
+             "To cancel an order that has not shipped, open Your Orders and choose Cancel Items.",
+             "Sellers can list a new product from the Add a Product page in Seller Central."]
+    ingest.ingest_lines(lines)
+    retrieval.reload(force=True)
+    retrieval.clear_query_cache()
+    return lines
+
+
+@pytest.fixture
+def chat_app(corpus, monkeypatch):
+    """
+    main.APP over the test corpus, generating with the Ollama stub at 10 tokens/sec.
+    Fast paths and the answer cache are off so every question reaches the LLM.
+    Yields (main, backend, client) where client() opens an httpx client on the app.
+    """
+    import contextlib
+    from types import SimpleNamespace
+    import httpx
+    import generator
+    import main
+    import router
+    import verifier
+    from ollama_stub import start_stub_server
+
+    server, url = start_stub_server(tokens_per_sec=10)
+    backend = generator.HTTPBackend(base_url=url, retries=0)
+    monkeypatch.setattr(generator, "get_backend", lambda kind=None: backend)
+    monkeypatch.setattr(main, "CACHE_ENABLED", False)
+    monkeypatch.setattr(router, "FASTPATH_ENABLED", False)
+    monkeypatch.setattr(verifier, "LOCAL_VERIFY_ENABLED", False)
+
+    @contextlib.asynccontextmanager
+    async def client():
+        transport = httpx.ASGITransport(app=main.APP)
+        async with main.APP.router.lifespan_context(main.APP), \
+                httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as c:
+            yield c
+
+    yield SimpleNamespace(main=main, backend=backend, client=client)
+    backend.close()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,48 @@
+# tests/test_admin.py
+"""Admin endpoints: access control (fail closed) and rollback through the API."""
+import asyncio
+
+import httpx
+import pytest
+
+import main
+import retrieval
+import storage
+from ingest import ingest_lines
+
+
+def _request(method: str, path: str, host: str = "127.0.0.1", **kw):
+    async def run():
+        transport = httpx.ASGITransport(app=main.APP, client=(host, 51234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            return await c.request(method, path, **kw)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("method,path", [("GET", "/admin/snapshots"), ("POST", "/admin/rollback")])
+def test_without_a_token_only_loopback_clients_are_admitted(corpus, monkeypatch, method, path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    version = storage.current_version()
+    assert _request(method, path, host="203.0.113.7").status_code == 403
+    assert storage.current_version() == version
+    assert _request("GET", "/admin/snapshots").status_code == 200
+
+
+def test_with_a_token_it_is_required_from_everyone(corpus, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert _request("GET", "/admin/snapshots").status_code == 403
+    assert _request("GET", "/admin/snapshots", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    r = _request("GET", "/admin/snapshots", host="203.0.113.7", headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code == 200 and r.json()["active"] == storage.current_version()
+
+
+def test_rollback_restores_and_serves_the_previous_snapshot(corpus, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    v1 = storage.current_version()
+    ingest_lines(corpus[:1], mode="replace")
+    retrieval.reload()
+    r = _request("POST", "/admin/rollback")
+    assert r.status_code == 200 and r.json()["serving"]["version"] == v1
+    assert storage.current_version() == v1 and len(retrieval.current_snapshot().lines) == len(corpus)
+    r = _request("POST", "/admin/rollback", json={"version": "../etc"})
+    assert r.status_code == 400 and storage.current_version() == v1
@@ -0,0 +1,78 @@
+# tests/test_answer_cache.py
+"""AnswerCache: similarity threshold, LRU/TTL eviction and invalidation when the corpus changes."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache
+from ingest import ingest_lines
+
+DIM = 8
+
+
+def _vec(cos: float = 1.0, axis: int = 0) -> np.ndarray:
+    """Unit vector at cosine similarity cos to basis vector axis."""
+    v = np.zeros((1, DIM), dtype="float32")
+    v[0, axis] = cos
+    v[0, (axis + 1) % DIM] = np.sqrt(max(0.0, 1.0 - cos * cos))
+    return v
+
+
+@pytest.fixture
+def cache(storage_dir):
+    return AnswerCache(max_entries=3, ttl_seconds=60, max_distance=0.08)
+
+
+def test_hit_within_the_distance_and_miss_beyond_it(cache):
+    cache.put(_vec(axis=0), {"answer": "returns"})
+    assert cache.get(_vec(0.95, axis=0)) == {"answer": "returns"}  # distance 0.05
+    assert cache.get(_vec(0.90, axis=0)) is None                   # distance 0.10
+    assert cache.get(_vec(axis=3)) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_a_paraphrase_replaces_its_twin(cache):
+    cache.put(_vec(axis=0), {"answer": "old"})
+    cache.put(_vec(0.97, axis=0), {"answer": "new"})
+    assert cache.stats()["entries"] == 1
+    assert cache.get(_vec(axis=0)) == {"answer": "new"}
+
+
+def test_capacity_evicts_the_least_recently_used(cache):
+    for axis in range(3):
+        cache.put(_vec(axis=axis * 2), {"answer": axis})
+    assert cache.get(_vec(axis=0)) == {"answer": 0}  # now most recently used
+    cache.put(_vec(axis=6), {"answer": 3})
+    assert cache.get(_vec(axis=2)) is None            # the LRU entry went
+    assert cache.get(_vec(axis=0)) == {"answer": 0}
+    assert cache.stats()["entries"] == 3 and cache.evictions == 1
+
+
+def test_expired_entries_are_evicted(cache, monkeypatch):
+    import answer_cache
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    cache.put(_vec(axis=0), {"answer": "returns"})
+    now[0] += 59
+    assert cache.get(_vec(axis=0)) is not None
+    now[0] += 2
+    assert cache.get(_vec(axis=0)) is None
+    assert cache.stats()["entries"] == 0 and cache.evictions == 1
+
+
+def test_invalidate_drops_everything(cache):
+    cache.put(_vec(axis=0), {"answer": "returns"})
+    cache.invalidate()
+    assert cache.get(_vec(axis=0)) is None
+    assert cache.stats()["entries"] == 0 and cache.invalidations == 1
+
+
+def test_ingest_invalidates_the_cache(storage_dir, embedder):
+    ingest_lines(["To return an item, go to Your Orders."])
+    cache = AnswerCache()
+    cache.put(_vec(axis=0), {"answer": "returns"})
+    assert cache.get(_vec(axis=0)) is not None
+    ingest_lines(["Track your package from Your Orders."], mode="append")
+    assert cache.get(_vec(axis=0)) is None
+    assert cache.invalidations == 1
@@ -0,0 +1,112 @@
+# tests/test_batch.py
+"""batch.py: dedup, input order, and CLI checkpoint resume after an interruption; /chat/batch input checks."""
+import asyncio
+import json
+import sys
+
+import pytest
+
+import batch
+from workers import ADMISSION
+
+QUESTIONS = ["How do I return an item?",
+             "Track my package",
+             "how do i return an item",       # exact duplicate of 0 after normalizing
+             "hello",                          # greeting template
+             "an item: return how, do I?",     # same words as 0: cosine 1.0
+             "Redeem a gift card",
+             "Cancel an order",
+             "track MY package!!"]             # exact duplicate of 1
+
+
+@pytest.fixture
+def answered(corpus, monkeypatch):
+    """Questions answer_one was called for; answers are canned (no LLM)."""
+    calls = []
+
+    def fake_answer(query, q_emb, retrieved, is_ood, max_score):
+        calls.append(query)
+        return {"answer": f"answer to {query}", "verified": True, "is_ood": False, "max_score": max_score,
+                "sources": [], "route": "llm"}
+
+    monkeypatch.setattr(batch, "answer_one", fake_answer)
+    return calls
+
+
+def _items():
+    return [{"id": f"q{i}", "query": q} for i, q in enumerate(QUESTIONS)]
+
+
+def test_duplicates_are_answered_once_in_input_order(answered):
+    results = list(batch.run_batch(_items()))
+    assert [r["index"] for r in results] == list(range(len(QUESTIONS)))
+    assert [r["id"] for r in results] == [f"q{i}" for i in range(len(QUESTIONS))]
+    assert [r["duplicate_of"] for r in results] == [None, None, 0, None, 0, None, None, 1]
+    assert answered == [QUESTIONS[i] for i in (0, 1, 5, 6)]
+    assert results[2]["answer"] == results[4]["answer"] == results[0]["answer"]
+    assert results[3]["route"] == "greeting"
+
+
+def test_start_skips_earlier_questions(answered):
+    results = list(batch.run_batch(_items(), start=5))
+    assert [r["index"] for r in results] == [5, 6, 7]
+
+
+def _cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["batch.py", *map(str, args)])
+    batch.main()
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_cli_resumes_after_an_interruption(answered, tmp_path, monkeypatch):
+    src = tmp_path / "questions.jsonl"
+    src.write_text("\n".join(json.dumps(it) for it in _items()), encoding="utf-8")
+    out = tmp_path / "answers.ndjson"
+    run_batch = batch.run_batch
+
+    def interrupted(*args, **kw):
+        for n, result in enumerate(run_batch(*args, **kw)):
+            if n == 4:
+                raise KeyboardInterrupt
+            yield result
+
+    monkeypatch.setattr(batch, "run_batch", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _cli(monkeypatch, src, "--output", out)
+    assert [r["index"] for r in _lines(out)] == [0, 1, 2, 3]
+    with open(out, "ab") as f:
+        f.write(b'{"index": 4, "partial')  # written after the last checkpoint
+
+    monkeypatch.setattr(batch, "run_batch", run_batch)
+    _cli(monkeypatch, src, "--output", out)
+    results = _lines(out)
+    assert [r["index"] for r in results] == list(range(len(QUESTIONS)))
+    assert [r["query"] for r in results] == QUESTIONS
+    ckpt = json.loads((tmp_path / "answers.ndjson.ckpt").read_text(encoding="utf-8"))
+    assert ckpt["done"] == len(QUESTIONS) and ckpt["offset"] == out.stat().st_size
+
+
+def test_checkpoint_of_another_input_is_refused(answered, tmp_path, monkeypatch):
+    src = tmp_path / "questions.txt"
+    src.write_text("\n".join(QUESTIONS[:3]), encoding="utf-8")
+    out = tmp_path / "answers.ndjson"
+    _cli(monkeypatch, src, "--output", out)
+    src.write_text("\n".join(QUESTIONS[:4]), encoding="utf-8")
+    with pytest.raises(SystemExit, match="different input"):
+        _cli(monkeypatch, src, "--output", out)
+    _cli(monkeypatch, src, "--output", out, "--restart")
+    assert [r["query"] for r in _lines(out)] == QUESTIONS[:4]
+
+
+@pytest.mark.parametrize("params", [{"top_k": "five"}, {"start": "x"}, {"top_k": None}, {"top_k": 0}, {"start": -1}])
+def test_chat_batch_rejects_bad_top_k_and_start(chat_app, params):
+    async def run():
+        async with chat_app.client() as c:
+            return await c.post("/chat/batch", json={"queries": ["Track my package"], **params})
+
+    r = asyncio.run(run())
+    assert r.status_code == 400 and "error" in r.json()
+    assert ADMISSION.stats()["in_flight"] == 0
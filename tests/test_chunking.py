@@ -0,0 +1,69 @@
+# tests/test_chunking.py
+"""chunking.py: block grouping and split_text's size / overlap edge cases."""
+import pytest
+
+from chunking import count_tokens, iter_blocks, iter_chunks, split_text
+
+
+def _sentences(n: int):
+    return [f"Sentence number {i} is here." for i in range(1, n + 1)]  # 6 tokens each
+
+
+def test_blank_text_gives_no_chunks():
+    assert split_text("") == []
+    assert split_text("  \n ") == []
+    assert list(iter_chunks([(1, ""), (2, "   ")])) == []
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("Track your package.", max_tokens=10) == ["Track your package."]
+
+
+def test_chunks_respect_the_limit_and_carry_the_overlap():
+    chunks = split_text(" ".join(_sentences(7)), max_tokens=12, overlap=6)
+    assert all(count_tokens(c) <= 12 for c in chunks)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.startswith(prev.split(". ")[-1])  # the last sentence is repeated
+    assert chunks[0].startswith("Sentence number 1 ") and chunks[-1].endswith("number 7 is here.")
+
+
+def test_trailing_partial_chunk_is_kept():
+    sentences = _sentences(5)
+    chunks = split_text(" ".join(sentences), max_tokens=12, overlap=0)
+    assert chunks == [" ".join(sentences[0:2]), " ".join(sentences[2:4]), sentences[4]]
+
+
+def test_overlap_never_pushes_a_chunk_over_the_limit():
+    chunks = split_text(" ".join(_sentences(6)), max_tokens=12, overlap=12)
+    assert all(count_tokens(c) <= 12 for c in chunks)
+    assert all(f"number {i} " in " ".join(chunks) for i in range(1, 7))
+
+
+def test_token_longer_than_the_limit_is_its_own_chunk():
+    long_word = "-".join("abcdefgh")  # one word, 15 tokens
+    chunks = split_text(f"Go to {long_word} now. Then stop.", max_tokens=4, overlap=1)
+    assert long_word in chunks
+    assert all(count_tokens(c) <= 4 for c in chunks if c != long_word)
+    assert chunks[-1].endswith("stop.")
+
+
+def test_over_long_sentence_is_split_into_word_windows():
+    sentence = " ".join(f"w{i}" for i in range(20))  # no sentence boundary
+    chunks = split_text(sentence, max_tokens=8, overlap=2)
+    assert all(count_tokens(c) <= 8 for c in chunks)
+    assert chunks[0].split()[0] == "w0" and chunks[-1].split()[-1] == "w19"
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert prev.split()[-2:] == nxt.split()[:2]
+
+
+@pytest.mark.parametrize("unit,expected", [
+    ("line", [(1, 1, "a b"), (2, 2, "c"), (4, 4, "d")]),
+    ("paragraph", [(1, 2, "a b c"), (4, 4, "d")]),
+])
+def test_blocks_keep_their_line_spans(unit, expected):
+    assert list(iter_blocks([(1, "a b"), (2, " c "), (3, ""), (4, "d")], unit)) == expected
+
+
+def test_unknown_unit_is_rejected():
+    with pytest.raises(ValueError):
+        list(iter_blocks([(1, "a")], "page"))
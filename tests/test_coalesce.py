@@ -0,0 +1,231 @@
+# tests/test_coalesce.py
+"""SingleFlight (coalesce.py): leaders and followers, shared errors, takeover, handoff, shared streams."""
+import asyncio
+
+import pytest
+
+import deadlines
+from coalesce import LeaderAborted, SingleFlight
+from deadlines import RequestCancelled, request_deadline
+
+KEY = "how do i return an item"
+
+
+def _drained(sf: SingleFlight):
+    assert sf._calls == {} and sf._streams == {}
+    assert sf.stats()["in_flight"] == 0
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _collect(items):
+    return [item async for item in items]
+
+
+def test_identical_requests_share_one_call():
+    async def run():
+        sf = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        tasks = [asyncio.ensure_future(sf.do(KEY, work)) for _ in range(5)]
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*tasks)
+        assert len(calls) == 1
+        assert [r for r, _ in results] == ["answer"] * 5
+        assert sorted(shared for _, shared in results) == [False] + [True] * 4
+        assert sf.leaders == 1 and sf.followers == 4
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_leader_error_reaches_every_follower():
+    async def run():
+        sf = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise RuntimeError("ollama down")
+
+        tasks = [asyncio.ensure_future(sf.do(KEY, work)) for _ in range(4)]
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) and str(r) == "ollama down" for r in results)
+        assert sf.errors_shared == 3
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_follower_takes_over_from_a_cancelled_leader():
+    async def run():
+        sf = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(sf.do(KEY, work))
+        await _settle()
+        followers = [asyncio.ensure_future(sf.do(KEY, work)) for _ in range(3)]
+        await _settle()
+        leader.cancel()  # its client disconnected
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*followers)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert len(calls) == 2  # the cancelled leader's call, then one new leader
+        assert [r for r, _ in results] == ["answer"] * 3
+        assert sorted(shared for _, shared in results) == [False, True, True]
+        assert sf.takeovers == 1
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_cancelled_follower_does_not_take_over():
+    async def run():
+        sf = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(sf.do(KEY, work))
+        await _settle()
+        follower = asyncio.ensure_future(sf.do(KEY, work))
+        await _settle()
+        leader.cancel()
+        follower.cancel()
+        await asyncio.gather(leader, follower, return_exceptions=True)
+        assert follower.cancelled()
+        assert len(calls) == 1 and sf.takeovers == 0
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_handed_off_call_is_cancelled_when_the_last_follower_leaves():
+    async def run():
+        sf = SingleFlight()
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        async def work():
+            # stands in for a generation: the deadline's cancel hook stops it
+            with deadlines.on_cancel(lambda: loop.call_soon_threadsafe(stopped.set)):
+                await stopped.wait()
+            deadlines.check()
+            return "answer"
+
+        async def request(deadline_box):
+            with request_deadline() as deadline:
+                deadline_box.append(deadline)
+                return await sf.do(KEY, work)
+
+        leader_box = []
+        leader = asyncio.ensure_future(request(leader_box))
+        await _settle()
+        followers = [asyncio.ensure_future(request([])) for _ in range(2)]
+        await _settle()
+        leader_deadline = leader_box[0]
+        assert sf.handoff(KEY, leader_deadline)  # the leader's client is gone; followers still wait
+        assert not leader_deadline.cancelled
+        followers[0].cancel()
+        await _settle()
+        assert not stopped.is_set()  # one follower still waits
+        followers[1].cancel()
+        await asyncio.gather(*followers, return_exceptions=True)
+        with pytest.raises(RequestCancelled):
+            await leader
+        assert stopped.is_set()
+        assert leader_deadline.cancelled and leader_deadline.reason == "disconnected"
+        assert sf.handoffs == 1
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_only_the_leader_can_hand_off():
+    async def run():
+        sf = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "answer"
+
+        async def request(deadline_box):
+            with request_deadline() as deadline:
+                deadline_box.append(deadline)
+                return await sf.do(KEY, work)
+
+        leader_box, follower_box = [], []
+        tasks = [asyncio.ensure_future(request(leader_box))]
+        await _settle()
+        tasks.append(asyncio.ensure_future(request(follower_box)))
+        await _settle()
+        assert not sf.handoff(KEY, follower_box[0])
+        release.set()
+        await asyncio.gather(*tasks)
+        assert not sf.handoff(KEY, leader_box[0])  # finished: nothing to hand off
+        assert sf.handoffs == 0
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_stream_followers_replay_the_leaders_items():
+    async def run():
+        sf = SingleFlight()
+        step = asyncio.Event()
+
+        async def tokens():
+            for tok in ("Go ", "to ", "Your Orders."):
+                await step.wait()
+                yield tok
+
+        leader = asyncio.ensure_future(_collect(sf.lead(KEY, tokens())))
+        await _settle()
+        assert sf.streaming(KEY)
+        follower = asyncio.ensure_future(_collect(sf.follow(KEY)))
+        step.set()
+        assert await leader == await follower == ["Go ", "to ", "Your Orders."]
+        assert sf.leaders == 1 and sf.followers == 1
+        _drained(sf)
+    asyncio.run(run())
+
+
+def test_stream_followers_see_an_aborted_leader():
+    async def run():
+        sf = SingleFlight()
+        release = asyncio.Event()
+
+        async def tokens():
+            yield "Go "
+            await release.wait()
+            yield "never"
+
+        leader_items = sf.lead(KEY, tokens())
+        assert await leader_items.__anext__() == "Go "
+        follower = asyncio.ensure_future(_collect(sf.follow(KEY)))
+        await _settle()
+        await leader_items.aclose()  # the leader's client went away mid-stream
+        with pytest.raises(LeaderAborted):
+            await follower
+        assert sf.errors_shared == 1
+        _drained(sf)
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+# tests/test_context_packer.py
+"""context_packer.py: token budget, score-gap cutoff and near-duplicate removal."""
+import pytest
+
+from context_packer import _line_tokens, pack_context, score_cutoff
+
+
+TEXTS = ["Go to Your Orders and choose Return or Replace Items.",
+         "Track a package from Your Orders by selecting Track Package.",
+         "Prime members get free two-day shipping on eligible items.",
+         "Redeem a gift card under Your Account, then Gift Cards.",
+         "Cancel an order that has not shipped from Your Orders.",
+         "Sellers list a new product from the Add a Product page."]
+
+
+def _hits(scores, texts=TEXTS):
+    return [{"line_no": i + 1, "text": t, "score": s} for i, (s, t) in enumerate(zip(scores, texts))]
+
+
+@pytest.mark.parametrize("budget", [20, 45, 70, 1000])
+def test_packed_context_stays_within_the_budget(budget):
+    hits = _hits([0.80, 0.78, 0.77, 0.75, 0.74, 0.72])
+    kept, stats = pack_context(hits, budget=budget)
+    assert stats["tokens_used"] == sum(_line_tokens(r) for r in kept) <= budget
+    assert stats["tokens_saved"] == stats["tokens_in"] - stats["tokens_used"]
+    assert stats["lines_used"] + stats["dropped_gap"] + stats["dropped_duplicate"] + stats["dropped_budget"] == len(hits)
+
+
+def test_budget_keeps_the_highest_scoring_lines():
+    hits = _hits([0.80, 0.78, 0.77, 0.75, 0.74, 0.72])
+    kept, stats = pack_context(hits, budget=sum(_line_tokens(r) for r in hits[:3]))
+    assert [r["line_no"] for r in kept] == [1, 2, 3]
+    assert stats["dropped_budget"] == 3
+
+
+def test_first_line_is_kept_even_over_budget():
+    hits = _hits([0.9, 0.85])
+    kept, _ = pack_context(hits, budget=1)
+    assert [r["line_no"] for r in kept] == [1]
+
+
+def test_lines_after_a_score_gap_are_cut():
+    hits = _hits([0.82, 0.80, 0.55, 0.53])  # gap of 0.25 after the second line
+    kept, stats = pack_context(hits, budget=1000)
+    assert [r["line_no"] for r in kept] == [1, 2]
+    assert stats["dropped_gap"] == 2
+    assert score_cutoff([r["score"] for r in hits]) == pytest.approx(0.80)
+
+
+def test_relative_floor_cuts_weak_lines():
+    assert score_cutoff([0.8, 0.7, 0.6, 0.5, 0.39]) == pytest.approx(0.4)
+
+
+def test_near_duplicates_are_dropped():
+    texts = ["Go to Your Orders and choose Return or Replace Items.",
+             "Go to Your Orders, then choose Return or Replace Items.",
+             "Refunds are issued to the original payment method."]
+    kept, stats = pack_context(_hits([0.8, 0.79, 0.78], texts), budget=1000)
+    assert [r["text"] for r in kept] == [texts[0], texts[2]]
+    assert stats["dropped_duplicate"] == 1
+
+
+def test_hybrid_order_is_preserved():
+    hits = _hits([0.70, 0.81, 0.75])  # fused ranking is not score order
+    kept, _ = pack_context(hits, budget=1000)
+    assert [r["line_no"] for r in kept] == [1, 2, 3]
+
+
+def test_packing_off_keeps_everything(monkeypatch):
+    import context_packer
+    monkeypatch.setattr(context_packer, "CONTEXT_PACKING", False)
+    hits = _hits([0.9, 0.2])
+    kept, stats = pack_context(hits, budget=1)
+    assert kept == hits and stats["tokens_saved"] == 0
@@ -0,0 +1,114 @@
+# tests/test_deadlines.py
+"""Request deadlines end to end: REQUEST_TIMEOUT against a slow Ollama stub."""
+import asyncio
+import json
+import time
+
+import pytest
+
+import deadlines
+from coalesce import COALESCER
+from deadlines import DeadlineExceeded, Deadline, RequestCancelled
+from workers import ADMISSION
+
+QUERY = {"query": "how do I return an item"}
+
+
+@pytest.fixture
+def short_deadline(chat_app, monkeypatch):
+    monkeypatch.setattr(deadlines, "REQUEST_TIMEOUT", 0.5)  # generation at 10 tokens/sec takes ~2 s
+    return chat_app
+
+
+async def _released(backend, wait: float = 1.0):
+    """True once the admission slot and the backend's generation slot are both free again."""
+    end = time.monotonic() + wait
+    while time.monotonic() < end:
+        if ADMISSION.stats()["in_flight"] == 0 and backend._slots._value == backend._slots._initial_value:
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        out.append((fields.get("event"), json.loads(fields.get("data", "null"))))
+    return out
+
+
+def test_chat_returns_504_when_the_deadline_passes(short_deadline):
+    app = short_deadline
+
+    async def run():
+        before = deadlines.cancellation_stats()["deadline"]
+        async with app.client() as c:
+            t0 = time.monotonic()
+            r = await c.post("/chat", json=QUERY)
+            assert r.status_code == 504
+            assert time.monotonic() - t0 < 1.5
+            assert "deadline" in r.json()["error"]
+            # the running Ollama call was stopped, not left to finish
+            assert await _released(app.backend)
+        assert deadlines.cancellation_stats()["deadline"] == before + 1
+        assert COALESCER._calls == {}
+    asyncio.run(run())
+
+
+def test_stream_emits_an_error_event_when_the_deadline_passes(short_deadline):
+    app = short_deadline
+
+    async def run():
+        before = deadlines.cancellation_stats()["deadline"]
+        async with app.client() as c:
+            r = await c.post("/chat/stream", json=QUERY)
+            events = _events(r.text)
+            assert events[0][0] == "sources"
+            assert events[-1][0] == "error" and "deadline" in events[-1][1]["error"]
+            assert "done" not in [name for name, _ in events]
+            assert await _released(app.backend)
+        assert deadlines.cancellation_stats()["deadline"] == before + 1
+    asyncio.run(run())
+
+
+def test_chat_within_the_deadline_is_answered(chat_app, monkeypatch):
+    monkeypatch.setattr(deadlines, "REQUEST_TIMEOUT", 30)
+
+    async def run():
+        before = deadlines.cancellation_stats()
+        async with chat_app.client() as c:
+            r = await c.post("/chat", json=QUERY)
+        assert r.status_code == 200 and r.json()["route"] == "llm"
+        assert deadlines.cancellation_stats() == before
+        assert ADMISSION.stats()["in_flight"] == 0
+    asyncio.run(run())
+
+
+def test_cancel_runs_hooks_once_and_counts_once():
+    deadline = Deadline(30)
+    calls = []
+    before = deadlines.cancellation_stats()["disconnected"]
+    with deadline.on_cancel(lambda: calls.append(1)):
+        deadline.cancel("disconnected")
+        deadline.cancel("deadline")  # first reason wins
+    assert calls == [1] and deadline.reason == "disconnected"
+    assert deadlines.cancellation_stats()["disconnected"] == before + 1
+    with pytest.raises(RequestCancelled):
+        deadline.check()
+    with pytest.raises(RequestCancelled):  # registering on a cancelled deadline runs the hook at once
+        with deadline.on_cancel(lambda: calls.append(2)):
+            pass
+    assert calls == [1, 2]
+
+
+def test_armed_deadline_expires_and_follows_an_extension():
+    async def run():
+        deadline = Deadline(0.05)
+        deadline.arm()
+        deadline.extend(time.monotonic() + 0.2)
+        await asyncio.sleep(0.1)
+        assert not deadline.cancelled  # moved out before the first expiry
+        await asyncio.sleep(0.2)
+        assert deadline.cancelled and isinstance(deadline.error(), DeadlineExceeded)
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+# tests/test_evaluate.py
+"""evaluate.py: faithfulness retrieves the whole eval set with one batched search."""
+import evaluate
+import retrieval
+
+ITEMS = [{"query": "How do I return an item?"}, {"query": "Track my package"},
+         {"query": "What is the capital of France?", "ood": True}, {"query": "Cancel an order"}]
+
+
+def test_faithfulness_searches_the_eval_set_once(corpus, monkeypatch):
+    searches, generated = [], []
+    search_many = retrieval.search_many
+    monkeypatch.setattr(retrieval, "search", lambda *a, **kw: searches.append("search"))
+    monkeypatch.setattr(retrieval, "search_many", lambda queries, *a: searches.append(list(queries)) or search_many(queries, *a))
+
+    def fake_one(query, retrieved, limiter):
+        generated.append(query)
+        return {"verified": True, "fallback": False, "error": None, "seconds": 0.0}
+
+    monkeypatch.setattr(evaluate, "_faithfulness_one", fake_one)
+    report = evaluate.evaluate_faithfulness(ITEMS, top_k=3, threshold=0.0, concurrency=2, rate=0,
+                                            cache=evaluate.EvalCache("test", enabled=False))
+    in_domain = [it["query"] for it in ITEMS if not it.get("ood")]
+    assert searches == [in_domain]
+    assert sorted(generated) == sorted(in_domain)
+    assert report["queries"] == 3 and report["generated"] == 3 and report["verified_rate"] == 1.0
@@ -0,0 +1,86 @@
+# tests/test_generator_http.py
+"""HTTPBackend (generator.py) against the Ollama stub: connection pooling, retries, streaming."""
+import socket
+
+import pytest
+
+from generator import HTTPBackend, OllamaUnavailableError
+from ollama_stub import start_stub_server, stub_completion
+
+PROMPT = "CONTEXT:\n[12] Go to Your Orders and choose Return or Replace Items.\n\nUser Question:\nhow do I return an item?"
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server, url = start_stub_server()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def backend(stub):
+    backend = HTTPBackend(base_url=stub, retries=1)
+    yield backend
+    backend.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_generate_returns_completion(backend):
+    assert backend.generate(PROMPT) == stub_completion(PROMPT)
+
+
+def test_keep_alive_connection_is_reused(backend):
+    backend.generate(PROMPT)
+    assert backend._idle.qsize() == 1
+    conn = backend._idle.queue[-1]
+    sock = conn.sock
+    backend.generate(PROMPT)
+    assert backend._idle.qsize() == 1
+    assert backend._idle.queue[-1] is conn and conn.sock is sock
+
+
+def test_stale_pooled_connection_is_retried(backend):
+    backend.generate(PROMPT)
+    backend._idle.queue[-1].sock.shutdown(socket.SHUT_RDWR)  # as if the server closed the idle socket
+    assert backend.generate(PROMPT) == stub_completion(PROMPT)
+    assert backend._idle.qsize() == 1
+
+
+def test_unreachable_server_raises_after_retries():
+    backend = HTTPBackend(base_url=f"http://127.0.0.1:{_free_port()}", retries=1)
+    with pytest.raises(OllamaUnavailableError):
+        backend.generate(PROMPT)
+
+
+def test_stream_yields_completion_and_pools_connection(backend):
+    parts = list(backend.stream(PROMPT))
+    assert len(parts) > 1
+    assert "".join(parts) == stub_completion(PROMPT)
+    assert backend._idle.qsize() == 1
+
+
+def test_abandoned_stream_is_not_pooled(backend):
+    stream = backend.stream(PROMPT)
+    next(stream)
+    stream.close()
+    assert backend._idle.qsize() == 0
+    assert backend.generate(PROMPT) == stub_completion(PROMPT)
+
+
+def test_generate_timeout_leaves_server_usable(stub):
+    slow_server, slow_url = start_stub_server(tokens_per_sec=20)
+    try:
+        backend = HTTPBackend(base_url=slow_url, retries=0)
+        with pytest.raises(RuntimeError, match="timed out"):
+            backend.generate(PROMPT, timeout=0.1)
+        assert backend.generate(PROMPT) == stub_completion(PROMPT)
+        backend.close()
+    finally:
+        slow_server.shutdown()
+        slow_server.server_close()
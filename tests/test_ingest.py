@@ -0,0 +1,57 @@
+# tests/test_ingest.py
+"""ingest.py: concurrent ingests against the versioned store."""
+import threading
+import time
+
+import storage
+from ingest import ingest_lines
+
+
+def _texts():
+    return {r["text"] for r in storage.open_lines(storage.current_dir())}
+
+
+def test_concurrent_appends_both_survive(corpus, embedder, monkeypatch):
+    encode = embedder.encode
+
+    def slow_encode(sentences, **kw):
+        time.sleep(0.2)  # both ingests would read the same active snapshot without the lock
+        return encode(sentences, **kw)
+
+    monkeypatch.setattr(embedder, "encode", slow_encode)
+    uploads = [["Gift cards can be redeemed from Your Account under Gift Cards."],
+               ["Digital orders are listed under Your Content and Devices."]]
+    errors = []
+
+    def append(lines):
+        try:
+            ingest_lines(lines, mode="append")
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=append, args=(lines,)) for lines in uploads]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert _texts() == set(corpus) | {uploads[0][0], uploads[1][0]}
+    # the later snapshot was built on top of the earlier one
+    versions = [m["version"] for m in storage.list_snapshots()]
+    assert storage.read_manifest(versions[-1])["parent"] == versions[-2]
+
+
+def test_write_lock_is_exclusive(storage_dir):
+    order = []
+
+    def writer():
+        with storage.write_lock():
+            order.append("second")
+
+    with storage.write_lock():
+        t = threading.Thread(target=writer)
+        t.start()
+        time.sleep(0.1)
+        order.append("first")
+    t.join()
+    assert order == ["first", "second"]
@@ -0,0 +1,75 @@
+# tests/test_lexical.py
+"""lexical.py: CSR BM25 against a naive BM25, and the write/read round trip."""
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from lexical import BM25Index, BM25Writer, tokenize
+
+DOCS = ["Return an item from Your Orders: choose Return or Replace Items.",
+        "Track a package from Your Orders.",
+        "Gift card balance: redeem a gift card under Gift Cards.",
+        "Crocs sandals returns follow the standard return window.",
+        "Prime members get free shipping; Prime Video is included.",
+        "Sellers list products in Seller Central."]
+QUERIES = ["return item", "gift card", "prime shipping", "crocs", "orders package track", "seller central products"]
+
+
+def naive_bm25(docs, query, k1=1.2, b=0.75):
+    tokenized = [tokenize(d) for d in docs]
+    n = len(docs)
+    avgdl = sum(map(len, tokenized)) / n
+    df = Counter(t for toks in tokenized for t in set(toks))
+    scores = []
+    for toks in tokenized:
+        tf = Counter(toks)
+        score = 0.0
+        for t in set(tokenize(query)):
+            if tf[t]:
+                idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                score += idf * tf[t] * (k1 + 1) / (tf[t] + k1 * (1 - b + b * len(toks) / avgdl))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture
+def index(tmp_path):
+    writer = BM25Writer(tmp_path)
+    writer.add(DOCS[:4])
+    writer.add(DOCS[4:])  # postings of both batches are merged per term
+    writer.close()
+    return BM25Index.open(tmp_path)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_naive_bm25(index, query):
+    expected = naive_bm25(DOCS, query)
+    rows, scores, _ = index.search(query, k=len(DOCS))
+    got = dict(zip(rows.tolist(), scores.tolist()))
+    for row, score in enumerate(expected):
+        assert got.get(row, 0.0) == pytest.approx(score, rel=1e-5, abs=1e-6)
+    assert rows[0] == int(np.argmax(expected))
+
+
+def test_round_trip(index, tmp_path):
+    assert len(index.doc_len) == len(DOCS)
+    assert list(index.doc_len) == [len(tokenize(d)) for d in DOCS]
+    assert index.avgdl == pytest.approx(sum(len(tokenize(d)) for d in DOCS) / len(DOCS))
+    for term, t in index.terms.items():
+        postings = index.rows[index.indptr[t]:index.indptr[t + 1]]
+        assert list(postings) == [i for i, d in enumerate(DOCS) if term in tokenize(d)]
+        assert list(postings) == sorted(postings)
+        tfs = index.tf[index.indptr[t]:index.indptr[t + 1]]
+        assert list(tfs) == [tokenize(DOCS[r]).count(term) for r in postings]
+    assert not list(tmp_path.glob("*.tmp.npy"))
+
+
+def test_unknown_terms(index, tmp_path):
+    rows, scores, strength = index.search("zzz qqq", k=3)
+    assert len(rows) == 0 and strength == 0.0
+    _, _, full = index.search("crocs", k=1)
+    _, _, partial = index.search("crocs zzz", k=1)  # a term missing from the corpus weakens the match
+    assert partial < full <= 1.0
+    assert BM25Index.open(tmp_path / "missing") is None
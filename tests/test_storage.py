@@ -0,0 +1,181 @@
+# tests/test_storage.py
+"""storage.py: versioned snapshots, rollback and pruning, ingest deltas, and the on-disk line/vector formats."""
+import numpy as np
+import pytest
+
+import storage
+from ingest import ingest_lines
+
+LINES = ["To return an item, go to Your Orders and choose Return or Replace Items.",
+         "Track your package from Your Orders by selecting Track Package.",
+         "Prime members get free two-day shipping on eligible items."]
+
+
+def _texts(version=None):
+    directory = storage.snapshot_dir(version) if version else storage.current_dir()
+    return [r["text"] for r in storage.open_lines(directory)]
+
+
+def _vectors(version):
+    """{text: stored vector} of a snapshot."""
+    directory = storage.snapshot_dir(version)
+    vectors = np.load(directory / storage.EMB_FILE)
+    return {r["text"]: vectors[i] for i, r in enumerate(storage.open_lines(directory))}
+
+
+@pytest.fixture
+def encoded(embedder, monkeypatch):
+    """Texts the embedder was asked to encode."""
+    seen = []
+    encode = embedder.encode
+
+    def recording(sentences, **kw):
+        seen.extend([sentences] if isinstance(sentences, str) else sentences)
+        return encode(sentences, **kw)
+
+    monkeypatch.setattr(embedder, "encode", recording)
+    return seen
+
+
+def test_rollback_activates_the_previous_snapshot(storage_dir, embedder):
+    v1 = ingest_lines(LINES)["version"]
+    v2 = ingest_lines(LINES[:1], mode="replace")["version"]
+    assert storage.current_version() == v2 and _texts() == LINES[:1]
+    assert storage.previous_version() == v1
+    storage.activate(v1)
+    assert storage.current_version() == v1 and _texts() == LINES
+    assert storage.read_manifest(v2)["parent"] == v1
+
+
+def test_activate_rejects_a_modified_snapshot(storage_dir, embedder):
+    v1 = ingest_lines(LINES)["version"]
+    ingest_lines(LINES[:1], mode="replace")
+    with open(storage.snapshot_dir(v1) / storage.TEXTS_FILE, "ab") as f:
+        f.write(b"tampered")
+    with pytest.raises(ValueError, match="checksum"):
+        storage.activate(v1)
+    assert storage.current_version() != v1
+
+
+@pytest.mark.parametrize("version", ["", "../storage", "a/b", "a\\b", ".v1.tmp"])
+def test_read_manifest_rejects_invalid_versions(storage_dir, version):
+    with pytest.raises(ValueError, match="invalid snapshot version"):
+        storage.read_manifest(version)
+
+
+def test_prune_keeps_the_newest_and_the_active_snapshot(storage_dir, embedder):
+    versions = [ingest_lines(LINES[:n])["version"] for n in (1, 2, 3, 1)]
+    storage.activate(versions[0])
+    storage.prune(keep=2)
+    kept = [m["version"] for m in storage.list_snapshots()]
+    assert kept == [versions[0]] + versions[-2:]
+    assert storage.current_version() == versions[0]
+
+
+def test_commit_prunes_to_snapshot_keep(storage_dir, embedder, monkeypatch):
+    monkeypatch.setattr(storage, "SNAPSHOT_KEEP", 2)
+    versions = [ingest_lines(LINES[:n])["version"] for n in (1, 2, 3)]
+    assert [m["version"] for m in storage.list_snapshots()] == versions[-2:]
+
+
+def test_replace_reuses_unchanged_embeddings(storage_dir, encoded):
+    v1 = ingest_lines(LINES)["version"]
+    encoded.clear()
+    changed = LINES[:2] + ["Prime members get free same-day delivery in some cities."]
+    summary = ingest_lines(changed, mode="replace")
+    assert encoded == [changed[2]]
+    assert (summary["added"], summary["reused"], summary["removed"]) == (1, 2, 1)
+    before, after = _vectors(v1), _vectors(summary["version"])
+    for text in LINES[:2]:
+        assert np.array_equal(before[text], after[text])
+
+
+def test_append_encodes_only_new_lines(storage_dir, encoded):
+    v1 = ingest_lines(LINES[:2])["version"]
+    encoded.clear()
+    summary = ingest_lines(LINES, mode="append")  # two already stored, one new
+    assert encoded == [LINES[2]]
+    assert (summary["added"], summary["reused"]) == (1, 2)
+    assert _texts() == LINES
+    before, after = _vectors(v1), _vectors(summary["version"])
+    assert all(np.array_equal(before[t], after[t]) for t in LINES[:2])
+
+
+def test_delete_removes_lines_without_encoding(storage_dir, encoded):
+    v1 = ingest_lines(LINES)["version"]
+    encoded.clear()
+    summary = ingest_lines([LINES[1]], mode="delete")
+    assert encoded == []
+    assert (summary["added"], summary["removed"]) == (0, 1)
+    assert _texts() == [LINES[0], LINES[2]]
+    before, after = _vectors(v1), _vectors(summary["version"])
+    assert all(np.array_equal(before[t], after[t]) for t in (LINES[0], LINES[2]))
+
+
+def test_delete_of_every_line_is_refused(storage_dir, embedder):
+    v1 = ingest_lines(LINES[:1])["version"]
+    with pytest.raises(ValueError, match="empty"):
+        ingest_lines(LINES[:1], mode="delete")
+    assert storage.current_version() == v1
+
+
+ROWS = [{"id": 11, "line_no": 1, "text": "Return an item from Your Orders.", "source": "help.txt",
+         "line_start": 1, "line_end": 1},
+        {"id": 7, "line_no": 2, "text": "Rückgabe: Artikel innerhalb von 30 Tagen zurücksenden — 返品 ✓",
+         "source": "help_de.txt", "line_start": 4, "line_end": 6},
+        {"id": 42, "line_no": 3, "text": "Prime members get free shipping.", "source": None}]
+
+
+def test_line_store_round_trip(tmp_path):
+    writer = storage.LineWriter(tmp_path)
+    writer.append(ROWS[:2])
+    writer.append(ROWS[2:])  # a second batch continues the offsets
+    assert writer.close() == 3
+    lines = storage.LineStore(tmp_path)
+    assert len(lines) == 3
+    for i, r in enumerate(ROWS):
+        row = lines.row(i)
+        assert (row["id"], row["line_no"], row["text"]) == (r["id"], r["line_no"], r["text"])
+        assert row["source"] == r["source"]
+        assert lines.get(r["id"]) == row
+    sizes = [len(r["text"].encode("utf-8")) for r in ROWS]
+    assert list(lines.offsets) == [0, sizes[0], sizes[0] + sizes[1], sum(sizes)]
+    assert (lines.row(1)["line_start"], lines.row(1)["line_end"]) == (4, 6)
+    with pytest.raises(KeyError):
+        lines.get(12345)
+
+
+def test_npy_appender_round_trip(tmp_path):
+    path = tmp_path / "vectors.npy"
+    out = storage.NpyAppender(path, np.float32, (4,))
+    batches = [np.arange(8, dtype="float32").reshape(2, 4), np.ones((3, 4), dtype="float32")]
+    for batch in batches:
+        out.append(batch)
+    out.close(block_rows=2)  # copied in blocks smaller than the file
+    assert np.array_equal(np.load(path), np.vstack(batches))
+    assert not path.with_name(path.name + ".part").exists()
+
+    empty = storage.NpyAppender(tmp_path / "empty.npy", np.int64)
+    empty.close()
+    assert np.load(tmp_path / "empty.npy").shape == (0,)
+
+
+def test_convert_legacy_keeps_lines_and_embeddings(storage_dir):
+    import pickle
+    legacy = storage_dir / "legacy"
+    legacy.mkdir()
+    meta = [{"line_no": n, "text": t} for n, t in enumerate(LINES + ["Ünïcödé line ✓"], 1)]
+    vectors = np.random.default_rng(0).normal(size=(len(meta), 16)).astype("float32")
+    with open(legacy / storage.LEGACY_META_FILE, "wb") as f:
+        pickle.dump(meta, f)
+    np.save(legacy / storage.EMB_FILE, vectors)
+
+    manifest = storage.convert_legacy(legacy)
+    assert storage.current_version() == manifest["version"]
+    rows = list(storage.open_lines(storage.current_dir()))
+    assert [(r["line_no"], r["text"]) for r in rows] == [(m["line_no"], m["text"]) for m in meta]
+    assert [r["id"] for r in rows] == [storage.line_id(storage.line_key(m["text"])) for m in meta]
+    stored = np.load(storage.current_dir() / storage.EMB_FILE)
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert np.allclose(stored, expected, atol=1e-6)
+    assert [r["text"] for r in storage.LegacyLineStore(legacy)] == [r["text"] for r in rows]
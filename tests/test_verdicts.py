@@ -0,0 +1,71 @@
+# tests/test_verdicts.py
+"""Optimistic answers: the background verification holds the request's admission slot until it ends."""
+import asyncio
+import threading
+import time
+
+import deadlines
+from generator import FALLBACK_TEXT
+from verdicts import VERDICTS
+from workers import ADMISSION
+
+QUERY = {"query": "how do I return an item", "optimistic": True}
+
+
+async def _free(wait: float = 2.0):
+    end = time.monotonic() + wait
+    while time.monotonic() < end:
+        if ADMISSION.stats()["in_flight"] == 0:
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+def _optimistic_verdict(chat_app):
+    """POST an optimistic /chat; returns (answer, in_flight right after it, verdict, in_flight at the end)."""
+    async def run():
+        async with chat_app.client() as c:
+            r = (await c.post("/chat", json=QUERY)).json()
+            held = ADMISSION.stats()["in_flight"]
+            v = (await c.get(f"/chat/verdict/{r['response_id']}", params={"wait": 10})).json()
+            return r, held, v, await _free()
+    return asyncio.run(run())
+
+
+def test_slot_is_held_until_the_verdict(chat_app):
+    r, held, v, freed = _optimistic_verdict(chat_app)
+    assert r["verification"] == "verifying" and held == 1
+    assert v["verification"] == "verified"
+    assert freed
+
+
+def test_hung_verification_is_cancelled_after_its_budget(chat_app, monkeypatch):
+    monkeypatch.setattr(chat_app.main, "VERIFY_BUDGET", 0.3)
+    stopped = threading.Event()
+
+    def hung_verifier(query, retrieved, answer):
+        # a verifier LLM call that never answers; the deadline's cancel hook stops it
+        with deadlines.on_cancel(stopped.set):
+            stopped.wait(30)
+        deadlines.check()
+        return True, answer
+
+    monkeypatch.setattr(chat_app.main, "verify_answer", hung_verifier)
+    errors = VERDICTS.counts["errors"]
+    t0 = time.monotonic()
+    r, held, v, freed = _optimistic_verdict(chat_app)
+    assert held == 1
+    assert v["verification"] == "retracted" and v["answer"] == FALLBACK_TEXT
+    assert stopped.is_set() and time.monotonic() - t0 < 5
+    assert VERDICTS.counts["errors"] == errors + 1
+    assert freed
+
+
+def test_failed_verification_releases_the_slot(chat_app, monkeypatch):
+    def broken_verifier(query, retrieved, answer):
+        raise RuntimeError("verifier crashed")
+
+    monkeypatch.setattr(chat_app.main, "verify_answer", broken_verifier)
+    r, held, v, freed = _optimistic_verdict(chat_app)
+    assert v["verification"] == "retracted"
+    assert freed
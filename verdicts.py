@@ -0,0 +1,93 @@
+# verdicts.py
+"""
+Optimistic answers: deliver the generated answer at once, verify it afterwards.
+
+With OPTIMISTIC_VERIFY=1 (or "optimistic": true in the request body) a generated
+answer is sent as soon as generation ends, tagged "verification": "verifying", and
+verify_answer runs in the background. The verdict reaches the client
+  - on /chat: by polling GET /chat/verdict/{response_id}, which waits up to
+    VERDICT_WAIT seconds for a verification still running
+  - on /chat/stream: as a final "verdict" event after "done"
+A verdict is {"verification": "verified" | "retracted", "verified", "answer"}; a
+retracted answer (NO, or the verifier failed) comes back as FALLBACK_TEXT, which
+the UI shows in its place before opening the support modal. A verification still
+running after VERIFY_BUDGET seconds is cancelled and counts as retracted. Verdicts
+are kept VERDICT_TTL seconds.
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Optional, Tuple
+
+from generator import FALLBACK_TEXT
+from telemetry import get_logger
+
+log = get_logger("verdicts")
+
+OPTIMISTIC_VERIFY = os.environ.get("OPTIMISTIC_VERIFY", "0") == "1"
+VERDICT_TTL = float(os.environ.get("VERDICT_TTL", "300"))       # seconds a verdict stays pollable
+VERDICT_WAIT = float(os.environ.get("VERDICT_WAIT", "30"))      # longest a poll waits for a running verification
+VERIFY_BUDGET = float(os.environ.get("VERIFY_BUDGET", "60"))    # a background verification is cancelled after this
+VERDICT_MAX_ENTRIES = int(os.environ.get("VERDICT_MAX_ENTRIES", "10000"))
+
+
+def verdict(verified: bool, final: str) -> dict:
+    """The verdict event / poll result for verify_answer's (verified, final_answer)."""
+    return {"verification": "verified" if verified else "retracted", "verified": verified, "answer": final}
+
+
+class PendingVerdicts:
+    def __init__(self, ttl: float = VERDICT_TTL, max_entries: int = VERDICT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # response_id -> (created, task resolving to the verdict)
+        self.counts = {"verified": 0, "retracted": 0, "errors": 0}
+
+    def start(self, verify: Awaitable[Tuple[bool, str]]) -> str:
+        """Run verify (resolving to verify_answer's result) in the background; returns the response_id to poll."""
+        self._expire()
+        response_id = uuid.uuid4().hex
+        task = asyncio.ensure_future(self._run(response_id, verify))
+        self._entries[response_id] = (time.monotonic(), task)
+        return response_id
+
+    async def _run(self, response_id: str, verify) -> dict:
+        try:
+            verified, final = await verify
+        except Exception as e:
+            log.warning(f"background verification of {response_id} failed: {e}")
+            self.counts["errors"] += 1
+            verified, final = False, FALLBACK_TEXT
+        self.record(verified)
+        return {"response_id": response_id, **verdict(verified, final)}
+
+    def record(self, verified: bool):
+        self.counts["verified" if verified else "retracted"] += 1
+
+    async def get(self, response_id: str, wait: float = VERDICT_WAIT) -> Optional[dict]:
+        """The verdict, waiting up to wait seconds while it is still running; None if unknown or expired."""
+        self._expire()
+        entry = self._entries.get(response_id)
+        if entry is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(entry[1]), wait)
+        except asyncio.TimeoutError:
+            return {"response_id": response_id, "verification": "verifying", "verified": None}
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            response_id, (created, task) = next(iter(self._entries.items()))
+            if now - created < self.ttl and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[response_id]  # a verification still running finishes, it just can't be polled
+
+    def stats(self) -> dict:
+        return {"enabled": OPTIMISTIC_VERIFY, "pending": sum(not task.done() for _, task in self._entries.values()),
+                "kept": len(self._entries), **self.counts}
+
+
+VERDICTS = PendingVerdicts()
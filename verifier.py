@@ -1,23 +1,123 @@
 # verifier.py
+import os
+import re
+import threading
 from typing import List, Dict, Tuple
+
+from context_packer import pack_context
+from deadlines import RequestCancelled
 from generator import run_ollama_mistral, build_verification_prompt, FALLBACK_TEXT
+from telemetry import get_logger
+
+log = get_logger("verifier")
+
+# Tier 1 (local) thresholds on cosine similarity between answer sentences and retrieved lines.
+# Answers between the two go to the LLM verifier (tier 2).
+LOCAL_VERIFY_ENABLED = os.environ.get("LOCAL_VERIFY_ENABLED", "1") == "1"
+VERIFY_ACCEPT_SIM = float(os.environ.get("VERIFY_ACCEPT_SIM", "0.60"))  # every sentence at least this -> YES
+VERIFY_REJECT_SIM = float(os.environ.get("VERIFY_REJECT_SIM", "0.30"))  # mean support below this -> NO
+MIN_SENTENCE_WORDS = 4  # shorter sentences ("Hi there!", "Thanks.") carry no facts to check
+
+CITATION_RE = re.compile(r"\[(\d+)\]")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+VERDICT_RE = re.compile(r"^\W*(YES|NO)\b")
+
+_counts = {"local_yes": 0, "local_no": 0, "llm_yes": 0, "llm_no": 0, "llm_error": 0}
+_counts_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _counts_lock:
+        _counts[key] += 1
+
+
+def verifier_stats() -> Dict:
+    """How often each tier decided; local_* never reached the LLM."""
+    with _counts_lock:
+        stats = dict(_counts)
+    total = sum(stats.values())
+    stats["local_rate"] = (stats["local_yes"] + stats["local_no"]) / total if total else 0.0
+    return stats
+
+
+def _answer_sentences(answer: str) -> List[str]:
+    parts = [CITATION_RE.sub("", s).strip() for s in SENTENCE_SPLIT_RE.split(answer)]
+    return [s for s in parts if len(s.split()) >= MIN_SENTENCE_WORDS]
+
+
+def local_verdict(retrieved: List[Dict], answer: str) -> Tuple[str, Dict]:
+    """
+    Fast in-process grounding check against retrieved (the packed lines the answer was
+    generated from). Returns (decision, details) where decision is "yes", "no" or "uncertain".
+     - any [n] citation that is not a retrieved line -> "no"
+     - each answer sentence is scored by its best cosine similarity to a retrieved line;
+       all sentences >= VERIFY_ACCEPT_SIM -> "yes", mean < VERIFY_REJECT_SIM -> "no"
+    """
+    allowed = {int(r["line_no"]) for r in retrieved}
+    cited = {int(n) for n in CITATION_RE.findall(answer)}
+    bad = sorted(cited - allowed)
+    if bad:
+        return "no", {"reason": "unknown citations", "citations": bad}
+
+    sentences = _answer_sentences(answer)
+    if not sentences:
+        return "uncertain", {"reason": "no checkable sentences"}
+
+    from retrieval import encode_texts  # not at module level: ingest imports this before an index exists
+    vecs = encode_texts(sentences + [r["text"] for r in retrieved])
+    sims = vecs[:len(sentences)] @ vecs[len(sentences):].T
+    support = sims.max(axis=1)
+    details = {"min_support": float(support.min()), "mean_support": float(support.mean()), "sentences": len(sentences)}
+    if support.min() >= VERIFY_ACCEPT_SIM:
+        return "yes", details
+    if support.mean() < VERIFY_REJECT_SIM:
+        return "no", details
+    return "uncertain", details
+
 
 def verify_answer(query: str, retrieved: List[Dict], answer: str) -> Tuple[bool, str]:
     """
-    Ask the model whether its proposed answer relies only on the retrieved context.
+    Check that the proposed answer relies only on the retrieved context.
+    Tier 1 (local_verdict) decides confident cases in milliseconds; only uncertain
+    answers are sent to the model with build_verification_prompt.
     Returns (verified_boolean, final_answer). If verification fails or returns NO, final_answer is FALLBACK_TEXT.
     """
     if not retrieved:
         return False, FALLBACK_TEXT
-    ver_prompt = build_verification_prompt(query, retrieved, answer)
+    if answer.strip() == FALLBACK_TEXT:
+        return False, FALLBACK_TEXT
+
+    # Both tiers check against the lines the generation prompt actually contained
+    packed, _ = pack_context(retrieved)
+    if LOCAL_VERIFY_ENABLED:
+        try:
+            decision, details = local_verdict(packed, answer)
+        except Exception as e:
+            log.warning(f"local check failed, using LLM: {e}")
+            decision, details = "uncertain", {}
+        log.info(f"local verdict: {decision} {details}")
+        if decision == "yes":
+            _count("local_yes")
+            return True, answer
+        if decision == "no":
+            _count("local_no")
+            return False, FALLBACK_TEXT
+
+    ver_prompt = build_verification_prompt(query, retrieved, answer, packed)
     try:
         out = run_ollama_mistral(ver_prompt)
+    except RequestCancelled:
+        raise  # nobody is waiting for the verdict
     except Exception as e:
-        print(f"[verifier] verification failed: {e}")
+        log.warning(f"verification failed: {e}")
+        _count("llm_error")
         return False, FALLBACK_TEXT
     text = out.strip().upper()
-    print(f"[verifier] verification output: {text[:200]!r}")
-    if "YES" in text:
+    log.info(f"verification output: {text[:200]!r}")
+    m = VERDICT_RE.match(text)
+    if m and m.group(1) == "YES":
+        _count("llm_yes")
         return True, answer
     else:
+        _count("llm_no")
         return False, FALLBACK_TEXT
@@ -0,0 +1,154 @@
+# workers.py
+"""
+Executors and admission control for the /chat pipeline.
+
+Retrieval (SentenceTransformer encode + FAISS) and LLM calls are blocking, so the
+async endpoints hand them to dedicated thread pools instead of running them on the
+event loop. AdmissionController bounds how many chat requests run at once and how
+many may queue behind them; anything beyond that is rejected immediately.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from generator import OLLAMA_MAX_CONCURRENCY
+
+# Embedding + FAISS search. Threads here mostly wait on retrieval's micro-batcher,
+# so the pool should be at least as large as the batches we want to form.
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", "16"))
+# LLM calls mostly wait on Ollama; generation and verification may overlap.
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", str(2 * OLLAMA_MAX_CONCURRENCY)))
+# /chat/batch jobs: one thread per running job, which mostly waits on the job's own generation pool.
+BATCH_JOBS = int(os.environ.get("BATCH_JOBS", "2"))
+
+MAX_INFLIGHT = int(os.environ.get("MAX_INFLIGHT", "8"))   # chat requests running the pipeline
+MAX_QUEUE = int(os.environ.get("MAX_QUEUE", "32"))        # chat requests waiting for a slot
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "30"))
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", "2"))     # seconds, sent with 503s
+
+CPU_POOL = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+LLM_POOL = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_JOBS, thread_name_prefix="batch")
+
+_DONE = object()
+
+
+async def run_in(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+    """Run a blocking callable in pool and await its result (in a copy of the caller's context, so trace ids carry over)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    return await run_in(CPU_POOL, fn, *args, **kwargs)
+
+
+async def run_llm(fn, *args, **kwargs):
+    return await run_in(LLM_POOL, fn, *args, **kwargs)
+
+
+async def iterate_in(pool: ThreadPoolExecutor, iterator):
+    """
+    Async-iterate a blocking iterator, pulling each item in pool.
+    The underlying generator is closed (in pool) if the consumer stops early.
+    """
+    try:
+        while True:
+            item = await run_in(pool, next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                await run_in(pool, close)
+            except ValueError:  # still inside next() in pool (a cancelled request): it ends on its own
+                pass
+
+
+class OverloadedError(Exception):
+    """Raised when a request cannot be admitted; carries the Retry-After hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int = RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    """An admitted request's slot. release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    At most max_inflight requests run at once and at most max_queue wait for a slot.
+    A request that finds the queue full, or waits longer than queue_timeout, is
+    rejected with OverloadedError.
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._sem = None  # created lazily so it binds to the server's event loop
+
+    async def acquire(self) -> _Ticket:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_inflight)
+        if self.in_flight + self.waiting >= self.max_inflight + self.max_queue:
+            self.rejected += 1
+            raise OverloadedError(f"server busy: {self.in_flight} running, {self.waiting} queued")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise OverloadedError(f"server busy: no slot within {self.queue_timeout}s")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return _Ticket(self)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        ticket = await self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "admitted": self.admitted,
+                "rejected": self.rejected, "max_inflight": self.max_inflight, "max_queue": self.max_queue}
+
+
+ADMISSION = AdmissionController()
+
+
+def pool_stats() -> dict:
+    """Tasks waiting for a thread in each executor (the executor's internal work queue)."""
+    return {name: {"workers": pool._max_workers, "queued": pool._work_queue.qsize()}
+            for name, pool in (("search", CPU_POOL), ("llm", LLM_POOL), ("batch", BATCH_POOL))}